@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+from sqlalchemy.exc import IntegrityError
+from models import Agent, CacheVersion
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging
+import metrics
+
+# Set up logging
+logger = setup_logging("agent_cache", "agent_cache.log")
+
+CACHE_NAME = "agents"  # Row in cache_versions shared by every node
+VERSION_CHECK_INTERVAL = 5  # How often a node checks whether another node changed agents (seconds)
+
+# Cache metrics
+cache_hits = metrics.counter("agent_cache.hits", "Agent lookups served from memory")
+cache_misses = metrics.counter("agent_cache.misses", "Agent lookups that loaded from the database")
+cache_invalidations = metrics.counter("agent_cache.invalidations", "Times the agent cache was dropped, by reason")
+
+
+class AgentConfig:
+    """Read-only agent configuration with its JSON fields already parsed"""
+
+    __slots__ = ("agent_id", "name", "system_prompt", "initial_messages", "settings",
+                 "from_number", "created_at", "updated_at")
+
+    def __init__(self, agent):
+        self.agent_id = agent.agent_id
+        self.name = agent.name
+        self.system_prompt = agent.system_prompt
+        self.from_number = agent.from_number
+        self.created_at = agent.created_at
+        self.updated_at = agent.updated_at
+
+        try:
+            self.initial_messages = json.loads(agent.initial_messages or '[]')
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse initial_messages JSON for agent {agent.agent_id}")
+            self.initial_messages = []
+        try:
+            self.settings = json.loads(agent.settings or '{}')
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse settings JSON for agent {agent.agent_id}")
+            self.settings = {}
+
+    def to_dict(self):
+        """Same shape as Agent.to_dict()"""
+        return {
+            "agent_id": self.agent_id,
+            "name": self.name,
+            "system_prompt": self.system_prompt,
+            "initial_messages": self.initial_messages,
+            "settings": self.settings,
+            "from_number": self.from_number,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+def bump_version(db_session):
+    """
+    Mark agents as changed. Call inside the transaction that changes them, then
+    call agent_cache.invalidate() after the commit.
+    """
+    def increment():
+        return db_session.query(CacheVersion).filter_by(cache_name=CACHE_NAME).update(
+            {CacheVersion.version: CacheVersion.version + 1}, synchronize_session=False)
+
+    if increment():
+        return
+
+    # First change ever: create the row, unless another node just did
+    try:
+        with db_session.begin_nested():
+            db_session.add(CacheVersion(cache_name=CACHE_NAME, version=1))
+    except IntegrityError:
+        increment()
+
+
+def _read_version(db_session):
+    version = db_session.query(CacheVersion.version).filter_by(cache_name=CACHE_NAME).scalar()
+    return version or 0
+
+
+class AgentCache:
+    """
+    In-process cache of agent configurations.
+
+    Entries are valid for the version stamp they were loaded at. The stamp is
+    re-read at most every VERSION_CHECK_INTERVAL seconds, so lookups on the dial
+    path cost no database round trip, and a change made on another node is seen
+    within that interval.
+    """
+
+    def __init__(self, check_interval=VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.agents = {}
+        self.all_loaded = False
+        self.version = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def invalidate(self, reason="local change"):
+        with self.lock:
+            self.agents = {}
+            self.all_loaded = False
+            self.version = None
+            self.checked_at = 0
+        cache_invalidations.inc(label=reason)
+
+    def _check_version(self, db_session):
+        """Drop the cache if the shared version moved; returns the current version"""
+        version = _read_version(db_session)
+        with self.lock:
+            if self.version is not None and version != self.version:
+                self.agents = {}
+                self.all_loaded = False
+                cache_invalidations.inc(label="version changed")
+            self.version = version
+            self.checked_at = time.monotonic()
+        return version
+
+    def _fresh(self):
+        return self.version is not None and time.monotonic() - self.checked_at < self.check_interval
+
+    def get(self, agent_id):
+        """AgentConfig for an agent, or None if it does not exist"""
+        if not agent_id:
+            return None
+
+        with self.lock:
+            if self._fresh():
+                config = self.agents.get(agent_id)
+                if config is not None or self.all_loaded:
+                    cache_hits.inc()
+                    return config
+
+        cache_misses.inc()
+        db_session = get_db_session_with_retry()
+        try:
+            version = self._check_version(db_session)
+            with self.lock:
+                config = self.agents.get(agent_id)
+                if config is not None:
+                    return config
+
+            agent = db_session.query(Agent).filter_by(agent_id=agent_id).first()
+            if not agent:
+                return None
+
+            config = AgentConfig(agent)
+            with self.lock:
+                if self.version == version:
+                    self.agents[agent_id] = config
+            return config
+        finally:
+            close_db_session(db_session)
+
+    def get_all(self):
+        """AgentConfig for every agent"""
+        with self.lock:
+            if self._fresh() and self.all_loaded:
+                cache_hits.inc()
+                return list(self.agents.values())
+
+        cache_misses.inc()
+        db_session = get_db_session_with_retry()
+        try:
+            version = self._check_version(db_session)
+            with self.lock:
+                if self.all_loaded:
+                    return list(self.agents.values())
+
+            configs = [AgentConfig(agent) for agent in db_session.query(Agent).all()]
+            with self.lock:
+                if self.version == version:
+                    self.agents = {config.agent_id: config for config in configs}
+                    self.all_loaded = True
+            return configs
+        finally:
+            close_db_session(db_session)
+
+    def status(self):
+        with self.lock:
+            return {"agents": len(self.agents), "all_loaded": self.all_loaded, "version": self.version}
+
+
+# Shared agent cache
+agent_cache = AgentCache()
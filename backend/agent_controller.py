@@ -3,6 +3,7 @@ import logging
 import uuid
 from flask import Blueprint, request, jsonify
 from models import Agent
+from agent_cache import agent_cache, bump_version
 from database import get_db_session, close_db_session, get_db_session_with_retry
 from config import setup_logging
 
@@ -19,8 +20,7 @@ def get_agents():
     Get all agents
     """
     try:
-        db_session = get_db_session_with_retry()
-        agents = db_session.query(Agent).all()
+        agents = agent_cache.get_all()
 
         return jsonify({
             "status": "success",
@@ -32,8 +32,6 @@ def get_agents():
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        close_db_session(db_session)
 
 
 @agent.route('/agents/<agent_id>', methods=['GET'])
@@ -42,8 +40,7 @@ def get_agent(agent_id):
     Get a specific agent by ID
     """
     try:
-        db_session = get_db_session_with_retry()
-        agent = db_session.query(Agent).filter_by(agent_id=agent_id).first()
+        agent = agent_cache.get(agent_id)
 
         if not agent:
             return jsonify({
@@ -61,8 +58,6 @@ def get_agent(agent_id):
             "status": "error",
             "message": str(e)
         }), 500
-    finally:
-        close_db_session(db_session)
 
 
 @agent.route('/agents', methods=['POST'])
@@ -112,7 +107,9 @@ def create_agent():
         )
 
         db_session.add(new_agent)
+        bump_version(db_session)
         db_session.commit()
+        agent_cache.invalidate()
 
         logger.info(f"Created agent: {new_agent.agent_id}")
 
@@ -167,7 +164,9 @@ def update_agent(agent_id):
         if "from_number" in data:
             agent.from_number = data["from_number"]
 
+        bump_version(db_session)
         db_session.commit()
+        agent_cache.invalidate()
 
         logger.info(f"Updated agent: {agent_id}")
 
@@ -205,7 +204,9 @@ def delete_agent(agent_id):
 
         # Delete the agent
         db_session.delete(agent)
+        bump_version(db_session)
         db_session.commit()
+        agent_cache.invalidate()
 
         logger.info(f"Deleted agent: {agent_id}")
 
@@ -254,7 +255,9 @@ def duplicate_agent(agent_id):
         )
 
         db_session.add(new_agent)
+        bump_version(db_session)
         db_session.commit()
+        agent_cache.invalidate()
 
         logger.info(f"Duplicated agent {agent_id} to {new_agent_id}")
 
@@ -330,7 +333,9 @@ def bulk_import_agents():
                 db_session.add(new_agent)
                 imported_agents.append(new_agent.to_dict())
 
+        bump_version(db_session)
         db_session.commit()
+        agent_cache.invalidate()
 
         logger.info(f"Bulk imported {len(imported_agents)} agents")
 
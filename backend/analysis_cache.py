@@ -0,0 +1,130 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from models import AnalysisResult
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging
+import metrics
+
+# Set up logging
+logger = setup_logging("analysis_cache", "analysis_cache.log")
+
+MAX_MEMORY_ENTRIES = 2000  # Results kept in process
+
+# Cache metrics
+lookups = metrics.counter("analysis_cache.lookups", "Analysis memo lookups, by memory_hit/db_hit/miss")
+hit_rate = metrics.gauge("analysis_cache.hit_rate", "Share of analysis memo lookups answered without an LLM call")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_transcript(transcript):
+    """
+    Collapse whitespace only: numbers, case and punctuation can be customer
+    data (phone numbers, amounts, names), so only transcripts that match
+    exactly up to whitespace share a memoized result.
+    """
+    return _WHITESPACE.sub(" ", transcript).strip()
+
+
+def prompt_version(prompt):
+    """Short stable version of a prompt, so editing the prompt invalidates old results"""
+    return hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def content_hash(transcript, version, model):
+    # "exact" keeps these keys apart from the case/number-folded keys of earlier versions
+    key = f"exact\n{version}\n{model}\n{normalize_transcript(transcript)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Memoized analysis results keyed by content_hash(). Lookups check an
+    in-process LRU first and fall back to the analysis_results table, which is
+    shared by all nodes.
+    """
+
+    def __init__(self, max_entries=MAX_MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _remember(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _count(self, outcome):
+        lookups.inc(label=outcome)
+        total = lookups.total()
+        hit_rate.set(round((total - lookups.value("miss")) / total, 4) if total else 0)
+
+    def get(self, key):
+        """Stored result JSON for a content hash, or None"""
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+        if result is not None:
+            self._count("memory_hit")
+            return result
+
+        db_session = None
+        try:
+            db_session = get_db_session_with_retry()
+            result = db_session.query(AnalysisResult.result).filter_by(content_hash=key).scalar()
+        except Exception as e:
+            logger.error(f"Error reading analysis cache: {str(e)}")
+            result = None
+        finally:
+            if db_session:
+                close_db_session(db_session)
+
+        if result is None:
+            self._count("miss")
+            return None
+
+        self._remember(key, result)
+        self._count("db_hit")
+        return result
+
+    def put(self, key, result, version, model):
+        """Store a result; another node storing the same hash first is fine"""
+        self._remember(key, result)
+
+        db_session = None
+        try:
+            db_session = get_db_session_with_retry()
+            db_session.add(AnalysisResult(content_hash=key, prompt_version=version, model=model, result=result))
+            db_session.commit()
+        except IntegrityError:
+            db_session.rollback()
+        except Exception as e:
+            logger.error(f"Error writing analysis cache: {str(e)}")
+            if db_session:
+                db_session.rollback()
+        finally:
+            if db_session:
+                close_db_session(db_session)
+
+    def status(self):
+        with self.lock:
+            entries = len(self.entries)
+        total = lookups.total()
+        return {
+            "memory_entries": entries,
+            "lookups": total,
+            "memory_hits": lookups.value("memory_hit"),
+            "db_hits": lookups.value("db_hit"),
+            "misses": lookups.value("miss"),
+            "hit_rate": round((total - lookups.value("miss")) / total, 4) if total else None
+        }
+
+
+# Shared cache used by the extraction service
+analysis_cache = AnalysisCache()
@@ -1,17 +1,29 @@
 import requests
 import logging
 import traceback
-from flask import Blueprint, request, jsonify, current_app, Response
+from flask import Blueprint, request, jsonify, current_app, Response, send_file
 import plivo
 from config import ULTRAVOX_API_KEY, ULTRAVOX_API_BASE_URL, PLIVO_AUTH_ID, PLIVO_AUTH_TOKEN, setup_logging
-import openai
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import os
 import re
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 from models import CallLog, CallAnalytics, CallAnalysisStatus
 from database import get_db_session, close_db_session, get_db_session_with_retry
 from sqlalchemy import func
+from transcript_metrics import metrics_for_transcript, compute_campaign_metrics
+from campaign_rollup import update_rollup_for_call, rebuild_rollup, get_campaign_analytics
+from extraction_service import extraction_service, format_transcript, store_entities
+from transcript_classifier import classify_call
+from recording_cache import (recording_cache, cache_key as recording_cache_key, open_upstream, UpstreamError,
+                             content_type as recording_content_type, CHUNK_SIZE as RECORDING_CHUNK_SIZE,
+                             FETCH_TIMEOUT as RECORDING_FETCH_TIMEOUT)
+from recording_archiver import (recording_archiver, get_archived_recording, stable_url, holder_url,
+                                PROXIED_HEADER, ARCHIVE_DELAY as RECORDING_ARCHIVE_DELAY)
+from recording_peaks import ensure_peaks, read_peaks
+from transcript_search import index_transcript
+from data_archiver import find_call_log, find_call_analytics, is_archived
 
 # Set up logging
 logger = setup_logging("analysis_controller", "analysis_controller.log")
@@ -32,7 +44,7 @@ def get_call_transcription(call_id):
 
         # First check if we have this transcription cached in the database
         db_session = get_db_session_with_retry()
-        call_log = db_session.query(CallLog).filter_by(ultravox_id=call_id).first()
+        call_log = find_call_log(db_session, ultravox_id=call_id)
 
         # If we have the transcription cached and it's not requested to refresh
         if call_log and call_log.transcription and not request.args.get('refresh'):
@@ -75,6 +87,7 @@ def get_call_transcription(call_id):
         # Cache the transcription in the database if we have a call_log record
         if call_log:
             call_log.transcription = json.dumps(data)
+            index_transcript(db_session, call_log)
             db_session.commit()
             logger.info(f"Cached transcription for call ID: {call_id}")
 
@@ -102,11 +115,41 @@ def get_call_transcription(call_id):
             pass
 
 
+def _send_cached_recording(path, max_age=3600):
+    """Serve a cached recording; send_file handles Range/If-Range and uses sendfile where available"""
+    mimetype = recording_content_type(path)
+    filename = "recording.opus" if mimetype == "audio/ogg" else "recording.wav"
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=max_age, download_name=filename)
+    response.headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+def _recording_cache_key_for(call_id, url):
+    """Cache key for a proxied recording, or None unless `url` is the recording URL stored for the call"""
+    if not call_id:
+        return None
+    db_session = get_db_session_with_retry()
+    try:
+        call_log = find_call_log(db_session, ultravox_id=call_id)
+        if not call_log or call_log.recording_url != url:
+            return None
+        return recording_cache_key(call_id)
+    finally:
+        close_db_session(db_session)
+
+
 @analysis.route('/proxy_audio/<path:url>', methods=['GET'])
 def proxy_audio(url):
     """
     Proxy endpoint to avoid CORS issues with audio files
     Enhanced to better handle complex URLs with special characters and expired tokens
+
+    Recordings are kept in an on-disk LRU cache keyed by call ID (pass ?call_id=),
+    so repeat plays and seeks are served locally with Range support. The first play streams from upstream
+    while the file is written to the cache. The cache is only used when the URL is
+    the call's recorded recording_url, so it never stands in for an unknown or
+    forged signed URL; any other URL is relayed without caching.
     """
     try:
         logger.info(f"Proxying audio from URL: {url}")
@@ -124,34 +167,35 @@ def proxy_audio(url):
         # Remove any line breaks or extra whitespace
         decoded_url = decoded_url.strip()
 
-        # Set up request parameters with timeout and streaming
-        request_params = {
-            'stream': True,  # Enable streaming for large files
-            'timeout': 10,  # 10-second timeout to prevent hanging
-            'allow_redirects': True  # Follow redirects if needed
-        }
+        key = _recording_cache_key_for(request.args.get('call_id'), decoded_url)
+        cached_path = recording_cache.get(key) if key else None
+        if cached_path:
+            return _send_cached_recording(cached_path)
+
+        range_header = request.headers.get('Range')
+        partial = range_header and range_header.replace(' ', '') != 'bytes=0-'
 
         try:
             # Fetch the audio file with robust error handling
-            response = requests.get(decoded_url, **request_params)
+            response = open_upstream(decoded_url, range_header if partial else None)
 
-            if not response.ok:
-                logger.error(f"Error fetching audio: {response.status_code} - {response.reason}")
-                error_message = f"Failed to fetch audio: {response.status_code} - {response.reason}"
+        except UpstreamError as e:
+            logger.error(f"Error fetching audio: {str(e)}")
+            error_message = f"Failed to fetch audio: {str(e)}"
 
-                # Special handling for common problems with Google Cloud Storage URLs
-                needs_refresh = False
-                if response.status_code in [400, 401, 403, 404]:
-                    # These status codes commonly indicate expired tokens or invalid permissions
-                    needs_refresh = True
-                    error_message += " (URL may be expired)"
-                    logger.info("URL might be expired or invalid - client should refresh")
+            # Special handling for common problems with Google Cloud Storage URLs
+            needs_refresh = False
+            if e.status_code in [400, 401, 403, 404]:
+                # These status codes commonly indicate expired tokens or invalid permissions
+                needs_refresh = True
+                error_message += " (URL may be expired)"
+                logger.info("URL might be expired or invalid - client should refresh")
 
-                return jsonify({
-                    "status": "error",
-                    "message": error_message,
-                    "needsRefresh": needs_refresh
-                }), response.status_code
+            return jsonify({
+                "status": "error",
+                "message": error_message,
+                "needsRefresh": needs_refresh
+            }), e.status_code
 
         except requests.exceptions.Timeout:
             logger.error(f"Timeout when fetching audio")
@@ -173,20 +217,48 @@ def proxy_audio(url):
         # Including the Content-Disposition header to help with downloads
         headers = {
             'Content-Type': response.headers.get('Content-Type', 'audio/wav'),
-            'Content-Length': response.headers.get('Content-Length'),
             'Content-Disposition': 'inline; filename="recording.wav"',
             'Accept-Ranges': 'bytes',
             'Cache-Control': 'public, max-age=3600',
             'Access-Control-Allow-Origin': '*'  # Allow cross-origin access
         }
+        if response.headers.get('Content-Length'):
+            headers['Content-Length'] = response.headers['Content-Length']
+
+        if partial:
+            # A seek before the recording is cached: pass the range through from
+            # upstream and cache the whole file in the background for later seeks
+            if response.headers.get('Content-Range'):
+                headers['Content-Range'] = response.headers['Content-Range']
+            if key:
+                recording_cache.fetch_async(key, decoded_url)
+
+            def relay():
+                try:
+                    for chunk in response.iter_content(chunk_size=RECORDING_CHUNK_SIZE):
+                        yield chunk
+                finally:
+                    response.close()
+
+            return Response(relay(), headers=headers, status=response.status_code)
 
         # Log success with content type and size
         logger.info(
             f"Successfully proxying audio, content-type: {headers.get('Content-Type')}, size: {headers.get('Content-Length', 'unknown')}")
 
-        # Stream the response (using chunked transfer with reasonable chunk size)
+        if not key:
+            def relay():
+                try:
+                    for chunk in response.iter_content(chunk_size=RECORDING_CHUNK_SIZE):
+                        yield chunk
+                finally:
+                    response.close()
+
+            return Response(relay(), headers=headers, status=200)
+
+        # Stream the response in fixed-size chunks while writing it to the cache
         return Response(
-            response.iter_content(chunk_size=8192),  # Larger chunk size for better performance
+            recording_cache.stream_and_cache(key, response),
             headers=headers,
             status=200
         )
@@ -219,10 +291,18 @@ def get_call_recording(call_id):
 
         # First check if we have this recording URL cached in the database
         db_session = get_db_session_with_retry()
-        call_log = db_session.query(CallLog).filter_by(ultravox_id=call_id).first()
+        call_log = find_call_log(db_session, ultravox_id=call_id)
+
+        # An archived recording is served from our own stable endpoint, which does not expire
+        if call_log and get_archived_recording(db_session, call_log.id)[1]:
+            return jsonify({
+                "status": "success",
+                "url": request.host_url.rstrip('/') + stable_url(call_id),
+                "source": "archive"
+            })
 
         # If we have the recording URL cached and it's not requested to refresh
-        if call_log and call_log.recording_url and not force_refresh:
+        if call_log and call_log.recording_url and call_log.recording_url.startswith('http') and not force_refresh:
             logger.info(f"Using cached recording URL for call ID: {call_id}")
 
             return jsonify({
@@ -292,6 +372,141 @@ def get_call_recording(call_id):
         except:
             pass
 
+def _proxy_from_holder(url):
+    """Relay an archive response from the node holding the file, passing Range through"""
+    if request.headers.get(PROXIED_HEADER):
+        # Already forwarded once: the holder itself does not have the file
+        return jsonify({
+            "status": "error",
+            "message": "Archived recording is not available on the node holding it"
+        }), 404
+
+    forwarded = {PROXIED_HEADER: "1"}
+    if request.headers.get('Range'):
+        forwarded['Range'] = request.headers['Range']
+    try:
+        response = requests.get(url, headers=forwarded, stream=True, timeout=RECORDING_FETCH_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error reaching the node holding {url}: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": f"Node holding the recording is unreachable: {str(e)}"
+        }), 502
+
+    headers = {name: response.headers[name] for name in
+               ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Disposition', 'Accept-Ranges',
+                'Cache-Control', 'ETag', 'Last-Modified') if name in response.headers}
+    headers['Access-Control-Allow-Origin'] = '*'
+
+    def relay():
+        try:
+            for chunk in response.iter_content(chunk_size=RECORDING_CHUNK_SIZE):
+                yield chunk
+        finally:
+            response.close()
+
+    return Response(relay(), headers=headers, status=response.status_code)
+
+
+@analysis.route('/call_recording/<call_id>/audio', methods=['GET'])
+def get_archived_call_recording(call_id):
+    """
+    Stable URL for a call's recording. Serves the local archive copy (with Range
+    support), or relays it from the node holding it; a recording that is not
+    archived yet is queued for archiving and answered with 425.
+    """
+    db_session = None
+    try:
+        db_session = get_db_session_with_retry()
+        call_log = find_call_log(db_session, ultravox_id=call_id)
+        if not call_log:
+            return jsonify({
+                "status": "error",
+                "message": f"Call with ID {call_id} not found"
+            }), 404
+
+        call_log_id = call_log.id
+        path, archive = get_archived_recording(db_session, call_log_id)
+        if not path and archive:
+            return _proxy_from_holder(holder_url(archive, request.full_path.rstrip("?")))
+        if not path:
+            # Archiving downloads and may transcode the recording, so it runs on the archiver's
+            # workers; a call that ended too recently is left to the sweep, after ARCHIVE_DELAY
+            if call_log.end_time and call_log.end_time <= datetime.now() - timedelta(seconds=RECORDING_ARCHIVE_DELAY):
+                recording_archiver.enqueue(call_log_id)
+            return jsonify({
+                "status": "error",
+                "message": "Recording is being archived, try again shortly"
+            }), 425
+
+        return _send_cached_recording(path, max_age=86400)
+    except Exception as e:
+        logger.error(f"Error in get_archived_call_recording: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        if db_session:
+            close_db_session(db_session)
+
+
+@analysis.route('/call_recording/<call_id>/peaks', methods=['GET'])
+def get_call_recording_peaks(call_id):
+    """
+    Waveform peaks for an archived recording, so the player can draw the call
+    before (or without) downloading the audio. Returns JSON by default, or the
+    compact binary peaks file with ?format=binary.
+    """
+    db_session = None
+    try:
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'binary'):
+            return jsonify({
+                "status": "error",
+                "message": "format must be 'json' or 'binary'"
+            }), 400
+
+        db_session = get_db_session_with_retry()
+        call_log = find_call_log(db_session, ultravox_id=call_id)
+        if not call_log:
+            return jsonify({
+                "status": "error",
+                "message": f"Call with ID {call_id} not found"
+            }), 404
+
+        path, archive = get_archived_recording(db_session, call_log.id)
+        if not path and archive:
+            return _proxy_from_holder(holder_url(archive, request.full_path.rstrip("?")))
+        if not path:
+            return jsonify({
+                "status": "error",
+                "message": "Recording has not been archived yet"
+            }), 404
+
+        # Normally written when the recording was archived; older archives get theirs now
+        peaks_file = ensure_peaks(path)
+
+        if output_format == 'binary':
+            response = send_file(peaks_file, mimetype="application/octet-stream", conditional=True, max_age=86400)
+        else:
+            response = jsonify({"status": "success", **read_peaks(peaks_file)})
+            response.headers['Cache-Control'] = 'public, max-age=86400'
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        return response
+    except Exception as e:
+        logger.error(f"Error in get_call_recording_peaks: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        if db_session:
+            close_db_session(db_session)
+
+
 @analysis.route('/call_analytics/<call_id>/<call_uuid>', methods=['GET'])
 def get_call_analytics(call_id, call_uuid):
     """
@@ -303,15 +518,15 @@ def get_call_analytics(call_id, call_uuid):
 
         # First check if we have this analytics data cached
         db_session = get_db_session_with_retry()
-        call_log = db_session.query(CallLog).filter_by(ultravox_id=call_id, call_uuid=call_uuid).first()
+        call_log = find_call_log(db_session, ultravox_id=call_id, call_uuid=call_uuid)
 
         # If call doesn't exist in our DB by Ultravox ID, try by call UUID
         if not call_log:
-            call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
+            call_log = find_call_log(db_session, call_uuid=call_uuid)
 
         # And if that doesn't work, try by Ultravox ID only
         if not call_log:
-            call_log = db_session.query(CallLog).filter_by(ultravox_id=call_id).first()
+            call_log = find_call_log(db_session, ultravox_id=call_id)
 
         analytics_data = {
             "ultravox": None,
@@ -490,43 +705,18 @@ def get_call_analytics(call_id, call_uuid):
         # Add combined stats
         analytics_data["combined"] = combined_stats
 
-        # Store analytics in CallAnalytics if we have a call_log record
-        if call_log and call_log.id:
+        # Store analytics in CallAnalytics if we have a call_log record (archived calls are not re-analysed)
+        if call_log and call_log.id and not is_archived(call_log):
             try:
                 # Check if analytics record exists
                 analytics_record = db_session.query(CallAnalytics).filter_by(call_id=call_log.id).first()
 
                 if not analytics_record:
-                    # Calculate additional metrics if possible
-                    total_messages = 0
-                    agent_messages = 0
-                    user_messages = 0
-                    agent_response_length = 0
-                    user_response_length = 0
-
+                    # Calculate transcript metrics if possible
+                    message_stats = metrics_for_transcript(None)
                     if call_log.transcription:
                         try:
-                            transcription_data = json.loads(call_log.transcription)
-                            messages = transcription_data.get("results", [])
-
-                            # Count messages by role
-                            total_messages = len(messages)
-                            agent_messages = sum(
-                                1 for msg in messages if msg.get("role") in ["MESSAGE_ROLE_AGENT", "assistant"])
-                            user_messages = sum(
-                                1 for msg in messages if msg.get("role") in ["MESSAGE_ROLE_USER", "user"])
-
-                            # Calculate average response length
-                            agent_texts = [msg.get("text", "") for msg in messages if
-                                           msg.get("role") in ["MESSAGE_ROLE_AGENT", "assistant"] and msg.get("text")]
-                            user_texts = [msg.get("text", "") for msg in messages if
-                                          msg.get("role") in ["MESSAGE_ROLE_USER", "user"] and msg.get("text")]
-
-                            if agent_texts:
-                                agent_response_length = sum(len(text) for text in agent_texts) // len(agent_texts)
-
-                            if user_texts:
-                                user_response_length = sum(len(text) for text in user_texts) // len(user_texts)
+                            message_stats = metrics_for_transcript(call_log.transcription)
                         except Exception as e:
                             logger.warning(f"Error calculating message statistics: {str(e)}")
 
@@ -534,11 +724,12 @@ def get_call_analytics(call_id, call_uuid):
                     new_analytics = CallAnalytics(
                         call_id=call_log.id,
                         total_duration=combined_stats.get("total_duration"),
-                        total_messages=total_messages,
-                        agent_messages=agent_messages,
-                        user_messages=user_messages,
-                        avg_agent_response_length=agent_response_length,
-                        avg_user_response_length=user_response_length,
+                        total_messages=message_stats["total_messages"],
+                        agent_messages=message_stats["agent_messages"],
+                        user_messages=message_stats["user_messages"],
+                        avg_agent_response_length=message_stats["avg_agent_response_length"],
+                        avg_user_response_length=message_stats["avg_user_response_length"],
+                        transcript_metrics=json.dumps(message_stats) if call_log.transcription else None,
                         call_success=True if call_log.call_state == 'ANSWER' else False
                     )
 
@@ -550,6 +741,8 @@ def get_call_analytics(call_id, call_uuid):
                     analytics_record.total_duration = combined_stats.get("total_duration")
                     db_session.commit()
                     logger.info(f"Updated analytics record for call ID: {call_log.id}")
+
+                update_rollup_for_call(db_session, call_log.id)
             except Exception as e:
                 logger.error(f"Error storing call analytics: {str(e)}")
                 logger.error(traceback.format_exc())
@@ -574,10 +767,88 @@ def get_call_analytics(call_id, call_uuid):
             pass
 
 
+@analysis.route('/campaigns/<int:campaign_id>/transcript_metrics', methods=['POST'])
+def campaign_transcript_metrics(campaign_id):
+    """
+    Compute transcript metrics (turns, talk ratio, response lengths, silence gaps)
+    for every transcribed call of a campaign, store them in CallAnalytics and
+    return the campaign-wide distributions. Pass ?write=false to only compute.
+    """
+    try:
+        write = request.args.get('write', 'true').lower() != 'false'
+        aggregate = compute_campaign_metrics(campaign_id, write=write)
+
+        if write:
+            # Bulk-written durations bypass the per-call rollup updates
+            db_session = get_db_session_with_retry()
+            try:
+                rebuild_rollup(db_session, campaign_id)
+            finally:
+                close_db_session(db_session)
+
+        return jsonify({
+            "status": "success",
+            "campaign_id": campaign_id,
+            "metrics": aggregate
+        })
+    except Exception as e:
+        logger.error(f"Error in campaign_transcript_metrics: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+
+@analysis.route('/campaigns/<int:campaign_id>/analytics', methods=['GET'])
+def campaign_analytics(campaign_id):
+    """
+    Campaign-level analysis rollup: sentiment distribution, top topics, outcome
+    funnel and duration percentiles. The rollup is updated as each call's
+    analysis is stored; pass ?rebuild=true to recompute it from all calls.
+    """
+    db_session = None
+    try:
+        db_session = get_db_session_with_retry()
+        top_topics = request.args.get('top_topics', 10, type=int)
+        rebuild = request.args.get('rebuild', 'false').lower() == 'true'
+
+        return jsonify({
+            "status": "success",
+            "analytics": get_campaign_analytics(db_session, campaign_id, top_topics=top_topics, rebuild=rebuild)
+        })
+    except Exception as e:
+        logger.error(f"Error in campaign_analytics: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        if db_session:
+            close_db_session(db_session)
+
+
+@analysis.route('/campaigns/<int:campaign_id>/extraction_stats', methods=['GET'])
+def campaign_extraction_stats(campaign_id):
+    """
+    Entity extraction throughput, token usage and cost for a campaign, as seen
+    by this process, plus the extraction queue status.
+    """
+    return jsonify({
+        "status": "success",
+        "campaign_id": campaign_id,
+        "extraction": extraction_service.campaign_stats(campaign_id),
+        "service": extraction_service.status()
+    })
+
+
 @analysis.route('/analyze_transcript/<call_id>', methods=['GET'])
 def analyze_transcript(call_id):
     """
-    Analyze a call transcript using OpenAI and store results
+    Analyze a call transcript using OpenAI and store results.
+    ?refresh re-runs the analysis, reusing a memoized result for an identical
+    transcript; ?recompute also bypasses the memo and the rule-based classifier.
     """
     try:
         logger.info(f"Analyzing transcript for call ID: {call_id}")
@@ -592,7 +863,7 @@ def analyze_transcript(call_id):
 
         # Get the call transcript
         db_session = get_db_session_with_retry()
-        call_log = db_session.query(CallLog).filter_by(ultravox_id=call_id).first()
+        call_log = find_call_log(db_session, ultravox_id=call_id)
 
         if not call_log:
             return jsonify({
@@ -620,31 +891,17 @@ def analyze_transcript(call_id):
             # Parse the response
             data = response.json()
             call_log.transcription = json.dumps(data)
+            index_transcript(db_session, call_log)
             db_session.commit()
 
         # Parse the transcript
         try:
-            transcript_data = json.loads(call_log.transcription)
-            messages = transcript_data.get("results", [])
-
-            if not messages:
-                return jsonify({
-                    "status": "error",
-                    "message": "No messages found in transcript"
-                }), 404
-
-            # Format the transcript for analysis
-            formatted_transcript = ""
-            for msg in messages:
-                role = "Agent" if msg.get("role") in ["MESSAGE_ROLE_AGENT", "assistant"] else "Customer"
-                text = msg.get("text", "")
-                if text:
-                    formatted_transcript += f"{role}: {text}\n\n"
+            formatted_transcript = format_transcript(call_log.transcription)
 
             # Get existing analytics
             analytics_record = None
             if call_log.id:
-                analytics_record = db_session.query(CallAnalytics).filter_by(call_id=call_log.id).first()
+                analytics_record = find_call_analytics(db_session, call_log.id)
 
             # Check if we already have entity analysis
             if analytics_record and analytics_record.entities_extracted and not request.args.get('refresh'):
@@ -657,53 +914,45 @@ def analyze_transcript(call_id):
                     "source": "cache"
                 })
 
-            # Use OpenAI to analyze the transcript
-            client = openai.OpenAI(api_key=openai_api_key)
-
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": """You are an expert at analyzing call transcripts. 
-                    Extract key information from this conversation between an Agent and a Customer.
-                    Return the results as a JSON object with the following fields:
-                    - customer_name: Extracted customer name, or null if not mentioned
-                    - contact_details: Extracted phone number or email, or null if not mentioned
-                    - topics: List of main topics discussed
-                    - products_mentioned: List of products or services mentioned
-                    - customer_needs: List of customer needs or pain points expressed
-                    - sentiment: Overall customer sentiment (positive, neutral, negative, mixed)
-                    - financial_figures: Any prices, costs, budgets mentioned
-                    - follow_up_actions: List of required follow-up actions
-
-                    Follow these rules:
-                    - Use null for fields where no information is available
-                    - Be concise and direct in your extraction
-                    - Format as valid JSON only, without explanation
-                    - Only include information explicitly mentioned in the transcript"""},
-                    {"role": "user", "content": formatted_transcript}
-                ],
-                temperature=0.2,
-                response_format={"type": "json_object"}
-            )
+            # Voicemail, wrong numbers and calls without a conversation are
+            # labelled locally; only substantive conversations go to the LLM
+            recompute = request.args.get('recompute')
+            rule_result = None if recompute else classify_call(call_log)
+            if rule_result:
+                if not is_archived(call_log):
+                    store_entities(db_session, call_log, rule_result)
+                return jsonify({
+                    "status": "success",
+                    "analysis": json.loads(rule_result),
+                    "source": "rules"
+                })
 
-            # Parse the response
-            analysis_result = response.choices[0].message.content
+            if not formatted_transcript:
+                return jsonify({
+                    "status": "error",
+                    "message": "No messages found in transcript"
+                }), 404
+
+            # Extract entities through the shared, rate limited extraction service
+            try:
+                analysis_result = extraction_service.extract(
+                    formatted_transcript,
+                    call_id=call_log.id,
+                    campaign_id=call_log.campaign_id,
+                    api_key=openai_api_key,
+                    use_cache=not recompute
+                )
+            except FutureTimeoutError:
+                return jsonify({
+                    "status": "error",
+                    "message": "Timed out waiting for transcript analysis"
+                }), 504
             entity_data = json.loads(analysis_result)
 
             # Store the results in the database
-            if analytics_record:
-                analytics_record.entities_extracted = analysis_result
-                db_session.commit()
+            if call_log.id and not is_archived(call_log):
+                store_entities(db_session, call_log, analysis_result)
                 logger.info(f"Cached entity analysis for call ID: {call_id}")
-            elif call_log.id:
-                # Create a new analytics record
-                new_analytics = CallAnalytics(
-                    call_id=call_log.id,
-                    entities_extracted=analysis_result
-                )
-                db_session.add(new_analytics)
-                db_session.commit()
-                logger.info(f"Created analytics record with entity analysis for call ID: {call_log.id}")
 
             return jsonify({
                 "status": "success",
@@ -751,7 +1000,7 @@ def get_call_analysis_status(call_uuid):
             })
 
         # If no status record, check if call exists and create a record on the fly
-        call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
+        call_log = find_call_log(db_session, call_uuid=call_uuid)
 
         if not call_log:
             return jsonify({
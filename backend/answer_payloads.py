@@ -0,0 +1,115 @@
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+PAYLOAD_TTL = 600  # How long a prepared payload waits for its call to be answered (seconds)
+MAX_PREPARED_CALLS = 5000  # Upper bound on prepared payloads held in memory
+MAX_TEMPLATES = 256  # Upper bound on distinct agent templates held in memory
+_MAX_DURATION_SLOT = f"__max_duration_{uuid.uuid4().hex}__"  # Placeholder that cannot occur in a prompt
+
+
+def build_ultravox_payload(system_prompt, language_hint, voice, max_duration, vad_settings,
+                           initial_messages, inactivity_messages, recording_enabled):
+    """The Ultravox call creation payload used for every Plivo call"""
+    return {
+        "systemPrompt": system_prompt,
+        "temperature": 0.2,
+        "languageHint": language_hint,
+        "voice": voice,
+        "initialMessages": initial_messages,
+        "maxDuration": max_duration,
+        "inactivityMessages": inactivity_messages,
+        "selectedTools": [],
+        "recordingEnabled": recording_enabled,
+        "transcriptOptional": True,
+        "medium": {"plivo": {}},
+        "vadSettings": vad_settings
+    }
+
+
+class AnswerPayloadCache:
+    """
+    Serialized Ultravox payloads ready for answer_url.
+
+    Templates are the payload serialized once per distinct agent configuration
+    (everything except maxDuration). make_call_api prepares each outbound call by
+    filling in its template and storing the result under the Plivo call UUID, so
+    answer_url only has to look the bytes up.
+    """
+
+    def __init__(self, ttl=PAYLOAD_TTL, max_calls=MAX_PREPARED_CALLS, max_templates=MAX_TEMPLATES):
+        self.ttl = ttl
+        self.max_calls = max_calls
+        self.max_templates = max_templates
+        self.templates = OrderedDict()
+        self.calls = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _template(self, payload):
+        """Serialized payload with a placeholder for maxDuration, cached by configuration"""
+        # The system prompt dominates the payload size; keying on the string itself
+        # avoids escaping it again for every call of the same agent
+        key = (
+            payload.get("systemPrompt"),
+            payload.get("languageHint"),
+            payload.get("voice"),
+            payload.get("recordingEnabled"),
+            json.dumps([payload.get("vadSettings"), payload.get("initialMessages"),
+                        payload.get("inactivityMessages")], sort_keys=True)
+        )
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None:
+                self.templates.move_to_end(key)
+                return template
+
+        template = tuple(json.dumps(dict(payload, maxDuration=_MAX_DURATION_SLOT)).split(f'"{_MAX_DURATION_SLOT}"'))
+        with self.lock:
+            self.templates[key] = template
+            while len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        return template
+
+    def render(self, payload):
+        """Serialize a payload through its cached template"""
+        head, tail = self._template(payload)
+        return head + json.dumps(payload.get("maxDuration")) + tail
+
+    def prepare(self, call_uuid, payload, call_info=None):
+        """
+        Store the serialized payload for a call about to be placed, together with
+        the details answer_url records in CallLog (system_prompt, voice, ...).
+        """
+        entry = (time.monotonic() + self.ttl, self.render(payload), call_info or {})
+        with self.lock:
+            self.calls[call_uuid] = entry
+            self.calls.move_to_end(call_uuid)
+            while len(self.calls) > self.max_calls:
+                self.calls.popitem(last=False)
+
+    def get(self, call_uuid):
+        """Return (payload_json, call_info) for a prepared call, or (None, None)"""
+        with self.lock:
+            entry = self.calls.get(call_uuid)
+
+            # Drop expired entries from the old end while we hold the lock
+            now = time.monotonic()
+            while self.calls:
+                oldest = next(iter(self.calls.values()))
+                if oldest[0] > now:
+                    break
+                self.calls.popitem(last=False)
+
+        if entry is None or entry[0] < now:
+            return None, None
+        return entry[1], entry[2]
+
+    def status(self):
+        with self.lock:
+            return {"prepared_calls": len(self.calls), "templates": len(self.templates)}
+
+
+# Shared cache: filled by make_call_api, read by answer_url
+answer_payloads = AnswerPayloadCache()
@@ -9,8 +9,11 @@ import requests
 from config import PLIVO_AUTH_ID, PLIVO_AUTH_TOKEN, NGROK_URL, setup_logging, SYSTEM_PROMPT, DEFAULT_VAD_SETTINGS, \
     ULTRAVOX_API_BASE_URL, ULTRAVOX_API_KEY
 from utils import get_join_url
-from models import CallMapping, CallLog, Agent, Campaign, CampaignContact, SavedPhoneNumber
+from answer_payloads import answer_payloads, build_ultravox_payload
+from agent_cache import agent_cache
+from models import CallLog, Agent, Campaign, CampaignContact, SavedPhoneNumber
 from database import get_db_session, close_db_session, get_db_session_with_retry
+from data_archiver import find_call_log, recent_call_logs
 import traceback
 
 # Set up logging
@@ -93,14 +96,14 @@ def make_call_api():
         db_session = get_db_session_with_retry()
         try:
             if agent_id:
-                agent = db_session.query(Agent).filter_by(agent_id=agent_id).first()
+                agent = agent_cache.get(agent_id)
                 if agent:
                     # Use agent's configuration if available
                     if agent.system_prompt:
                         system_prompt = agent.system_prompt
 
-                    # Parse settings JSON
-                    settings = json.loads(agent.settings)
+                    # Settings are parsed once per agent by the cache
+                    settings = agent.settings
 
                     if settings.get("language_hint"):
                         language_hint = settings["language_hint"]
@@ -120,7 +123,7 @@ def make_call_api():
                     if settings.get("recording_enabled") is not None:
                         recording_enabled = settings["recording_enabled"]
 
-                    initial_messages = json.loads(agent.initial_messages)
+                    initial_messages = agent.initial_messages
                     # Format initial messages for Ultravox API
                     formatted_initial_messages = []
                     # for msg in initial_messages:
@@ -161,23 +164,20 @@ def make_call_api():
         current_app.config["CUSTOM_RECORDING_ENABLED"] = recording_enabled
 
         # Construct the Ultravox payload
-        ultravox_payload = {
-            "systemPrompt": system_prompt,
-            "temperature": 0.2,
-            "languageHint": language_hint,
-            "voice": voice,
-            "initialMessages": formatted_initial_messages,
-            "maxDuration": max_duration,
-            "inactivityMessages": inactivity_messages,
-            "selectedTools": [],
-            "recordingEnabled": recording_enabled,
-            "transcriptOptional": True,
-            "medium": {"plivo": {}},
-            "vadSettings": vad_settings
-        }
+        ultravox_payload = build_ultravox_payload(
+            system_prompt=system_prompt,
+            language_hint=language_hint,
+            voice=voice,
+            max_duration=max_duration,
+            vad_settings=vad_settings,
+            initial_messages=formatted_initial_messages,
+            inactivity_messages=inactivity_messages,
+            recording_enabled=recording_enabled
+        )
+        payload_json = answer_payloads.render(ultravox_payload)
 
         # Get join URL from Ultravox API
-        join_url, ultravox_call_id = get_join_url(ultravox_payload)
+        join_url, ultravox_call_id = get_join_url(payload_json)
 
         # Initiate the call
         call = plivo_client.calls.create(
@@ -189,11 +189,18 @@ def make_call_api():
             hangup_method='POST'
         )
 
+        # Prepare the answer_url payload so the answered call gets its XML without rebuilding it
+        answer_payloads.prepare(call.request_uuid, ultravox_payload, {
+            "system_prompt": system_prompt,
+            "language_hint": language_hint,
+            "voice": voice,
+            "max_duration": max_duration
+        })
+
         # Log successful call initiation
         logger.info(f"Call initiated successfully!")
         logger.info(f"Call UUID: {call.request_uuid}")
         logger.info(f"Ultravox Call ID: {ultravox_call_id}")
-        logger.info(f"Call mapping created: Plivo UUID {call.request_uuid} -> Ultravox ID {ultravox_call_id}")
 
         # Save the phone numbers to the database if they don't exist
         try:
@@ -253,17 +260,6 @@ def make_call_api():
 
             db_session.add(new_call)
 
-            # Also maintain the legacy CallMapping for backward compatibility
-            call_mapping = CallMapping(
-                plivo_call_uuid=call.request_uuid,
-                ultravox_call_id=ultravox_call_id,
-                recipient_phone_number=recipient_number,
-                plivo_phone_number=plivo_number,
-                system_prompt=system_prompt
-            )
-
-            db_session.add(call_mapping)
-
             # If this is a campaign call, update the campaign contact
             if campaign_id:
                 contact = db_session.query(CampaignContact).filter_by(
@@ -322,7 +318,7 @@ def get_call_status(call_uuid):
 
         try:
             # Check if we have a record for this call
-            call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
+            call_log = find_call_log(db_session, call_uuid=call_uuid)
         except Exception as e:
             logger.warning(f"Error checking call log: {str(e)}")
             # Continue even if DB check fails
@@ -461,25 +457,18 @@ def get_recent_calls():
 
         db_session = get_db_session_with_retry()
 
-        # Query the CallLog table
-        total_count = db_session.query(CallLog).count()
-
-        calls_query = db_session.query(CallLog)
-
         # Apply filtering if needed
+        filters = {}
         campaign_id = request.args.get('campaign_id')
         if campaign_id:
-            calls_query = calls_query.filter_by(campaign_id=int(campaign_id))
+            filters['campaign_id'] = int(campaign_id)
 
         agent_id = request.args.get('agent_id')
         if agent_id:
-            calls_query = calls_query.filter_by(agent_id=agent_id)
-
-        # Order by most recent first
-        calls_query = calls_query.order_by(CallLog.created_at.desc())
+            filters['agent_id'] = agent_id
 
-        # Apply pagination
-        calls = calls_query.limit(limit).offset(offset).all()
+        # Most recent first, continuing into archived calls past the end of CallLog
+        calls, total_count = recent_call_logs(db_session, limit, offset, **filters)
 
         # Format the response
         formatted_calls = []
@@ -501,7 +490,7 @@ def get_recent_calls():
 
             # If agent data is requested, include agent name
             if call.agent_id:
-                agent = db_session.query(Agent).filter_by(agent_id=call.agent_id).first()
+                agent = agent_cache.get(call.agent_id)
                 if agent:
                     formatted_call["agent_name"] = agent.name
 
@@ -544,7 +533,7 @@ def get_call_details(call_uuid):
         db_session = get_db_session_with_retry()
 
         # Get the call from our database
-        call = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
+        call = find_call_log(db_session, call_uuid=call_uuid)
 
         if not call:
             return jsonify({
@@ -557,7 +546,7 @@ def get_call_details(call_uuid):
 
         # Add agent information if available
         if call.agent_id:
-            agent = db_session.query(Agent).filter_by(agent_id=call.agent_id).first()
+            agent = agent_cache.get(call.agent_id)
             if agent:
                 call_details["agent"] = {
                     "id": agent.agent_id,
@@ -602,14 +591,13 @@ def get_call_details(call_uuid):
 @api.route('/call_mapping/<call_uuid>', methods=['GET'])
 def get_call_mapping(call_uuid):
     """
-    Get the mapping between Plivo call_uuid and Ultravox call_id
-    Enhanced to use the CallLog table first
+    Get the mapping between Plivo call_uuid and Ultravox call_id.
+    Served from CallLog; legacy call_mappings rows were backfilled into it at startup.
     """
     try:
         db_session = get_db_session_with_retry()
 
-        # First try to get the mapping from CallLog
-        call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
+        call_log = find_call_log(db_session, call_uuid=call_uuid)
 
         if call_log and call_log.ultravox_id:
             return jsonify({
@@ -622,21 +610,6 @@ def get_call_mapping(call_uuid):
                     "source": "call_log"
                 }
             })
-
-        # Fall back to legacy mapping if not found in CallLog
-        call_mapping = db_session.query(CallMapping).filter_by(plivo_call_uuid=call_uuid).first()
-
-        if call_mapping:
-            return jsonify({
-                "status": "success",
-                "mapping": {
-                    "plivo_call_uuid": call_mapping.plivo_call_uuid,
-                    "ultravox_call_id": call_mapping.ultravox_call_id,
-                    "recipient_phone_number": call_mapping.recipient_phone_number,
-                    "plivo_phone_number": call_mapping.plivo_phone_number,
-                    "source": "call_mapping"
-                }
-            })
         else:
             return jsonify({
                 "status": "error",
@@ -659,7 +632,6 @@ def get_call_mapping(call_uuid):
 def set_call_mapping(call_uuid, ultravox_call_id):
     """
     Temporary endpoint to set a call mapping for testing
-    Enhanced to update CallLog as well
     """
     try:
         db_session = get_db_session_with_retry()
@@ -683,23 +655,6 @@ def set_call_mapping(call_uuid, ultravox_call_id):
             db_session.add(new_call)
             logger.info(f"Created new CallLog: {call_uuid} -> {ultravox_call_id}")
 
-        # Check if mapping already exists in legacy table
-        existing_mapping = db_session.query(CallMapping).filter_by(plivo_call_uuid=call_uuid).first()
-
-        if existing_mapping:
-            existing_mapping.ultravox_call_id = ultravox_call_id
-            logger.info(f"Updated legacy mapping: {call_uuid} -> {ultravox_call_id}")
-        else:
-            # Create new mapping in legacy table
-            new_mapping = CallMapping(
-                plivo_call_uuid=call_uuid,
-                ultravox_call_id=ultravox_call_id,
-                recipient_phone_number="Unknown",
-                plivo_phone_number="Unknown"
-            )
-            db_session.add(new_mapping)
-            logger.info(f"Created legacy mapping: {call_uuid} -> {ultravox_call_id}")
-
         db_session.commit()
 
         return jsonify({
@@ -0,0 +1,145 @@
+"""
+Benchmark the executor's hot queries with and without the composite indexes
+declared on CampaignContact and CallLog.
+
+Builds a throwaway SQLite database with synthetic campaigns, contacts and
+calls, then runs every query against the single-column indexes only and again
+with the composite indexes, printing the query plan and the median time of
+each. SQLite stands in for Azure SQL here; the plans show the same change
+(single-column seek + filter or sort -> composite index seek).
+
+    python benchmark_indexes.py --campaigns 50 --contacts 2000 --repeat 20
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, and_, func, text
+from sqlalchemy.orm import sessionmaker
+from models import Base, Agent, Campaign, CampaignContact, CallLog
+
+COMPOSITE_INDEXES = [
+    index for table in (CampaignContact.__table__, CallLog.__table__)
+    for index in table.indexes if len(index.columns) > 1
+]
+
+STATUSES = ["pending"] * 6 + ["completed"] * 3 + ["failed", "no-answer", "calling"]
+
+
+def seed(session, campaigns, contacts_per_campaign, agents=10):
+    rng = random.Random(42)
+    now = datetime.now()
+    session.add_all([Agent(agent_id=f"agent-{a}", name=f"Agent {a}", system_prompt="",
+                                   initial_messages="[]", settings="{}") for a in range(agents)])
+    session.add_all([Campaign(campaign_id=c, campaign_name=f"Campaign {c}", assigned_agent_id=f"agent-{c % agents}",
+                              assigned_agent_name=f"Agent {c % agents}", status="running",
+                              from_number="+10000000000") for c in range(1, campaigns + 1)])
+    session.commit()
+
+    contacts = []
+    calls = []
+    for c in range(1, campaigns + 1):
+        for n in range(contacts_per_campaign):
+            status = rng.choice(STATUSES)
+            call_uuid = f"{c}-{n}" if status != "pending" else None
+            updated_at = now - timedelta(minutes=rng.randint(0, 60 * 24))
+            contacts.append(dict(campaign_id=c, name=f"Contact {n}", phone=f"+91{c:04d}{n:06d}", status=status,
+                                 call_uuid=call_uuid, created_at=updated_at, updated_at=updated_at))
+            if call_uuid:
+                calls.append(dict(call_uuid=call_uuid, to_number=f"+91{c:04d}{n:06d}", from_number="+10000000000",
+                                  campaign_id=c, agent_id=f"agent-{c % agents}", call_state="ANSWER",
+                                  initiation_time=updated_at, created_at=updated_at, updated_at=updated_at))
+    session.bulk_insert_mappings(CampaignContact, contacts)
+    session.bulk_insert_mappings(CallLog, calls)
+    session.commit()
+    return len(contacts), len(calls)
+
+
+def hot_queries(session, campaigns):
+    """(name, query) pairs mirroring campaign_executor / api_controller"""
+    campaign_id = campaigns // 2 or 1
+    owned = list(range(1, min(campaigns, 10) + 1))
+    cutoff = datetime.now() - timedelta(minutes=5)
+    return [
+        ("next pending contact", session.query(CampaignContact).filter(and_(
+            CampaignContact.campaign_id == campaign_id, CampaignContact.status == "pending")).limit(1)),
+        ("finished contact count", session.query(func.count(CampaignContact.id)).filter(and_(
+            CampaignContact.campaign_id == campaign_id,
+            CampaignContact.status.in_(["completed", "failed", "no-answer"])))),
+        ("status counts per campaign", session.query(
+            CampaignContact.campaign_id, CampaignContact.status, func.count(CampaignContact.id)).filter(and_(
+                CampaignContact.campaign_id.in_(owned), CampaignContact.status.in_(["pending", "calling"]))
+        ).group_by(CampaignContact.campaign_id, CampaignContact.status)),
+        ("update_call_statuses", session.query(CampaignContact).filter(and_(
+            CampaignContact.campaign_id.in_(owned), CampaignContact.status == "calling",
+            CampaignContact.call_uuid.isnot(None)))),
+        ("stuck call candidates", session.query(CampaignContact).filter(and_(
+            CampaignContact.status == "calling", CampaignContact.updated_at <= cutoff))),
+        ("recent calls by campaign", session.query(CallLog).filter_by(campaign_id=campaign_id)
+         .order_by(CallLog.created_at.desc()).limit(50)),
+        ("recent calls by agent", session.query(CallLog).filter_by(agent_id="agent-3")
+         .order_by(CallLog.created_at.desc()).limit(50)),
+    ]
+
+
+def explain(session, query):
+    sql = str(query.statement.compile(dialect=session.bind.dialect, compile_kwargs={"literal_binds": True}))
+    return "; ".join(row[-1] for row in session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+
+
+def timed(query, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        query.all()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def run(session, campaigns, repeat):
+    return {name: (explain(session, query), timed(query, repeat)) for name, query in hot_queries(session, campaigns)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--campaigns", type=int, default=50)
+    parser.add_argument("--contacts", type=int, default=2000, help="Contacts per campaign")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per query; the median is reported")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "benchmark.db")
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        Base.metadata.create_all(engine)
+        for index in COMPOSITE_INDEXES:
+            index.drop(bind=engine)
+
+        session = sessionmaker(bind=engine)()
+        contacts, calls = seed(session, args.campaigns, args.contacts)
+        session.execute(text("ANALYZE"))
+        print(f"Seeded {contacts} contacts and {calls} calls in {args.campaigns} campaigns\n")
+
+        before = run(session, args.campaigns, args.repeat)
+        for index in COMPOSITE_INDEXES:
+            index.create(bind=engine)
+        session.execute(text("ANALYZE"))
+        after = run(session, args.campaigns, args.repeat)
+        session.close()
+
+        for name, (plan_before, ms_before) in before.items():
+            plan_after, ms_after = after[name]
+            print(f"{name}: {ms_before:.2f} ms -> {ms_after:.2f} ms ({ms_before / max(ms_after, 1e-6):.1f}x)")
+            print(f"    before: {plan_before}")
+            print(f"    after:  {plan_after}")
+    finally:
+        engine.dispose()
+        os.remove(path)
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
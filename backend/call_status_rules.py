@@ -0,0 +1,91 @@
+"""
+How a finished call's Plivo call_state / hangup_cause map to its contact's
+status, defined once and usable both in Python (status_for) and in SQL
+(status_case, for set-based updates).
+
+call_state is checked first: it holds either Plivo's call record state
+(ANSWER, NO_ANSWER, ...) or the lower-case status from the hangup callback
+and the live call API. If it says nothing final, the hangup cause decides:
+a known cause maps as listed, and any other non-empty cause means the call
+failed. No rule matching means the call is still open.
+
+Values are compared upper-cased with trailing spaces removed, on both sides:
+that is what Azure SQL's default case-insensitive collation and padded string
+comparison do anyway, and doing it explicitly keeps status_for and status_case
+equivalent under any collation (and on SQLite).
+"""
+from sqlalchemy import case, func
+
+FINAL_STATUSES = ["completed", "failed", "no-answer"]
+
+CALL_STATE_RULES = {
+    # Plivo call record
+    "ANSWER": "completed",
+    "NO_ANSWER": "no-answer",
+    "BUSY": "no-answer",
+    "TIMEOUT": "no-answer",
+    "FAILED": "failed",
+    "EARLY MEDIA": "failed",
+    # Hangup callback / live call API
+    "completed": "completed",
+    "no-answer": "no-answer",
+    "busy": "no-answer",
+    "failed": "failed",
+}
+
+HANGUP_CAUSE_RULES = {
+    "NORMAL_CLEARING": "completed",
+    "NO_ANSWER": "no-answer",
+    "NO_USER_RESPONSE": "no-answer",
+    "USER_BUSY": "no-answer",
+}
+
+OTHER_HANGUP_CAUSE_STATUS = "failed"  # Any hangup cause not listed above
+
+
+def _key(value):
+    return value.rstrip().upper() if value else ""
+
+
+def _sql_key(column):
+    return func.upper(func.rtrim(column))
+
+
+def _normalized(rules):
+    """Rules keyed by _key(); the tables above agree on every value that differs only in case"""
+    return {_key(value): status for value, status in rules.items()}
+
+
+_CALL_STATES = _normalized(CALL_STATE_RULES)
+_HANGUP_CAUSES = _normalized(HANGUP_CAUSE_RULES)
+
+
+def status_for(call_state, hangup_cause):
+    """Final contact status for a call, or None if it is still open"""
+    state, cause = _key(call_state), _key(hangup_cause)
+    if state in _CALL_STATES:
+        return _CALL_STATES[state]
+    if cause in _HANGUP_CAUSES:
+        return _HANGUP_CAUSES[cause]
+    if cause:
+        return OTHER_HANGUP_CAUSE_STATUS
+    return None
+
+
+def _grouped(rules):
+    """{status: [values]} so each status is one IN (...) branch of the CASE"""
+    grouped = {}
+    for value, status in rules.items():
+        grouped.setdefault(status, []).append(value)
+    return grouped.items()
+
+
+def status_case(call_state, hangup_cause):
+    """SQL expression equivalent to status_for over two columns; NULL if the call is still open"""
+    state, cause = _sql_key(call_state), _sql_key(hangup_cause)
+    return case(
+        *[(state.in_(values), status) for status, values in _grouped(_CALL_STATES)],
+        *[(cause.in_(values), status) for status, values in _grouped(_HANGUP_CAUSES)],
+        (cause != "", OTHER_HANGUP_CAUSE_STATUS),
+        else_=None
+    )
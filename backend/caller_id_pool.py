@@ -0,0 +1,167 @@
+import json
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func, case
+from models import SavedPhoneNumber, CallLog
+from rate_limiter import dial_limiter
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("caller_id_pool", "caller_id_pool.log")
+
+# Pool defaults (overridable per campaign through config["caller_id_pool"])
+DEFAULT_STRATEGY = "lru"  # "lru" or "weighted"
+DEFAULT_MAX_CONCURRENT_PER_NUMBER = 1  # Simultaneous calls allowed on one caller ID
+HEALTH_WINDOW_HOURS = 24  # Look-back window for answer-rate scoring
+HEALTH_MIN_SAMPLES = 10  # Calls needed before a number can be excluded for poor health
+ACTIVE_CALL_WINDOW_HOURS = 1  # Calls older than this without an end_time are not counted as active
+
+
+def get_pool_config(campaign):
+    """
+    Return the caller ID pool settings for a campaign, or None if the campaign
+    dials from its single from_number.
+
+    Example campaign config:
+        {"caller_id_pool": {"enabled": true, "strategy": "weighted",
+                            "numbers": ["+9122..."], "max_concurrent_per_number": 2,
+                            "min_health": 0.1}}
+    """
+    if not campaign or not campaign.config:
+        return None
+
+    try:
+        config_data = json.loads(campaign.config)
+    except json.JSONDecodeError:
+        logger.warning(f"Invalid JSON in campaign config for campaign {campaign.campaign_id}")
+        return None
+
+    pool_config = config_data.get("caller_id_pool")
+    if not isinstance(pool_config, dict) or not pool_config.get("enabled"):
+        return None
+
+    return pool_config
+
+
+def get_number_health(db_session, numbers):
+    """
+    Score caller IDs by answer rate over the recent window.
+    Returns {number: {"calls": n, "answered": n, "score": 0..1}}.
+    Scores are smoothed so numbers with little history start near 0.5.
+    """
+    if not numbers:
+        return {}
+
+    since = datetime.now() - timedelta(hours=HEALTH_WINDOW_HOURS)
+    rows = db_session.query(
+        CallLog.from_number,
+        func.count(CallLog.id),
+        func.sum(case((CallLog.call_state == 'ANSWER', 1), else_=0))
+    ).filter(
+        CallLog.from_number.in_(numbers),
+        CallLog.initiation_time >= since
+    ).group_by(CallLog.from_number).all()
+
+    stats = {number: {"calls": 0, "answered": 0} for number in numbers}
+    for number, calls, answered in rows:
+        stats[number] = {"calls": calls or 0, "answered": int(answered or 0)}
+
+    for number, entry in stats.items():
+        entry["score"] = round((entry["answered"] + 1) / (entry["calls"] + 2), 4)
+
+    return stats
+
+
+def get_active_calls_per_number(db_session, numbers):
+    """Count calls still in progress on each caller ID"""
+    if not numbers:
+        return {}
+
+    since = datetime.now() - timedelta(hours=ACTIVE_CALL_WINDOW_HOURS)
+    rows = db_session.query(CallLog.from_number, func.count(CallLog.id)).filter(
+        CallLog.from_number.in_(numbers),
+        CallLog.end_time.is_(None),
+        CallLog.initiation_time >= since
+    ).group_by(CallLog.from_number).all()
+
+    return {number: count for number, count in rows}
+
+
+def _order_candidates(candidates, health, strategy):
+    """Order pool members according to the rotation strategy"""
+    if strategy == "weighted":
+        # Weighted random order without replacement: higher health scores tend to come first
+        return sorted(
+            candidates,
+            key=lambda saved: random.random() ** (1.0 / max(health[saved.phone_number]["score"], 0.01)),
+            reverse=True
+        )
+
+    # Least recently used first (the query already orders by last_used)
+    return candidates
+
+
+def select_from_number(db_session, campaign, to_number):
+    """
+    Pick the caller ID for the next call of a campaign and take its rate-limit token.
+
+    Campaigns without a caller ID pool use campaign.from_number. Pooled campaigns draw
+    from SavedPhoneNumber rows with number_type='from', skipping numbers that are at
+    their concurrency limit, have poor answer rates, or have an empty rate bucket.
+
+    Returns the chosen number, or None if no number can dial right now.
+    """
+    pool_config = get_pool_config(campaign)
+
+    if not pool_config:
+        if dial_limiter.try_acquire(campaign.from_number, to_number):
+            return campaign.from_number
+        return None
+
+    query = db_session.query(SavedPhoneNumber).filter(SavedPhoneNumber.number_type == 'from')
+    if pool_config.get("numbers"):
+        query = query.filter(SavedPhoneNumber.phone_number.in_(pool_config["numbers"]))
+    candidates = query.order_by(SavedPhoneNumber.last_used.asc()).all()
+
+    if not candidates:
+        logger.warning(f"Caller ID pool for campaign {campaign.campaign_id} is empty, using campaign from_number")
+        if dial_limiter.try_acquire(campaign.from_number, to_number):
+            return campaign.from_number
+        return None
+
+    numbers = [saved.phone_number for saved in candidates]
+    health = get_number_health(db_session, numbers)
+    active_calls = get_active_calls_per_number(db_session, numbers)
+
+    max_concurrent = int(pool_config.get("max_concurrent_per_number", DEFAULT_MAX_CONCURRENT_PER_NUMBER))
+    min_health = float(pool_config.get("min_health", 0))
+
+    # Drop unhealthy numbers, unless that would empty the pool
+    healthy = [
+        saved for saved in candidates
+        if health[saved.phone_number]["calls"] < HEALTH_MIN_SAMPLES
+        or health[saved.phone_number]["score"] >= min_health
+    ]
+    if healthy:
+        candidates = healthy
+
+    strategy = pool_config.get("strategy", DEFAULT_STRATEGY)
+    for saved in _order_candidates(candidates, health, strategy):
+        number = saved.phone_number
+
+        if active_calls.get(number, 0) >= max_concurrent:
+            continue
+
+        if not dial_limiter.try_acquire(number, to_number):
+            continue
+
+        # Rotate: mark the number as used so LRU ordering moves on
+        saved.last_used = datetime.now()
+
+        logger.info(f"Campaign {campaign.campaign_id} selected caller ID {number} "
+                    f"(strategy: {strategy}, health: {health[number]['score']}, "
+                    f"active: {active_calls.get(number, 0)})")
+        return number
+
+    logger.info(f"No caller ID available in pool for campaign {campaign.campaign_id}")
+    return None
@@ -1,10 +1,17 @@
+import csv
+import io
 import json
 import logging
+import re
 import requests
-from flask import Blueprint, request, jsonify
-from sqlalchemy import func
-from models import Campaign, Agent, CampaignContact, CallLog
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from sqlalchemy import func, and_
+from models import (Campaign, Agent, CampaignContact, CallLog, TranscriptMessage, CallAnalytics, CallLogArchive,
+                    CallAnalyticsArchive, CampaignContactArchive)
 from database import get_db_session, close_db_session, get_db_session_with_retry
+from campaign_rollup import delete_rollup
+from data_archiver import (find_call_logs, find_campaign_contacts, contact_status_counts, completed_call_uuids,
+                           analysed_call_count, delete_campaign_archive)
 from config import setup_logging, ULTRAVOX_API_BASE_URL, ULTRAVOX_API_KEY
 from datetime import datetime
 
@@ -14,6 +21,11 @@ logger = setup_logging("campaign_controller", "campaign_controller.log")
 # Create a Blueprint for campaign API routes
 campaign = Blueprint('campaign', __name__)
 
+EXPORT_BATCH_SIZE = 1000  # Rows fetched per round trip by the CSV export
+EXPORT_CHUNK_SIZE = 64 * 1024  # Bytes of CSV buffered before a chunk is sent
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')  # Spreadsheet apps evaluate cells starting with these
+PHONE_NUMBER = re.compile(r"\+\d+")  # E.164 numbers start with '+' but are not formulas
+
 
 @campaign.route('/campaigns', methods=['GET'])
 def get_campaigns():
@@ -30,16 +42,10 @@ def get_campaigns():
             camp_dict = camp.to_dict()
 
             # Get basic statistics
-            total_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-                campaign_id=camp.campaign_id).scalar()
-            completed_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-                campaign_id=camp.campaign_id,
-                status='completed'
-            ).scalar()
-            failed_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-                campaign_id=camp.campaign_id,
-                status='failed'
-            ).scalar()
+            status_counts = contact_status_counts(db_session, camp.campaign_id)
+            total_contacts = sum(status_counts.values())
+            completed_contacts = status_counts.get('completed', 0)
+            failed_contacts = status_counts.get('failed', 0)
 
             # Add statistics to the campaign data
             completion_percentage = round((completed_contacts / total_contacts) * 100, 2) if total_contacts > 0 else 0
@@ -50,25 +56,14 @@ def get_campaigns():
             analysis_progress = 0
             if camp.status == 'completed' and completed_contacts > 0:
                 # Get all completed calls for this campaign
-                completed_call_uuids = db_session.query(CampaignContact.call_uuid).filter_by(
-                    campaign_id=camp.campaign_id,
-                    status='completed'
-                ).all()
-
-                completed_call_uuids = [cu[0] for cu in completed_call_uuids if cu[0]]
+                call_uuids = completed_call_uuids(db_session, camp.campaign_id)
 
-                if completed_call_uuids:
+                if call_uuids:
                     # Get call logs with complete analysis
-                    calls_with_analysis = db_session.query(func.count(CallLog.id)).filter(
-                        CallLog.call_uuid.in_(completed_call_uuids),
-                        CallLog.summary.isnot(None),  # Has summary
-                        CallLog.recording_url.isnot(None),  # Has recording
-                        CallLog.transcription.isnot(None)  # Has transcription
-                    ).scalar()
+                    calls_with_analysis = analysed_call_count(db_session, call_uuids)
 
                     # Calculate percentage
-                    analysis_progress = round((calls_with_analysis / len(completed_call_uuids)) * 100) if len(
-                        completed_call_uuids) > 0 else 0
+                    analysis_progress = round((calls_with_analysis / len(call_uuids)) * 100)
 
             camp_dict['statistics'] = {
                 'total_contacts': total_contacts,
@@ -111,43 +106,24 @@ def get_campaign(campaign_id):
             }), 404
 
         # Get campaign statistics
-        total_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(campaign_id=campaign_id).scalar()
-        completed_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='completed'
-        ).scalar()
-        failed_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='failed'
-        ).scalar()
-        pending_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='pending'
-        ).scalar()
+        status_counts = contact_status_counts(db_session, campaign_id)
+        total_contacts = sum(status_counts.values())
+        completed_contacts = status_counts.get('completed', 0)
+        failed_contacts = status_counts.get('failed', 0)
+        pending_contacts = status_counts.get('pending', 0)
 
         # Calculate analysis progress
         analysis_progress = 0
         if campaign.status == 'completed' and completed_contacts > 0:
             # Get all completed calls for this campaign
-            completed_call_uuids = db_session.query(CampaignContact.call_uuid).filter_by(
-                campaign_id=campaign_id,
-                status='completed'
-            ).all()
+            call_uuids = completed_call_uuids(db_session, campaign_id)
 
-            completed_call_uuids = [cu[0] for cu in completed_call_uuids if cu[0]]
-
-            if completed_call_uuids:
+            if call_uuids:
                 # Get call logs with complete analysis
-                calls_with_analysis = db_session.query(func.count(CallLog.id)).filter(
-                    CallLog.call_uuid.in_(completed_call_uuids),
-                    CallLog.summary.isnot(None),  # Has summary
-                    CallLog.recording_url.isnot(None),  # Has recording
-                    CallLog.transcription.isnot(None)  # Has transcription
-                ).scalar()
+                calls_with_analysis = analysed_call_count(db_session, call_uuids)
 
                 # Calculate percentage
-                analysis_progress = round((calls_with_analysis / len(completed_call_uuids)) * 100) if len(
-                    completed_call_uuids) > 0 else 0
+                analysis_progress = round((calls_with_analysis / len(call_uuids)) * 100)
 
         campaign_data = campaign.to_dict()
         campaign_data['statistics'] = {
@@ -337,6 +313,11 @@ def delete_campaign(campaign_id):
         calls = db_session.query(CallLog).filter_by(campaign_id=campaign_id).all()
         for call in calls:
             call.campaign_id = None
+        db_session.query(TranscriptMessage).filter_by(campaign_id=campaign_id).update(
+            {TranscriptMessage.campaign_id: None}, synchronize_session=False)
+        delete_campaign_archive(db_session, campaign_id)
+
+        delete_rollup(db_session, campaign_id)
 
         # Delete the campaign
         db_session.delete(campaign)
@@ -431,7 +412,7 @@ def get_campaign_contacts(campaign_id):
             }), 404
 
         # Get contacts
-        contacts = db_session.query(CampaignContact).filter_by(campaign_id=campaign_id).all()
+        contacts = find_campaign_contacts(db_session, campaign_id)
 
         return jsonify({
             "status": "success",
@@ -450,6 +431,123 @@ def get_campaign_contacts(campaign_id):
         close_db_session(db_session)
 
 
+def _call_column(name):
+    """A call column from call_logs, or from call_logs_archive once the call is archived"""
+    return func.coalesce(getattr(CallLog, name), getattr(CallLogArchive, name))
+
+
+EXPORT_COLUMNS = [
+    ("name", lambda contact: contact.name),
+    ("phone", lambda contact: contact.phone),
+    ("status", lambda contact: contact.status),
+    ("call_uuid", lambda contact: contact.call_uuid),
+    ("ultravox_id", lambda contact: _call_column("ultravox_id")),
+    ("call_state", lambda contact: _call_column("call_state")),
+    ("hangup_cause", lambda contact: _call_column("hangup_cause")),
+    ("call_duration", lambda contact: _call_column("call_duration")),
+    ("initiation_time", lambda contact: _call_column("initiation_time")),
+    ("answer_time", lambda contact: _call_column("answer_time")),
+    ("end_time", lambda contact: _call_column("end_time")),
+    ("summary", lambda contact: _call_column("summary")),
+    ("call_success", lambda contact: func.coalesce(CallAnalytics.call_success, CallAnalyticsArchive.call_success)),
+    ("entities", lambda contact: func.coalesce(CallAnalytics.entities_extracted,
+                                               CallAnalyticsArchive.entities_extracted)),  # JSON
+    ("updated_at", lambda contact: contact.updated_at),
+]
+
+
+def _export_query(db_session, contact, campaign_id):
+    """A campaign's contacts from `contact` (hot or archived), each with its call and analytics"""
+    return db_session.query(*[column(contact) for _, column in EXPORT_COLUMNS]).outerjoin(
+        CallLog, CallLog.call_uuid == contact.call_uuid
+    ).outerjoin(
+        CallLogArchive, and_(CallLog.id.is_(None), CallLogArchive.call_uuid == contact.call_uuid)
+    ).outerjoin(
+        CallAnalytics, CallAnalytics.call_id == CallLog.id
+    ).outerjoin(
+        CallAnalyticsArchive, CallAnalyticsArchive.call_id == CallLogArchive.id
+    ).filter(contact.campaign_id == campaign_id).order_by(contact.id)
+
+
+def _csv_cell(value):
+    """
+    One CSV cell. Text starting like a formula (names are user uploaded,
+    summaries come from the LLM) is prefixed with ' so spreadsheet apps show it
+    as text instead of evaluating it. Phone numbers are left as they are, so the
+    file can still be re-imported as contacts.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) and not PHONE_NUMBER.fullmatch(value):
+        return "'" + value
+    return value
+
+
+def _export_csv(campaign_id):
+    """Yield the CSV in chunks, streaming rows from the database a batch at a time"""
+    db_session = get_db_session_with_retry()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM, so spreadsheet apps read non-ASCII names as UTF-8
+        writer.writerow([name for name, _ in EXPORT_COLUMNS])
+        # Send the header at once so the download starts before the query finishes
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+        for contact in (CampaignContact, CampaignContactArchive):
+            for row in _export_query(db_session, contact, campaign_id).yield_per(EXPORT_BATCH_SIZE):
+                writer.writerow([_csv_cell(value) for value in row])
+                if buffer.tell() >= EXPORT_CHUNK_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        yield buffer.getvalue()
+    except Exception as e:
+        # Headers are already sent; the client sees a truncated file
+        logger.error(f"Error exporting campaign {campaign_id}: {str(e)}")
+        raise
+    finally:
+        close_db_session(db_session)
+
+
+@campaign.route('/campaigns/<int:campaign_id>/export.csv', methods=['GET'])
+def export_campaign_csv(campaign_id):
+    """
+    Download a campaign's contacts with their call outcome, duration, summary
+    and extracted entities as CSV. Rows are streamed, so memory use does not
+    grow with the campaign size.
+    """
+    db_session = None
+    try:
+        db_session = get_db_session_with_retry()
+        campaign_row = db_session.query(Campaign.campaign_name).filter_by(campaign_id=campaign_id).first()
+        if not campaign_row:
+            return jsonify({
+                "status": "error",
+                "message": f"Campaign with ID {campaign_id} not found"
+            }), 404
+        filename = re.sub(r'[^\w.-]+', '_', campaign_row.campaign_name or '', flags=re.ASCII).strip('_') or \
+            f"campaign_{campaign_id}"
+    except Exception as e:
+        logger.error(f"Error in export_campaign_csv: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        close_db_session(db_session)
+
+    return Response(
+        stream_with_context(_export_csv(campaign_id)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}_results.csv"'}
+    )
+
+
 @campaign.route('/campaigns/<int:campaign_id>/contacts', methods=['POST'])
 def add_campaign_contacts(campaign_id):
     """
@@ -654,34 +752,13 @@ def get_campaign_stats(campaign_id):
             }), 404
 
         # Get campaign statistics
-        total_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id
-        ).scalar()
-
-        completed_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='completed'
-        ).scalar()
-
-        failed_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='failed'
-        ).scalar()
-
-        no_answer_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='no-answer'
-        ).scalar()
-
-        pending_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='pending'
-        ).scalar()
-
-        calling_contacts = db_session.query(func.count(CampaignContact.id)).filter_by(
-            campaign_id=campaign_id,
-            status='calling'
-        ).scalar()
+        status_counts = contact_status_counts(db_session, campaign_id)
+        total_contacts = sum(status_counts.values())
+        completed_contacts = status_counts.get('completed', 0)
+        failed_contacts = status_counts.get('failed', 0)
+        no_answer_contacts = status_counts.get('no-answer', 0)
+        pending_contacts = status_counts.get('pending', 0)
+        calling_contacts = status_counts.get('calling', 0)
 
         # Calculate completion rate
         completion_rate = 0
@@ -709,32 +786,21 @@ def get_campaign_stats(campaign_id):
         # If analysis_progress isn't set but campaign is completed, calculate it
         if analysis_progress is None and campaign.status == 'completed' and completed_contacts > 0:
             # Get all completed calls for this campaign
-            completed_call_uuids = db_session.query(CampaignContact.call_uuid).filter_by(
-                campaign_id=campaign_id,
-                status='completed'
-            ).all()
+            call_uuids = completed_call_uuids(db_session, campaign_id)
 
-            completed_call_uuids = [cu[0] for cu in completed_call_uuids if cu[0]]
-
-            if completed_call_uuids:
+            if call_uuids:
                 # Get call logs with complete analysis
-                calls_with_analysis = db_session.query(func.count(CallLog.id)).filter(
-                    CallLog.call_uuid.in_(completed_call_uuids),
-                    CallLog.summary.isnot(None),  # Has summary
-                    CallLog.recording_url.isnot(None),  # Has recording
-                    CallLog.transcription.isnot(None)  # Has transcription
-                ).scalar()
+                calls_with_analysis = analysed_call_count(db_session, call_uuids)
 
                 # Calculate percentage
-                analysis_progress = round((calls_with_analysis / len(completed_call_uuids)) * 100) if len(
-                    completed_call_uuids) > 0 else 0
+                analysis_progress = round((calls_with_analysis / len(call_uuids)) * 100)
 
                 # Update campaign analysis_progress
                 campaign.analysis_progress = analysis_progress
                 db_session.commit()
 
         # Get associated calls
-        calls = db_session.query(CallLog).filter_by(campaign_id=campaign_id).all()
+        calls = find_call_logs(db_session, campaign_id=campaign_id)
 
         # Calculate average call duration
         total_duration = 0
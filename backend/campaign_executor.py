@@ -4,27 +4,50 @@ import threading
 import json
 import traceback
 import requests
-from datetime import datetime
-from sqlalchemy import and_, func
+import plivo
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, update
 from models import Campaign, CampaignContact, Agent, CallLog, CallAnalytics, CallAnalysisStatus
+import executor_state
+from agent_cache import agent_cache
 from database import get_db_session, close_db_session, get_db_session_with_retry
-from config import setup_logging, NGROK_URL
+from config import setup_logging, NGROK_URL, PLIVO_AUTH_ID, PLIVO_AUTH_TOKEN
+from rate_limiter import dial_limiter
+from caller_id_pool import select_from_number
+from campaign_scheduler import campaign_scheduler, get_scheduling_config
+from extraction_service import queue_call_extraction
+from recording_archiver import recording_archiver
+from call_status_rules import status_for, status_case, FINAL_STATUSES
+import metrics
 
 # Set up logging
 logger = setup_logging("campaign_executor", "campaign_executor.log")
 
 # Global flags and configuration
 running = False
+is_leader = False  # The holder of the leader lease runs cluster-wide housekeeping (reaper, scheduled starts)
+owned_campaigns = set()  # Campaigns this node holds leases for and therefore dials
 executor_thread = None
-MAX_CONCURRENT_CALLS = 1  # Process only one call at a time
 POLL_INTERVAL = 10  # How often to check for campaigns to process (seconds)
-CALL_INTERVAL = 5  # Wait 5 seconds between calls
-CAMPAIGN_PROCESSING_LIMIT = 3  # Maximum number of campaigns to process at once
+# Spacing between calls is enforced per from-number and per destination prefix by rate_limiter.dial_limiter,
+# whose buckets are shared by all nodes
+CAMPAIGN_PROCESSING_LIMIT = 3  # Dial slots per node per cycle, shared across its campaigns (see campaign_scheduler)
 API_BASE_URL = "http://localhost:5000/api"  # Base URL for API calls
+REAPER_INTERVAL = 60  # How often to look for contacts stuck in 'calling' (seconds)
+STUCK_CALL_GRACE_PERIOD = 120  # Extra time past max_duration before a call counts as stuck (seconds)
+DEFAULT_MAX_DURATION = 180  # Used when a call has no max_duration recorded (seconds)
+CLAIM_TIMEOUT = 30  # A claim older than the make_call request timeout can no longer be in flight (seconds)
+RECOVERY_ANALYSIS_LIMIT = 200  # Pending analyses re-queued when taking over
+RECOVERY_ANALYSIS_WINDOW_HOURS = 24  # Only calls finished this recently are re-queued for analysis
+LEASED_CAMPAIGN_STATUSES = ["created", "scheduled", "running", "paused"]  # Campaigns whose lease row is kept
 
+# Reaper metrics
+reaped_calls = metrics.counter("executor.stuck_calls_reaped", "Contacts released from 'calling', by new status")
+reaper_last_run = metrics.gauge("executor.reaper_last_run", "Unix time of the last stuck-call reaper pass")
 
-def make_call(contact, campaign, agent):
-    """Make a call to a contact for a campaign"""
+
+def make_call(contact, campaign, agent, from_number=None):
+    """Make a call to a contact for a campaign, optionally from a caller ID picked from the pool"""
     try:
         # Verify parameters are valid
         if not contact or not contact.phone:
@@ -35,6 +58,8 @@ def make_call(contact, campaign, agent):
             logger.error(f"Invalid campaign: missing from number")
             return False
 
+        from_number = from_number or campaign.from_number
+
         # Store contact ID for logging (to avoid detached instance issues)
         contact_id = contact.id
         contact_phone = contact.phone
@@ -42,7 +67,7 @@ def make_call(contact, campaign, agent):
         # Prepare call data
         call_data = {
             "recipient_phone_number": contact.phone,
-            "plivo_phone_number": campaign.from_number,
+            "plivo_phone_number": from_number,
             "agent_id": campaign.assigned_agent_id,
             "campaign_id": campaign.campaign_id
         }
@@ -50,7 +75,7 @@ def make_call(contact, campaign, agent):
         # Log the call setup details
         logger.info(f"Setting up call for contact {contact_id}:")
         logger.info(f"  - To: {contact_phone}")
-        logger.info(f"  - From: {campaign.from_number}")
+        logger.info(f"  - From: {from_number}")
         logger.info(f"  - Agent: {campaign.assigned_agent_id}")
         logger.info(f"  - Campaign: {campaign.campaign_id}")
 
@@ -212,7 +237,7 @@ def process_campaign(campaign_id):
             return False
 
         # Get the agent for this campaign
-        agent = db_session.query(Agent).filter_by(agent_id=campaign.assigned_agent_id).first()
+        agent = agent_cache.get(campaign.assigned_agent_id)
         if not agent:
             logger.warning(f"Agent {campaign.assigned_agent_id} not found for campaign {campaign_id}")
 
@@ -232,7 +257,7 @@ def process_campaign(campaign_id):
             completed_contacts = db_session.query(CampaignContact).filter(
                 and_(
                     CampaignContact.campaign_id == campaign_id,
-                    CampaignContact.status.in_(["completed", "failed", "no-answer"])
+                    CampaignContact.status.in_(FINAL_STATUSES)
                 )
             ).count()
 
@@ -265,33 +290,51 @@ def process_campaign(campaign_id):
             )
         ).count()
 
-        logger.info(f"Campaign {campaign_id} has {active_calls} active calls")
+        _, _, max_lines = get_scheduling_config(campaign)
+        logger.info(f"Campaign {campaign_id} has {active_calls} of {max_lines} lines in use")
 
         # Update campaign progress
         update_campaign_progress(campaign_id, db_session)
 
-        # Only make a call if there are no active calls
-        if active_calls == 0:
+        # Only make a call if the campaign has a free line
+        if active_calls < max_lines:
+            # Pick a caller ID whose rate buckets have budget; defer the campaign otherwise
+            from_number = select_from_number(db_session, campaign, pending_contact.phone)
+            if not from_number:
+                logger.info(f"No caller ID with rate budget for {dial_limiter.destination_prefix(pending_contact.phone)}, "
+                            f"deferring campaign {campaign_id}")
+                close_db_session(db_session)
+                return False
+
             # Keep the pending_contact ID and other essential data we'll need after closing the session
             contact_id = pending_contact.id
             contact_phone = pending_contact.phone
             contact_name = pending_contact.name
 
-            # Set contact status to calling before closing session
-            pending_contact.status = "calling"
+            # Claim the contact only if it is still pending: during a lease handoff the
+            # previous owner may still be dialing this campaign from its last cycle
+            claimed = db_session.execute(
+                update(CampaignContact).where(
+                    CampaignContact.id == contact_id,
+                    CampaignContact.status == "pending"
+                ).values(status="calling").execution_options(synchronize_session=False)
+            ).rowcount
             db_session.commit()
 
             # Now close the session
             close_db_session(db_session)
             db_session = None
 
+            if not claimed:
+                logger.info(f"Contact {contact_id} was claimed by another node, skipping")
+                return False
+
             # Make a single call with just the essential data we need
             logger.info(f"Attempting to make call for contact {contact_id} (campaign {campaign_id})")
 
             # Get fresh copies of objects with a new session
             new_db_session = get_db_session_with_retry()
             campaign_fresh = new_db_session.query(Campaign).filter_by(campaign_id=campaign_id).first()
-            agent_fresh = new_db_session.query(Agent).filter_by(agent_id=campaign_fresh.assigned_agent_id).first()
             contact_fresh = new_db_session.query(CampaignContact).filter_by(id=contact_id).first()
 
             # Make sure we got all the objects
@@ -300,8 +343,23 @@ def process_campaign(campaign_id):
                 close_db_session(new_db_session)
                 return False
 
+            # The heartbeat thread may have handed the campaign off since this cycle started
+            if campaign_id not in owned_campaigns:
+                logger.info(f"Campaign {campaign_id} was handed off, returning contact {contact_id} to pending")
+                new_db_session.execute(
+                    update(CampaignContact).where(
+                        CampaignContact.id == contact_id,
+                        CampaignContact.status == "calling",
+                        CampaignContact.call_uuid.is_(None)
+                    ).values(status="pending").execution_options(synchronize_session=False)
+                )
+                new_db_session.commit()
+                close_db_session(new_db_session)
+                return False
+
             # Make the call with fresh objects
-            success = make_call(contact_fresh, campaign_fresh, agent_fresh)
+            success = make_call(contact_fresh, campaign_fresh, agent_cache.get(campaign_fresh.assigned_agent_id),
+                                from_number)
 
             # Close the new session
             close_db_session(new_db_session)
@@ -313,7 +371,7 @@ def process_campaign(campaign_id):
                 logger.error(f"Failed to make call to contact {contact_id} for campaign {campaign_id}")
                 return False
         else:
-            logger.info(f"Campaign {campaign_id} already has {active_calls} active call(s), waiting...")
+            logger.info(f"Campaign {campaign_id} already has {active_calls} active call(s), all lines in use, waiting...")
             close_db_session(db_session)
             return False
 
@@ -334,75 +392,97 @@ def execute_campaigns():
 
     while running:
         try:
-            # Get campaigns that are running
+            # Get running campaigns leased to this node
             db_session = get_db_session_with_retry()
-            running_campaigns = db_session.query(Campaign).filter_by(status="running").all()
-            campaign_ids = [c.campaign_id for c in running_campaigns]
-            close_db_session(db_session)
-
-            if not campaign_ids:
-                logger.info("No running campaigns found, sleeping...")
-                time.sleep(POLL_INTERVAL)
-                continue
-
-            logger.info(f"Found {len(campaign_ids)} running campaigns: {campaign_ids}")
-
-            # Process each campaign (limited by CAMPAIGN_PROCESSING_LIMIT)
-            for campaign_id in campaign_ids[:CAMPAIGN_PROCESSING_LIMIT]:
-                # Add detailed logging to diagnose campaign execution issues
-                logger.info(f"Starting to process campaign {campaign_id} for execution")
-
-                # Immediately check if there are pending contacts for this campaign
-                db_session = get_db_session_with_retry()
-                pending_contact_count = db_session.query(func.count(CampaignContact.id)).filter(
+            running_campaigns = []
+            if owned_campaigns:
+                running_campaigns = db_session.query(Campaign).filter(
                     and_(
-                        CampaignContact.campaign_id == campaign_id,
-                        CampaignContact.status == "pending"
+                        Campaign.status == "running",
+                        Campaign.campaign_id.in_(list(owned_campaigns))
                     )
-                ).scalar()
-
-                active_calls_count = db_session.query(func.count(CampaignContact.id)).filter(
+                ).all()
+            campaign_ids = [c.campaign_id for c in running_campaigns]
+            scheduling = {c.campaign_id: get_scheduling_config(c) for c in running_campaigns}
+
+            # Count pending and active contacts for every running campaign in one query
+            contact_counts = {}
+            if campaign_ids:
+                rows = db_session.query(
+                    CampaignContact.campaign_id, CampaignContact.status, func.count(CampaignContact.id)
+                ).filter(
                     and_(
-                        CampaignContact.campaign_id == campaign_id,
-                        CampaignContact.status == "calling"
+                        CampaignContact.campaign_id.in_(campaign_ids),
+                        CampaignContact.status.in_(["pending", "calling"])
                     )
-                ).scalar()
-                close_db_session(db_session)
+                ).group_by(CampaignContact.campaign_id, CampaignContact.status).all()
+                for row_campaign_id, status, count in rows:
+                    contact_counts[(row_campaign_id, status)] = count
+            close_db_session(db_session)
 
-                logger.info(
-                    f"Campaign {campaign_id} has {pending_contact_count} pending contacts and {active_calls_count} active calls")
+            if campaign_ids:
+                logger.info(f"Found {len(campaign_ids)} running campaigns on this node: {campaign_ids}")
+
+            # Only campaigns with pending contacts and a free line can dial this cycle
+            eligible = []
+            for campaign_id in campaign_ids:
+                pending_contact_count = contact_counts.get((campaign_id, "pending"), 0)
+                active_calls_count = contact_counts.get((campaign_id, "calling"), 0)
+                priority, weight, max_lines = scheduling[campaign_id]
 
-                if pending_contact_count > 0 and active_calls_count == 0:
-                    # Process the campaign if there are pending contacts and no active calls
-                    result = process_campaign(campaign_id)
-                    logger.info(f"Processed campaign {campaign_id}, result: {result}")
+                logger.info(
+                    f"Campaign {campaign_id} has {pending_contact_count} pending contacts and "
+                    f"{active_calls_count} of {max_lines} lines in use")
 
-                    # If processing was successful, wait a bit before the next call
-                    if result:
-                        time.sleep(CALL_INTERVAL)
+                free_lines = min(pending_contact_count, max_lines - active_calls_count)
+                if free_lines > 0:
+                    eligible.append((campaign_id, priority, weight, free_lines))
                 else:
                     if pending_contact_count == 0:
                         logger.info(f"Campaign {campaign_id} has no pending contacts to process")
-                    if active_calls_count > 0:
-                        logger.info(f"Campaign {campaign_id} already has active calls, skipping")
+                    if active_calls_count >= max_lines:
+                        logger.info(f"Campaign {campaign_id} has all its lines in use, skipping")
+
+            # Share the cycle's dial slots across campaigns by priority lane and weight;
+            # busy campaigns keep their place in the fair queue until they stop running
+            selected = campaign_scheduler.select(eligible, CAMPAIGN_PROCESSING_LIMIT, running_ids=campaign_ids)
+            logger.info(f"Scheduler selected campaigns {selected} from {len(eligible)} eligible")
+
+            deferred = set()
+            for campaign_id in selected:
+                if campaign_id in deferred:
+                    continue
+                logger.info(f"Starting to process campaign {campaign_id} for execution")
 
-            # Check for scheduled campaigns that should be started
-            db_session = get_db_session_with_retry()
-            now = datetime.now()
-            scheduled_campaigns = db_session.query(Campaign).filter(
-                and_(
-                    Campaign.status == "scheduled",
-                    Campaign.schedule_date <= now
-                )
-            ).all()
+                # Rate limiting happens inside process_campaign, per from-number and
+                # destination prefix, so a throttled campaign does not hold up the others
+                result = process_campaign(campaign_id)
+                logger.info(f"Processed campaign {campaign_id}, result: {result}")
 
-            for campaign in scheduled_campaigns:
-                logger.info(f"Starting scheduled campaign {campaign.campaign_id}")
-                campaign.status = "running"
-                campaign.updated_at = now
+                if result:
+                    campaign_scheduler.record_dispatch(campaign_id, scheduling[campaign_id][1])
+                else:
+                    # Deferred or out of contacts: its other slots this cycle would fail the same way
+                    deferred.add(campaign_id)
 
-            db_session.commit()
-            close_db_session(db_session)
+            # Check for scheduled campaigns that should be started (once, by the leader)
+            if is_leader:
+                db_session = get_db_session_with_retry()
+                now = datetime.now()
+                scheduled_campaigns = db_session.query(Campaign).filter(
+                    and_(
+                        Campaign.status == "scheduled",
+                        Campaign.schedule_date <= now
+                    )
+                ).all()
+
+                for campaign in scheduled_campaigns:
+                    logger.info(f"Starting scheduled campaign {campaign.campaign_id}")
+                    campaign.status = "running"
+                    campaign.updated_at = now
+
+                db_session.commit()
+                close_db_session(db_session)
 
             # Wait before next polling cycle
             time.sleep(POLL_INTERVAL)
@@ -413,144 +493,463 @@ def execute_campaigns():
             time.sleep(POLL_INTERVAL)
 
 
+def finalize_finished_calls(db_session, campaign_ids):
+    """
+    Move the 'calling' contacts of these campaigns whose CallLog shows the call
+    has ended to their final status (see call_status_rules), with one
+    set-based UPDATE. Only the contacts that UPDATE changed are returned and
+    get additional_data rewritten (where its content changes), so a contact
+    the reaper released concurrently is left alone. Does not commit.
+    """
+    new_status = status_case(CallLog.call_state, CallLog.hangup_cause)
+    updated_ids = db_session.execute(
+        update(CampaignContact).where(
+            CampaignContact.campaign_id.in_(campaign_ids),
+            CampaignContact.status == "calling",
+            CallLog.call_uuid == CampaignContact.call_uuid,
+            new_status.isnot(None)
+        ).values(status=new_status).returning(CampaignContact.id).execution_options(synchronize_session=False)
+    ).scalars().all()
+    if not updated_ids:
+        return []
+
+    finished = db_session.query(
+        CampaignContact.id, CampaignContact.campaign_id, CampaignContact.call_uuid, CampaignContact.additional_data,
+        CampaignContact.status.label("new_status"), CallLog.id.label("call_log_id"), CallLog.ultravox_id,
+        CallLog.call_state, CallLog.hangup_cause, CallLog.call_duration
+    ).join(
+        CallLog, CallLog.call_uuid == CampaignContact.call_uuid
+    ).filter(
+        CampaignContact.id.in_(updated_ids)
+    ).all()
+
+    changed = []
+    for row in finished:
+        try:
+            additional_data = json.loads(row.additional_data) if row.additional_data else {}
+        except json.JSONDecodeError:
+            additional_data = {}
+        updated = dict(additional_data, call_log_state=row.call_state, call_log_hangup_cause=row.hangup_cause)
+        if row.call_duration:
+            updated["duration"] = row.call_duration
+        if updated != additional_data:
+            changed.append({"id": row.id, "additional_data": json.dumps(updated)})
+    if changed:
+        db_session.bulk_update_mappings(CampaignContact, changed)
+
+    return finished
+
+
 def update_call_statuses():
-    """Periodically check and update the status of active calls"""
+    """
+    Periodically finalize contacts whose call has ended. Statuses come from
+    CallLog, which the hangup webhook keeps current; calls whose webhook was
+    lost are reconciled against Plivo by reap_stuck_calls.
+    """
     while running:
+        if not owned_campaigns:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        db_session = None
         try:
             db_session = get_db_session_with_retry()
+            finished = finalize_finished_calls(db_session, list(owned_campaigns))
+            db_session.commit()
 
-            # Get contacts that are in 'calling' status and have a call_uuid
-            active_calls = db_session.query(CampaignContact).filter(
-                and_(
-                    CampaignContact.status == "calling",
-                    CampaignContact.call_uuid.isnot(None)
-                )
-            ).all()
+            for row in finished:
+                logger.info(f"Updated contact {row.id} status from 'calling' to '{row.new_status}'")
+                # The call has ended (either successfully or not): initiate analysis in a non-blocking way
+                if row.ultravox_id:
+                    threading.Thread(
+                        target=check_and_initiate_analysis,
+                        args=(row.ultravox_id, row.call_uuid, row.call_log_id)
+                    ).start()
 
-            if not active_calls:
-                close_db_session(db_session)
-                time.sleep(POLL_INTERVAL)
+            # Update progress for associated campaigns
+            for campaign_id in set(row.campaign_id for row in finished):
+                update_campaign_progress(campaign_id, db_session)
+
+        except Exception as e:
+            logger.error(f"Error updating call statuses: {str(e)}")
+            logger.error(traceback.format_exc())
+            if db_session:
+                db_session.rollback()
+        finally:
+            close_db_session(db_session)
+
+        # Wait before next update cycle
+        time.sleep(POLL_INTERVAL)
+
+
+def parse_duration_seconds(value, default=DEFAULT_MAX_DURATION):
+    """Convert an Ultravox duration string such as '180s' to seconds"""
+    if not value:
+        return default
+    try:
+        return int(float(str(value).strip().rstrip('s')))
+    except ValueError:
+        return default
+
+
+def reap_stuck_calls():
+    """
+    Release contacts stuck in 'calling' whose call should have ended by now
+    (max_duration plus STUCK_CALL_GRACE_PERIOD), e.g. because the hangup webhook
+    was lost or the server restarted mid-call. Stuck calls are reconciled in one
+    pass against CallLog and, where CallLog has no final state, against Plivo.
+    Returns the number of contacts released.
+    """
+    db_session = None
+    reaped = 0
+    try:
+        db_session = get_db_session_with_retry()
+        now = datetime.now()
+
+        # Cheap pre-filter: nothing younger than the grace period can be stuck
+        candidates = db_session.query(CampaignContact).filter(
+            and_(
+                CampaignContact.status == "calling",
+                CampaignContact.updated_at <= now - timedelta(seconds=STUCK_CALL_GRACE_PERIOD)
+            )
+        ).all()
+
+        if not candidates:
+            return 0
+
+        # A claim without a call_uuid may still have been dialed: attach the call it placed,
+        # so only claims that were never dialed go back to 'pending'
+        for contact in candidates:
+            if not contact.call_uuid:
+                placed = find_placed_call(db_session, contact)
+                if placed:
+                    logger.info(f"Attaching call {placed.call_uuid} to claimed contact {contact.id}")
+                    contact.call_uuid = placed.call_uuid
+
+        # Load the matching call logs in a single query
+        call_uuids = [contact.call_uuid for contact in candidates if contact.call_uuid]
+        call_logs = {}
+        if call_uuids:
+            call_logs = {
+                log.call_uuid: log
+                for log in db_session.query(CallLog).filter(CallLog.call_uuid.in_(call_uuids)).all()
+            }
+
+        plivo_client = None
+        finished = []
+
+        for contact in candidates:
+            call_log = call_logs.get(contact.call_uuid) if contact.call_uuid else None
+
+            # Work out when this call should have ended
+            started_at = (call_log.initiation_time if call_log and call_log.initiation_time else contact.updated_at)
+            max_duration = parse_duration_seconds(call_log.max_duration if call_log else None)
+            deadline = started_at + timedelta(seconds=max_duration + STUCK_CALL_GRACE_PERIOD)
+            if started_at.tzinfo is not None:
+                # Compare in local time, like the naive timestamps the rest of the schema uses
+                deadline = deadline.astimezone().replace(tzinfo=None)
+            if deadline > now:
                 continue
 
-            logger.info(f"Checking status for {len(active_calls)} active calls")
+            new_status = None
+            reason = None
 
-            for contact in active_calls:
+            if not contact.call_uuid:
+                # Claimed but never dialed (no call placed since the claim): put it back in the queue
+                new_status = "pending"
+                reason = "claimed without call_uuid"
+            elif call_log and status_for(call_log.call_state, call_log.hangup_cause):
+                new_status = status_for(call_log.call_state, call_log.hangup_cause)
+                reason = "call_log final state"
+            else:
+                # CallLog has no final state - ask Plivo directly
+                if plivo_client is None:
+                    plivo_client = plivo.RestClient(PLIVO_AUTH_ID, PLIVO_AUTH_TOKEN)
                 try:
-                    # Get call status from API
-                    response = requests.get(f"{API_BASE_URL}/call_status/{contact.call_uuid}")
-
-                    if response.status_code == 200:
-                        result = response.json()
-
-                        call_status = None
-                        additional_data = {}
-
-                        # Get existing additional data
-                        try:
-                            additional_data = json.loads(contact.additional_data) if contact.additional_data else {}
-                        except json.JSONDecodeError:
-                            additional_data = {}
-
-                        # Check if the call is completed
-                        if result.get("status") == "success":
-                            if result.get("call"):
-                                # For completed calls
-                                call_details = result.get("call")
-                                call_state = call_details.get("call_state")
-
-                                # Map call_state to contact status
-                                if call_state == "ANSWER":
-                                    call_status = "completed"
-                                elif call_state in ["NO_ANSWER", "BUSY", "TIMEOUT"]:
-                                    call_status = "no-answer"
-                                elif call_state == "FAILED" or call_state == "EARLY MEDIA":
-                                    call_status = "failed"
-
-                                # Store call details in contact's additional_data
-                                additional_data["call_details"] = call_details
-                                if call_details.get("call_duration"):
-                                    additional_data["duration"] = call_details.get("call_duration")
-
-                            elif result.get("call_status"):
-                                # For live calls
-                                live_status = result.get("call_status")
-
-                                # Only update if call is completed
-                                if live_status == "completed":
-                                    call_status = "completed"
-                                elif live_status == "no-answer" or live_status == "busy":
-                                    call_status = "no-answer"
-                                elif live_status == "failed":
-                                    call_status = "failed"
-
-                                # Store the status in additional_data
-                                additional_data["live_status"] = live_status
-
-                        # Also check call_logs table directly to get the most up-to-date status
-                        call_log = db_session.query(CallLog).filter_by(call_uuid=contact.call_uuid).first()
-                        if call_log:
-                            additional_data["call_log_state"] = call_log.call_state
-                            additional_data["call_log_hangup_cause"] = call_log.hangup_cause
-
-                            # If call_log has a final status but we haven't set a status yet
-                            if call_log.call_state and not call_status:
-                                if call_log.call_state == "ANSWER":
-                                    call_status = "completed"
-                                elif call_log.call_state in ["NO_ANSWER", "BUSY", "TIMEOUT"]:
-                                    call_status = "no-answer"
-                                elif call_log.call_state in ["FAILED", "EARLY MEDIA"]:
-                                    call_status = "failed"
-
-                            # Also check hangup cause
-                            if call_log.hangup_cause and not call_status:
-                                if call_log.hangup_cause == "NORMAL_CLEARING":
-                                    call_status = "completed"
-                                elif call_log.hangup_cause in ["NO_ANSWER", "NO_USER_RESPONSE", "USER_BUSY"]:
-                                    call_status = "no-answer"
-                                elif call_log.hangup_cause:  # Any other hangup cause
-                                    call_status = "failed"
-
-                        # Update the contact if we have a final status
-                        if call_status:
-                            logger.info(f"Updating contact {contact.id} status from 'calling' to '{call_status}'")
-                            contact.status = call_status
-
-                            # If call has completed (either successfully or not), initiate analysis
-                            if call_status in ["completed", "failed", "no-answer"] and call_log and call_log.ultravox_id:
-                                # Trigger analysis in a non-blocking way
-                                threading.Thread(
-                                    target=check_and_initiate_analysis,
-                                    args=(call_log.ultravox_id, contact.call_uuid, call_log.id)
-                                ).start()
-
-                        # Always update additional_data
-                        contact.additional_data = json.dumps(additional_data)
-
-                except Exception as call_err:
-                    logger.error(f"Error checking call status for contact {contact.id}: {str(call_err)}")
+                    details = plivo_client.calls.get(contact.call_uuid)
+                    call_state = getattr(details, 'call_state', None)
+                    hangup_cause = getattr(details, 'hangup_cause_name', None)
+                    new_status = status_for(call_state, hangup_cause) or "failed"
+                    reason = "plivo call record"
+
+                    if call_log:
+                        call_log.call_state = call_state
+                        call_log.hangup_cause = hangup_cause
+                        call_log.end_time = call_log.end_time or now
+                except plivo.exceptions.ResourceNotFoundError:
+                    try:
+                        plivo_client.live_calls.get(contact.call_uuid)
+                        logger.info(f"Contact {contact.id} call {contact.call_uuid} is still live, not reaping")
+                        continue
+                    except plivo.exceptions.ResourceNotFoundError:
+                        new_status = "failed"
+                        reason = "call not found in Plivo"
+                except Exception as plivo_err:
+                    logger.warning(f"Could not reconcile call {contact.call_uuid} with Plivo: {str(plivo_err)}")
+                    continue
 
-            # Update progress for associated campaigns
-            campaign_ids = set([contact.campaign_id for contact in active_calls if contact.campaign_id])
-            for campaign_id in campaign_ids:
+            try:
+                additional_data = json.loads(contact.additional_data) if contact.additional_data else {}
+            except json.JSONDecodeError:
+                additional_data = {}
+            additional_data["reaped"] = {
+                "at": now.isoformat(),
+                "reason": reason,
+                "previous_call_uuid": contact.call_uuid
+            }
+
+            logger.info(f"Reaping contact {contact.id} (call {contact.call_uuid}): 'calling' -> '{new_status}' ({reason})")
+            contact.status = new_status
+            contact.additional_data = json.dumps(additional_data)
+            if new_status == "pending":
+                contact.call_uuid = None
+            reaped_calls.inc(label=new_status)
+            reaped += 1
+
+            if new_status != "pending" and call_log and call_log.ultravox_id:
+                finished.append((call_log.ultravox_id, contact.call_uuid, call_log.id))
+
+        db_session.commit()
+
+        # Kick off analysis for calls that reached a final state
+        for ultravox_id, call_uuid, call_log_id in finished:
+            threading.Thread(
+                target=check_and_initiate_analysis,
+                args=(ultravox_id, call_uuid, call_log_id)
+            ).start()
+
+        if reaped:
+            for campaign_id in set(contact.campaign_id for contact in candidates):
                 update_campaign_progress(campaign_id, db_session)
+            logger.info(f"Reaper released {reaped} stuck contact(s)")
 
-            db_session.commit()
+        return reaped
+
+    except Exception as e:
+        logger.error(f"Error reaping stuck calls: {str(e)}")
+        logger.error(traceback.format_exc())
+        return reaped
+    finally:
+        reaper_last_run.set(time.time())
+        if db_session:
             close_db_session(db_session)
 
-            # Wait before next update cycle
-            time.sleep(POLL_INTERVAL)
 
-        except Exception as e:
-            logger.error(f"Error updating call statuses: {str(e)}")
-            logger.error(traceback.format_exc())
+def run_reaper():
+    """Periodically release contacts stuck in 'calling'"""
+    while running:
+        if is_leader:
+            reap_stuck_calls()
+        time.sleep(REAPER_INTERVAL)
+
+
+def snapshot_state():
+    """Executor state that must survive a restart or a change of leader"""
+    return {
+        "scheduler": campaign_scheduler.export_state(),
+        "reaped_calls": reaped_calls.snapshot(),
+        "saved_at": datetime.now().isoformat()
+    }
+
+
+def restore_state(state):
+    """Load state saved by a previous leader"""
+    if not state:
+        return
+
+    campaign_scheduler.import_state(state.get("scheduler"))
+    logger.info(f"Restored executor state saved at {state.get('saved_at')}")
+
+
+def find_placed_call(db_session, contact):
+    """
+    The CallLog of the call placed for a claimed contact that never got its
+    call_uuid (e.g. make_call's response was lost after Plivo placed the call),
+    or None if no call was placed since the claim.
+    """
+    return db_session.query(CallLog).filter(
+        and_(
+            CallLog.campaign_id == contact.campaign_id,
+            CallLog.to_number == contact.phone,
+            CallLog.initiation_time >= contact.updated_at - timedelta(seconds=CLAIM_TIMEOUT)
+        )
+    ).order_by(CallLog.initiation_time.desc()).first()
+
+
+def recover_inflight_claims(db_session, campaign_ids=None):
+    """
+    Resolve contacts that were claimed ('calling') but never got a call_uuid because
+    the previous process stopped between claiming and recording the dial result.
+    If a CallLog shows the call was placed, attach it; otherwise return the contact
+    to 'pending' so it is dialed exactly once. Limited to `campaign_ids` when given.
+    """
+    cutoff = datetime.now() - timedelta(seconds=CLAIM_TIMEOUT)
+    query = db_session.query(CampaignContact).filter(
+        and_(
+            CampaignContact.status == "calling",
+            CampaignContact.call_uuid.is_(None),
+            CampaignContact.updated_at <= cutoff
+        )
+    )
+    if campaign_ids is not None:
+        query = query.filter(CampaignContact.campaign_id.in_(list(campaign_ids)))
+    claims = query.all()
+
+    attached = 0
+    released = 0
+    for contact in claims:
+        call_log = find_placed_call(db_session, contact)
+        if call_log:
+            contact.call_uuid = call_log.call_uuid
+            attached += 1
+        else:
+            contact.status = "pending"
+            released += 1
+
+    db_session.commit()
+    if claims:
+        logger.info(f"Recovered {len(claims)} in-flight claims: {attached} attached to placed calls, {released} re-queued")
+
+
+def recover_pending_analyses(db_session):
+    """Re-queue analysis for recently finished calls whose analysis never completed"""
+    since = datetime.now() - timedelta(hours=RECOVERY_ANALYSIS_WINDOW_HOURS)
+    rows = db_session.query(CallLog.ultravox_id, CallLog.call_uuid, CallLog.id).join(
+        CampaignContact, CampaignContact.call_uuid == CallLog.call_uuid
+    ).outerjoin(
+        CallAnalysisStatus, CallAnalysisStatus.call_uuid == CallLog.call_uuid
+    ).filter(
+        and_(
+            CampaignContact.status.in_(FINAL_STATUSES),
+            CampaignContact.updated_at >= since,
+            CallLog.ultravox_id.isnot(None),
+            (CallAnalysisStatus.id.is_(None)) | (CallAnalysisStatus.is_complete == False)
+        )
+    ).limit(RECOVERY_ANALYSIS_LIMIT).all()
+
+    for ultravox_id, call_uuid, call_log_id in rows:
+        threading.Thread(
+            target=check_and_initiate_analysis,
+            args=(ultravox_id, call_uuid, call_log_id)
+        ).start()
+
+    if rows:
+        logger.info(f"Re-queued analysis for {len(rows)} calls")
+
+
+def recover_after_takeover():
+    """Resume work left behind by a previous leader (claims are recovered per campaign as leases move)"""
+    db_session = None
+    try:
+        db_session = get_db_session_with_retry()
+        recover_pending_analyses(db_session)
+    except Exception as e:
+        logger.error(f"Error recovering executor state: {str(e)}")
+        logger.error(traceback.format_exc())
+    finally:
+        if db_session:
+            close_db_session(db_session)
 
-            try:
-                close_db_session(db_session)
-            except:
-                pass
 
-            time.sleep(POLL_INTERVAL)
+def recover_campaign_claims(campaign_ids):
+    """Resolve claims a previous owner left behind on campaigns this node just took over"""
+    db_session = None
+    try:
+        db_session = get_db_session_with_retry()
+        recover_inflight_claims(db_session, campaign_ids)
+    except Exception as e:
+        logger.error(f"Error recovering claims for campaigns {sorted(campaign_ids)}: {str(e)}")
+    finally:
+        if db_session:
+            close_db_session(db_session)
+
+
+def rebalance_campaigns():
+    """
+    Shard running campaigns across live nodes. Each campaign is assigned by
+    rendezvous hashing over the nodes with a recent heartbeat; this node renews
+    leases for the campaigns assigned to it and releases the rest so their new
+    owner can pick them up. The lease, not the hash, is what allows dialing, so
+    two nodes with a momentarily different view of the membership never dial
+    the same campaign. The leader also deletes the leases of completed and
+    deleted campaigns.
+    """
+    global owned_campaigns
+
+    db_session = get_db_session_with_retry()
+    try:
+        statuses = dict(db_session.query(Campaign.campaign_id, Campaign.status).filter(
+            Campaign.status.in_(LEASED_CAMPAIGN_STATUSES)).all())
+    finally:
+        close_db_session(db_session)
+    running_ids = set(campaign_id for campaign_id, status in statuses.items() if status == "running")
+
+    if is_leader:
+        executor_state.delete_campaign_leases(statuses.keys())
+
+    nodes = executor_state.get_live_nodes()
+    if executor_state.NODE_ID not in nodes:
+        nodes.append(executor_state.NODE_ID)
+
+    assigned = set(
+        campaign_id for campaign_id in running_ids
+        if executor_state.owner_for(executor_state.campaign_lease_key(campaign_id), nodes) == executor_state.NODE_ID
+    )
+
+    for campaign_id in owned_campaigns - assigned:
+        executor_state.release_lease(executor_state.campaign_lease_key(campaign_id))
+        logger.info(f"Handing off campaign {campaign_id}")
+
+    held = set()
+    for campaign_id in assigned:
+        acquired, _ = executor_state.acquire_lease(executor_state.campaign_lease_key(campaign_id))
+        if acquired:
+            held.add(campaign_id)
+
+    taken_over = held - owned_campaigns
+    if taken_over:
+        logger.info(f"Node {executor_state.NODE_ID} took over campaigns {sorted(taken_over)} ({len(nodes)} live nodes)")
+        recover_campaign_claims(taken_over)
+
+    owned_campaigns = held
+
+
+def release_campaigns():
+    """Release every campaign lease held by this node"""
+    global owned_campaigns
 
+    for campaign_id in owned_campaigns:
+        executor_state.release_lease(executor_state.campaign_lease_key(campaign_id))
+    owned_campaigns = set()
+
+
+def run_heartbeat():
+    """Heartbeat this node, hold (or wait for) the leader lease and rebalance campaigns"""
+    global is_leader, owned_campaigns
+
+    while running:
+        try:
+            state = snapshot_state()
+            executor_state.heartbeat(state)
+            held, stored_state = executor_state.acquire_lease(executor_state.LEADER_LEASE, state)
+
+            if held and not is_leader:
+                logger.info(f"Node {executor_state.NODE_ID} is now the campaign executor leader")
+                restore_state(stored_state)
+                recover_after_takeover()
+            elif is_leader and not held:
+                logger.warning(f"Node {executor_state.NODE_ID} lost the leader lease, standing by")
+
+            is_leader = held
+            rebalance_campaigns()
+        except Exception as e:
+            # If we cannot prove we hold our leases, stop dialing
+            logger.error(f"Error in executor heartbeat: {str(e)}")
+            logger.error(traceback.format_exc())
+            is_leader = False
+            owned_campaigns = set()
+
+        time.sleep(executor_state.HEARTBEAT_INTERVAL)
 
 
 def start_executor():
@@ -563,6 +962,11 @@ def start_executor():
 
     running = True
 
+    # Start the heartbeat thread, which decides whether this node leads or stands by
+    heartbeat_thread = threading.Thread(target=run_heartbeat)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+
     # Start the main executor thread
     executor_thread = threading.Thread(target=execute_campaigns)
     executor_thread.daemon = True
@@ -573,13 +977,18 @@ def start_executor():
     status_thread.daemon = True
     status_thread.start()
 
+    # Start the stuck-call reaper thread
+    reaper_thread = threading.Thread(target=run_reaper)
+    reaper_thread.daemon = True
+    reaper_thread.start()
+
     logger.info("Campaign executor started")
     return True
 
 
 def stop_executor():
     """Stop the campaign executor thread"""
-    global running, executor_thread
+    global running, is_leader, executor_thread
 
     if not running:
         logger.warning("Campaign executor already stopped")
@@ -591,6 +1000,13 @@ def stop_executor():
         executor_thread.join(timeout=5.0)
         executor_thread = None
 
+    # Hand our leases and state to the remaining nodes straight away
+    release_campaigns()
+    if is_leader:
+        executor_state.release_lease(executor_state.LEADER_LEASE, snapshot_state())
+        is_leader = False
+    executor_state.retire_node()
+
     logger.info("Campaign executor stopped")
     return True
 
@@ -619,7 +1035,7 @@ def update_campaign_progress(campaign_id, db_session=None):
         completed_contacts = db_session.query(func.count(CampaignContact.id)).filter(
             and_(
                 CampaignContact.campaign_id == campaign_id,
-                CampaignContact.status.in_(["completed", "failed", "no-answer"])
+                CampaignContact.status.in_(FINAL_STATUSES)
             )
         ).scalar() or 0
 
@@ -764,6 +1180,11 @@ def check_and_initiate_analysis(ultravox_call_id, call_uuid, call_log_id=None):
                 # Recording is available
                 analysis_status.has_recording = True
                 logger.info(f"Recording available for call {call_uuid}")
+
+                # Archive it now rather than waiting for the archiver's next sweep
+                archive_call_id = call_log_id or db_session.query(CallLog.id).filter_by(call_uuid=call_uuid).scalar()
+                if archive_call_id:
+                    recording_archiver.enqueue(archive_call_id)
             else:
                 logger.info(f"Recording not yet available for call {call_uuid}: {recording_response.status_code}")
 
@@ -787,9 +1208,15 @@ def check_and_initiate_analysis(ultravox_call_id, call_uuid, call_log_id=None):
             else:
                 logger.info(f"Analytics not yet available for call {call_uuid}: {analytics_response.status_code}")
 
-        # Check for entity extraction (additional analysis) - no need to track this
-        entities_url = f"{API_BASE_URL}/analyze_transcript/{ultravox_call_id}"
-        entities_response = requests.get(entities_url)
+        # Queue entity extraction (additional analysis) - no need to track this. Trivial
+        # calls are labelled locally (also without a transcript, from the hangup cause);
+        # the rest is rate limited, packed and stored by the extraction service
+        try:
+            extraction_call_id = call_log_id or db_session.query(CallLog.id).filter_by(call_uuid=call_uuid).scalar()
+            if extraction_call_id:
+                queue_call_extraction(extraction_call_id)
+        except Exception as e:
+            logger.error(f"Error queueing entity extraction for call {call_uuid}: {str(e)}")
 
         # Check if all required components are available
         is_complete = analysis_status.has_transcript and analysis_status.has_recording and analysis_status.has_summary
@@ -842,11 +1269,12 @@ def initialize():
         if running_campaigns:
             logger.info(f"Found {len(running_campaigns)} campaigns in 'running' state at startup")
 
-            # Auto-start the executor if there are running campaigns
-            start_executor()
-
         close_db_session(db_session)
 
+        # Always start: the node either takes the leader lease and resumes from the
+        # persisted state, or stands by until the current leader stops heartbeating
+        start_executor()
+
     except Exception as e:
         logger.error(f"Error initializing campaign executor: {str(e)}")
         logger.error(traceback.format_exc())
@@ -0,0 +1,276 @@
+import json
+from collections import Counter
+from sqlalchemy.exc import IntegrityError
+from models import CallLog, CallAnalytics, CallLogArchive, CallAnalyticsArchive, CampaignAnalyticsRollup
+from data_archiver import contact_status_counts
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("campaign_rollup", "campaign_rollup.log")
+
+SENTIMENTS = ("positive", "neutral", "negative", "mixed")
+DURATION_PERCENTILES = (50, 75, 90, 95, 99)
+MAX_TOPIC_LENGTH = 100  # Longer topic strings are truncated before counting
+DEFAULT_TOP_TOPICS = 10
+CALL_SOURCES = ((CallAnalytics, CallLog), (CallAnalyticsArchive, CallLogArchive))  # Hot, then archived calls
+
+
+def _entities(analytics):
+    if not analytics or not analytics.entities_extracted:
+        return None
+    try:
+        entities = json.loads(analytics.entities_extracted)
+    except json.JSONDecodeError:
+        return None
+    return entities if isinstance(entities, dict) else None
+
+
+def _topics(entities):
+    topics = entities.get("topics") or []
+    if isinstance(topics, str):
+        topics = [topics]
+    normalized = set()
+    for topic in topics if isinstance(topics, list) else []:
+        if isinstance(topic, str) and topic.strip():
+            normalized.add(topic.strip().lower()[:MAX_TOPIC_LENGTH])
+    return sorted(normalized)
+
+
+def _sentiment(entities):
+    sentiment = entities.get("sentiment")
+    if not isinstance(sentiment, str) or not sentiment.strip():
+        return "unknown"
+    sentiment = sentiment.strip().lower()
+    return sentiment if sentiment in SENTIMENTS else "other"
+
+
+def _contribution(analytics, call_log):
+    """What one call adds to its campaign's rollup, or None if it adds nothing"""
+    if not analytics or not call_log or not call_log.campaign_id:
+        return None
+
+    duration = analytics.total_duration or call_log.call_duration
+    entities = _entities(analytics)
+    if entities is None and not duration:
+        return None
+
+    return {
+        "campaign_id": call_log.campaign_id,
+        "analyzed": entities is not None,
+        "sentiment": _sentiment(entities) if entities is not None else None,
+        "topics": _topics(entities) if entities is not None else [],
+        "duration": int(duration) if duration else None
+    }
+
+
+class _RollupCounts:
+    """Mutable view of a rollup row's counters"""
+
+    def __init__(self, rollup=None):
+        self.analyzed_calls = (rollup.analyzed_calls or 0) if rollup else 0
+        self.sentiments = Counter(self._load(rollup.sentiment_counts) if rollup else {})
+        self.topics = Counter(self._load(rollup.topic_counts) if rollup else {})
+        self.durations = Counter(self._load(rollup.duration_counts) if rollup else {})
+
+    @staticmethod
+    def _load(value):
+        try:
+            return json.loads(value) if value else {}
+        except json.JSONDecodeError:
+            return {}
+
+    def apply(self, contribution, sign):
+        if not contribution:
+            return
+        if contribution["analyzed"]:
+            self.analyzed_calls += sign
+            self.sentiments[contribution["sentiment"]] += sign
+            for topic in contribution["topics"]:
+                self.topics[topic] += sign
+        if contribution["duration"]:
+            self.durations[str(contribution["duration"])] += sign
+
+    def store(self, rollup):
+        rollup.analyzed_calls = max(self.analyzed_calls, 0)
+        rollup.sentiment_counts = json.dumps({k: v for k, v in self.sentiments.items() if v > 0})
+        rollup.topic_counts = json.dumps({k: v for k, v in self.topics.items() if v > 0})
+        rollup.duration_counts = json.dumps({k: v for k, v in self.durations.items() if v > 0})
+
+
+def _locked_rollup(db_session, campaign_id):
+    """The campaign's rollup row, locked for the rest of the transaction (created if missing)"""
+    def locked():
+        return db_session.query(CampaignAnalyticsRollup).filter_by(
+            campaign_id=campaign_id).with_for_update().populate_existing().first()
+
+    rollup = locked()
+    if rollup:
+        return rollup
+
+    # First analysed call of the campaign: create the row, unless another request just did
+    try:
+        with db_session.begin_nested():
+            db_session.add(CampaignAnalyticsRollup(campaign_id=campaign_id, analyzed_calls=0))
+    except IntegrityError:
+        pass
+    return locked()
+
+
+def update_rollup_for_call(db_session, call_log_id):
+    """
+    Fold a call's current analysis into its campaign rollup and commit. The
+    call's previous contribution is stored with its analytics and subtracted
+    first, so re-analysing a call does not count it twice. Returns True if the
+    rollup changed.
+    """
+    call_log = db_session.query(CallLog).filter_by(id=call_log_id).first()
+    if not call_log:
+        return False
+
+    analytics = db_session.query(CallAnalytics).filter_by(call_id=call_log_id).first()
+    if not analytics:
+        return False
+
+    campaign_id = call_log.campaign_id
+    if not campaign_id and not analytics.rollup_contribution:
+        return False
+
+    # Lock before reading the stored contribution so concurrent updates of the
+    # same call serialize on the rollup row
+    rollup = _locked_rollup(db_session, campaign_id) if campaign_id else None
+    db_session.refresh(analytics)
+
+    old = _RollupCounts._load(analytics.rollup_contribution) or None
+    new = _contribution(analytics, call_log)
+    if old == new:
+        db_session.commit()
+        return False
+
+    if old and old.get("campaign_id") != campaign_id:
+        # The call moved away from the campaign it was counted in
+        previous = db_session.query(CampaignAnalyticsRollup).filter_by(
+            campaign_id=old["campaign_id"]).with_for_update().first()
+        if previous:
+            counts = _RollupCounts(previous)
+            counts.apply(old, -1)
+            counts.store(previous)
+        old = None
+
+    if rollup:
+        counts = _RollupCounts(rollup)
+        counts.apply(old, -1)
+        counts.apply(new, 1)
+        counts.store(rollup)
+
+    analytics.rollup_contribution = json.dumps(new) if new else None
+    db_session.commit()
+    return True
+
+
+def _campaign_analytics(db_session, campaign_id):
+    """(analytics, call) pairs for a campaign's calls, hot and archived"""
+    return [row for analytics, call in CALL_SOURCES
+            for row in db_session.query(analytics, call).join(
+                call, call.id == analytics.call_id
+            ).filter(call.campaign_id == campaign_id).all()]
+
+
+def rebuild_rollup(db_session, campaign_id):
+    """Recompute a campaign's rollup from all of its calls' analytics, archived ones included, and commit"""
+    rollup = _locked_rollup(db_session, campaign_id)
+    counts = _RollupCounts()
+
+    rows = _campaign_analytics(db_session, campaign_id)
+
+    for analytics, call_log in rows:
+        contribution = _contribution(analytics, call_log)
+        counts.apply(contribution, 1)
+        value = json.dumps(contribution) if contribution else None
+        if analytics.rollup_contribution != value:
+            analytics.rollup_contribution = value
+
+    counts.store(rollup)
+    db_session.commit()
+    logger.info(f"Rebuilt analytics rollup for campaign {campaign_id} from {len(rows)} calls")
+    return rollup
+
+
+def delete_rollup(db_session, campaign_id):
+    """Remove a campaign's rollup; call inside the transaction deleting the campaign"""
+    db_session.query(CampaignAnalyticsRollup).filter_by(campaign_id=campaign_id).delete(
+        synchronize_session=False)
+
+
+def _duration_stats(durations):
+    """Count, average and nearest-rank percentiles from {seconds: calls}"""
+    values = sorted((int(seconds), calls) for seconds, calls in durations.items() if calls > 0)
+    total = sum(calls for _, calls in values)
+    if not total:
+        return {"calls": 0, "avg": None, "min": None, "max": None,
+                "percentiles": {f"p{p}": None for p in DURATION_PERCENTILES}}
+
+    percentiles = {}
+    targets = [(p, max(1, -(-p * total // 100))) for p in DURATION_PERCENTILES]
+    cumulative = 0
+    for seconds, calls in values:
+        cumulative += calls
+        while targets and cumulative >= targets[0][1]:
+            percentiles[f"p{targets.pop(0)[0]}"] = seconds
+
+    return {
+        "calls": total,
+        "avg": round(sum(seconds * calls for seconds, calls in values) / total, 1),
+        "min": values[0][0],
+        "max": values[-1][0],
+        "percentiles": percentiles
+    }
+
+
+def _funnel(db_session, campaign_id, counts):
+    """Contacts -> dialed -> connected -> analysed -> positive, from grouped status counts (hot and archived)"""
+    statuses = contact_status_counts(db_session, campaign_id)
+
+    total = sum(statuses.values())
+    return {
+        "contacts": total,
+        "dialed": total - statuses.get("pending", 0),
+        "connected": statuses.get("completed", 0),
+        "analyzed": counts.analyzed_calls,
+        "positive": counts.sentiments.get("positive", 0),
+        "statuses": statuses
+    }
+
+
+def get_campaign_analytics(db_session, campaign_id, top_topics=DEFAULT_TOP_TOPICS, rebuild=False):
+    """The campaign results page in one payload, read from the precomputed rollup"""
+    rollup = db_session.query(CampaignAnalyticsRollup).filter_by(campaign_id=campaign_id).first()
+
+    if rebuild or rollup is None:
+        # Campaigns analysed before the rollup existed are backfilled on first read
+        has_analytics = any(
+            db_session.query(analytics.id).join(call, call.id == analytics.call_id).filter(
+                call.campaign_id == campaign_id).first()
+            for analytics, call in CALL_SOURCES)
+        if rebuild or has_analytics:
+            rollup = rebuild_rollup(db_session, campaign_id)
+
+    counts = _RollupCounts(rollup)
+    analyzed = counts.analyzed_calls
+
+    sentiment = {name: counts.sentiments.get(name, 0) for name in SENTIMENTS}
+    sentiment.update({name: calls for name, calls in counts.sentiments.items() if name not in sentiment})
+
+    return {
+        "campaign_id": campaign_id,
+        "analyzed_calls": analyzed,
+        "sentiment": {
+            "counts": sentiment,
+            "percentages": {name: round(calls * 100 / analyzed, 1) if analyzed else 0
+                            for name, calls in sentiment.items()}
+        },
+        "top_topics": [{"topic": topic, "calls": calls}
+                       for topic, calls in counts.topics.most_common(top_topics)],
+        "funnel": _funnel(db_session, campaign_id, counts),
+        "duration": _duration_stats(counts.durations),
+        "updated_at": rollup.updated_at.isoformat() if rollup and rollup.updated_at else None
+    }
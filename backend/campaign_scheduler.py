@@ -0,0 +1,158 @@
+import json
+import math
+import threading
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("campaign_scheduler", "campaign_scheduler.log")
+
+# Scheduling defaults (overridable per campaign through config["priority"] / config["weight"] /
+# config["max_concurrent_calls"])
+DEFAULT_PRIORITY = 0  # Higher priority lanes are served first
+DEFAULT_WEIGHT = 1.0  # Share of dial capacity within a lane
+LINES_PER_WEIGHT = 1  # Default concurrent calls per unit of weight, so a heavier campaign can hold more lines
+STARVATION_CYCLES = 5  # Cycles an eligible campaign may be passed over before it is served regardless of lane
+
+
+def get_scheduling_config(campaign):
+    """Read priority, weight and concurrent call limit from a campaign's config JSON"""
+    priority = DEFAULT_PRIORITY
+    weight = DEFAULT_WEIGHT
+    max_lines = None
+
+    if campaign.config:
+        try:
+            config_data = json.loads(campaign.config)
+            priority = int(config_data.get("priority", DEFAULT_PRIORITY))
+            weight = float(config_data.get("weight", DEFAULT_WEIGHT))
+            if config_data.get("max_concurrent_calls") is not None:
+                max_lines = int(config_data["max_concurrent_calls"])
+        except (json.JSONDecodeError, TypeError, ValueError):
+            logger.warning(f"Invalid scheduling config for campaign {campaign.campaign_id}, using defaults")
+
+    if weight <= 0:
+        weight = DEFAULT_WEIGHT
+    if max_lines is None or max_lines <= 0:
+        max_lines = max(1, math.ceil(weight * LINES_PER_WEIGHT))
+
+    return priority, weight, max_lines
+
+
+class CampaignScheduler:
+    """
+    Weighted fair queueing across running campaigns.
+
+    Each campaign carries a virtual finish tag that advances by 1/weight every
+    time it is given a call, so over time campaigns in the same lane receive calls
+    in proportion to their weights. A campaign with several free lines can be
+    given several slots in one cycle. Lanes (priorities) are served highest first,
+    and any campaign passed over for STARVATION_CYCLES cycles jumps the queue.
+    Tags are kept while a campaign is running, including cycles where all its
+    lines are busy, and dropped once it stops.
+    """
+
+    def __init__(self):
+        self.virtual_time = 0.0
+        self.finish_tags = {}
+        self.waiting_cycles = {}
+        self.lock = threading.Lock()
+
+    def select(self, campaigns, slots, running_ids=None):
+        """
+        Choose which campaigns get a dial slot this cycle.
+
+        campaigns: list of (campaign_id, priority, weight, free_lines) for campaigns able to dial
+        slots: number of calls that may be started this cycle
+        running_ids: all running campaigns, including those with no free line this cycle
+            (defaults to the campaigns passed in)
+        Returns campaign IDs in the order they should be served, one entry per slot.
+        """
+        with self.lock:
+            eligible_ids = set(campaign_id for campaign_id, _, _, _ in campaigns)
+            running_ids = eligible_ids | set(running_ids if running_ids is not None else ())
+
+            # Forget campaigns that stopped running so they restart fairly if they return
+            for campaign_id in list(self.finish_tags):
+                if campaign_id not in running_ids:
+                    del self.finish_tags[campaign_id]
+                    self.waiting_cycles.pop(campaign_id, None)
+
+            for campaign_id in eligible_ids:
+                # New arrivals start at the current virtual time and cannot claim past capacity
+                self.finish_tags.setdefault(campaign_id, self.virtual_time)
+                self.waiting_cycles.setdefault(campaign_id, 0)
+
+            slots = max(slots, 0)
+            weights = {c[0]: c[2] for c in campaigns}
+            free_lines = {c[0]: c[3] for c in campaigns}
+            selected = []
+
+            # Starved campaigns are served one slot each first
+            starved = sorted(
+                [c for c in campaigns if self.waiting_cycles[c[0]] >= STARVATION_CYCLES and c[3] > 0],
+                key=lambda c: -self.waiting_cycles[c[0]]
+            )
+            for campaign_id, _, _, _ in starved[:slots]:
+                selected.append(campaign_id)
+                free_lines[campaign_id] -= 1
+
+            # Fill the remaining slots by lane and finish tag, charging each pick
+            # provisionally the way record_dispatch will
+            tags = {c[0]: self.finish_tags[c[0]] for c in campaigns}
+            for campaign_id in selected:
+                tags[campaign_id] = max(self.virtual_time, tags[campaign_id]) + 1.0 / weights[campaign_id]
+            while len(selected) < slots:
+                candidates = [c for c in campaigns if free_lines[c[0]] > 0]
+                if not candidates:
+                    break
+                campaign_id = min(candidates, key=lambda c: (-c[1], tags[c[0]], c[0]))[0]
+                selected.append(campaign_id)
+                free_lines[campaign_id] -= 1
+                tags[campaign_id] = max(self.virtual_time, tags[campaign_id]) + 1.0 / weights[campaign_id]
+
+            for campaign_id in eligible_ids:
+                if campaign_id in selected:
+                    self.waiting_cycles[campaign_id] = 0
+                else:
+                    self.waiting_cycles[campaign_id] += 1
+
+            return selected
+
+    def record_dispatch(self, campaign_id, weight):
+        """Charge a campaign for a call it started"""
+        with self.lock:
+            start = max(self.virtual_time, self.finish_tags.get(campaign_id, self.virtual_time))
+            self.finish_tags[campaign_id] = start + 1.0 / weight
+            self.virtual_time = start
+
+    def export_state(self):
+        """Serializable scheduler state for persisting across restarts"""
+        with self.lock:
+            return {
+                "virtual_time": self.virtual_time,
+                "finish_tags": {str(k): v for k, v in self.finish_tags.items()},
+                "waiting_cycles": {str(k): v for k, v in self.waiting_cycles.items()}
+            }
+
+    def import_state(self, state):
+        """Restore scheduler state saved by export_state"""
+        if not state:
+            return
+
+        with self.lock:
+            self.virtual_time = float(state.get("virtual_time", 0.0))
+            self.finish_tags = {int(k): float(v) for k, v in state.get("finish_tags", {}).items()}
+            self.waiting_cycles = {int(k): int(v) for k, v in state.get("waiting_cycles", {}).items()}
+
+    def status(self):
+        """Snapshot of scheduler state for diagnostics"""
+        with self.lock:
+            return {
+                "virtual_time": round(self.virtual_time, 4),
+                "finish_tags": {str(k): round(v, 4) for k, v in self.finish_tags.items()},
+                "waiting_cycles": {str(k): v for k, v in self.waiting_cycles.items()}
+            }
+
+
+# Shared scheduler used by the campaign executor
+campaign_scheduler = CampaignScheduler()
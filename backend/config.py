@@ -88,6 +88,29 @@ PLIVO_PHONE_NUMBER = os.getenv('PLIVO_PHONE_NUMBER')
 ULTRAVOX_API_KEY = os.getenv('ULTRAVOX_API_KEY', 'pNdPGbt6.pewiRrPNU7vTY4zs9JsCDO8X9s4YYtvo')
 ULTRAVOX_API_BASE_URL = "https://api.ultravox.ai/api"
 
+# --- OpenAI Configuration ---
+OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+
+# --- Recording Archive Configuration ---
+RECORDING_ARCHIVE_DIR = os.getenv('RECORDING_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        'recording_archive'))
+RECORDING_ARCHIVE_FORMAT = os.getenv('RECORDING_ARCHIVE_FORMAT', 'original')  # 'original' or 'opus' (needs ffmpeg)
+# Base URL other nodes reach this one on (e.g. http://10.0.0.4:5000). Set it when RECORDING_ARCHIVE_DIR is
+# node-local, so other nodes proxy archived recordings from the node holding them; leave unset for shared storage.
+NODE_INTERNAL_URL = (os.getenv('NODE_INTERNAL_URL') or '').rstrip('/') or None
+
+# --- Data Archival ---
+ARCHIVE_CALLS_AFTER_DAYS = int(os.getenv('ARCHIVE_CALLS_AFTER_DAYS', 90))  # Calls older than this move to call_logs_archive
+ARCHIVE_CONTACTS_AFTER_DAYS = int(os.getenv('ARCHIVE_CONTACTS_AFTER_DAYS', 30))  # ...and contacts of campaigns completed this long ago
+
+# --- Parquet Export ---
+PARQUET_EXPORT_DIR = os.getenv('PARQUET_EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                  'parquet_export'))
+PARQUET_EXPORT_INTERVAL = int(os.getenv('PARQUET_EXPORT_INTERVAL', 0))  # Seconds between runs; 0 = run parquet_export.py from cron
+
+# --- Schema Migrations ---
+MIGRATE_ON_STARTUP = os.getenv('MIGRATE_ON_STARTUP', 'true').lower() in ['true', '1', 'yes']  # Else run migrations.py
+
 # --- Server Configuration ---
 NGROK_URL = os.getenv('NGROK_URL')
 DEFAULT_RECIPIENT_NUMBER = os.getenv('DEFAULT_RECIPIENT_NUMBER', '+918879415567')
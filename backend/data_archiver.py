@@ -0,0 +1,248 @@
+"""
+Hot/cold split of call data.
+
+call_logs and campaign_contacts only need recent history; everything older
+moves to the *_archive tables (same columns, same ids) so the hot tables and
+their indexes stay small. The archival job moves, in keyset batches paced by
+migrations.Throttle:
+
+  - calls older than ARCHIVE_CALLS_AFTER_DAYS, with their call_analytics row,
+    unless their campaign is still created/running/paused
+  - contacts of campaigns completed more than ARCHIVE_CONTACTS_AFTER_DAYS ago
+
+The find_* helpers below check the hot table first and fall back to the
+archive, so read paths keep working for archived rows. Archived calls may
+still cache API responses, but are never re-analysed: their analytics stay as
+they were when the call was archived, and campaign_rollup rebuilds still
+count them.
+
+    python data_archiver.py [--calls-after-days N] [--contacts-after-days N]
+"""
+import argparse
+import threading
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import insert, delete, select, literal, or_, func, DateTime
+from models import (Campaign, CallLog, CallAnalytics, CampaignContact, CallLogArchive, CallAnalyticsArchive,
+                    CampaignContactArchive)
+from migrations import Throttle, run_batches
+import executor_state
+from config import setup_logging, ARCHIVE_CALLS_AFTER_DAYS, ARCHIVE_CONTACTS_AFTER_DAYS
+import metrics
+
+# Set up logging
+logger = setup_logging("data_archiver", "data_archiver.log")
+
+ARCHIVE_INTERVAL = 24 * 60 * 60  # Time between archival runs (seconds)
+ARCHIVE_START_DELAY = 5 * 60  # First run after startup, once the executor has settled (seconds)
+ACTIVE_CAMPAIGN_STATUSES = ["created", "running", "paused"]  # Calls of these campaigns stay hot
+ARCHIVER_LEASE = "data_archiver"  # executor_leases key held by the node that runs the archival job
+
+archived_rows = metrics.counter("archive.rows_moved", "Rows moved to archive tables, by table")
+archive_fallbacks = metrics.counter("archive.read_fallbacks", "Reads answered from an archive table, by table")
+
+
+def _move(session, source, archive, key_column, keys, archived_at):
+    """Copy rows to their archive table and delete them from the hot one, in the caller's transaction"""
+    names = [column.name for column in source.columns]
+    session.execute(insert(archive).from_select(
+        names + ["archived_at"],
+        select(*[source.c[name] for name in names], literal(archived_at, DateTime)).where(
+            source.c[key_column].in_(keys))
+    ))
+    return session.execute(delete(source).where(source.c[key_column].in_(keys))).rowcount
+
+
+def _archive_calls_step(cutoff):
+    def step(session, last_id, limit):
+        ids = [row[0] for row in session.query(CallLog.id).outerjoin(
+            Campaign, Campaign.campaign_id == CallLog.campaign_id
+        ).filter(
+            CallLog.id > (last_id or 0),
+            CallLog.created_at < cutoff,
+            or_(Campaign.campaign_id.is_(None), Campaign.status.notin_(ACTIVE_CAMPAIGN_STATUSES))
+        ).order_by(CallLog.id).limit(limit).all()]
+        if not ids:
+            return 0, last_id
+
+        now = datetime.now()
+        archived_rows.inc(_move(session, CallAnalytics.__table__, CallAnalyticsArchive.__table__, "call_id", ids, now),
+                          label="call_analytics")
+        archived_rows.inc(_move(session, CallLog.__table__, CallLogArchive.__table__, "id", ids, now),
+                          label="call_logs")
+        return len(ids), ids[-1]
+    return step
+
+
+def _archive_contacts_step(cutoff):
+    def step(session, last_id, limit):
+        ids = [row[0] for row in session.query(CampaignContact.id).join(
+            Campaign, Campaign.campaign_id == CampaignContact.campaign_id
+        ).filter(
+            CampaignContact.id > (last_id or 0),
+            Campaign.status == "completed",
+            Campaign.updated_at < cutoff
+        ).order_by(CampaignContact.id).limit(limit).all()]
+        if not ids:
+            return 0, last_id
+
+        archived_rows.inc(_move(session, CampaignContact.__table__, CampaignContactArchive.__table__, "id", ids,
+                                datetime.now()), label="campaign_contacts")
+        return len(ids), ids[-1]
+    return step
+
+
+def archive_old_data(calls_after_days=ARCHIVE_CALLS_AFTER_DAYS, contacts_after_days=ARCHIVE_CONTACTS_AFTER_DAYS,
+                     throttle=None):
+    """Move aged-out rows to the archive tables. Returns (calls, contacts) moved."""
+    now = datetime.now()
+    calls = run_batches("Archive call_logs", _archive_calls_step(now - timedelta(days=calls_after_days)), throttle)
+    contacts = run_batches("Archive campaign_contacts",
+                           _archive_contacts_step(now - timedelta(days=contacts_after_days)), throttle)
+    if calls or contacts:
+        logger.info(f"Archived {calls} calls and {contacts} campaign contacts")
+    return calls, contacts
+
+
+def start_archiver(interval=ARCHIVE_INTERVAL, start_delay=ARCHIVE_START_DELAY):
+    """
+    Run archive_old_data in the background, once per interval. Every node
+    starts the thread, but a run needs the archiver lease, which lasts an
+    interval: nodes started together would otherwise move the same keyset
+    and all but one would fail on the archive tables' primary keys.
+    """
+    stopping = threading.Event()
+
+    def run():
+        delay = start_delay
+        while not stopping.wait(delay):
+            delay = interval
+            try:
+                held, _ = executor_state.acquire_lease(ARCHIVER_LEASE, duration=interval)
+                if not held:
+                    logger.info("Another node holds the archiver lease, skipping this run")
+                    continue
+                archive_old_data(throttle=Throttle())
+            except Exception as e:
+                logger.error(f"Error archiving old data: {str(e)}")
+                logger.error(traceback.format_exc())
+
+    thread = threading.Thread(target=run, name="data-archiver")
+    thread.daemon = True
+    thread.start()
+    return stopping
+
+
+# --- Read paths ---
+
+def is_archived(row):
+    """True for rows loaded from an archive table"""
+    return isinstance(row, (CallLogArchive, CallAnalyticsArchive, CampaignContactArchive))
+
+
+def find_call_log(db_session, **filters):
+    """First CallLog matching filters, else its CallLogArchive copy, else None"""
+    call_log = db_session.query(CallLog).filter_by(**filters).first()
+    if call_log is None:
+        call_log = db_session.query(CallLogArchive).filter_by(**filters).first()
+        if call_log is not None:
+            archive_fallbacks.inc(label="call_logs")
+    return call_log
+
+
+def find_call_analytics(db_session, call_id):
+    analytics = db_session.query(CallAnalytics).filter_by(call_id=call_id).first()
+    if analytics is None:
+        analytics = db_session.query(CallAnalyticsArchive).filter_by(call_id=call_id).first()
+        if analytics is not None:
+            archive_fallbacks.inc(label="call_analytics")
+    return analytics
+
+
+def find_call_logs(db_session, **filters):
+    """All calls matching filters, hot and archived"""
+    return db_session.query(CallLog).filter_by(**filters).all() + \
+        db_session.query(CallLogArchive).filter_by(**filters).all()
+
+
+def load_call_logs(db_session, call_ids):
+    """{id: call} for the given ids, hot or archived"""
+    call_ids = set(call_ids)
+    calls = {call.id: call for call in db_session.query(CallLog).filter(CallLog.id.in_(call_ids)).all()} \
+        if call_ids else {}
+    missing = call_ids - calls.keys()
+    if missing:
+        calls.update((call.id, call) for call in db_session.query(CallLogArchive).filter(
+            CallLogArchive.id.in_(missing)).all())
+    return calls
+
+
+def recent_call_logs(db_session, limit, offset, **filters):
+    """
+    Newest-first page of calls. Archived calls are older than (nearly) all hot
+    ones, so the page continues into the archive once the hot table runs out.
+    Returns (calls, total_count).
+    """
+    calls = db_session.query(CallLog).filter_by(**filters).order_by(
+        CallLog.created_at.desc()).offset(offset).limit(limit).all()
+    hot_count = db_session.query(func.count(CallLog.id)).filter_by(**filters).scalar()
+    archived_count = db_session.query(func.count(CallLogArchive.id)).filter_by(**filters).scalar()
+
+    if len(calls) < limit and archived_count:
+        calls += db_session.query(CallLogArchive).filter_by(**filters).order_by(
+            CallLogArchive.created_at.desc()).offset(max(0, offset - hot_count)).limit(limit - len(calls)).all()
+    return calls, hot_count + archived_count
+
+
+def find_campaign_contacts(db_session, campaign_id):
+    """A campaign's contacts, hot and archived"""
+    return db_session.query(CampaignContact).filter_by(campaign_id=campaign_id).all() + \
+        db_session.query(CampaignContactArchive).filter_by(campaign_id=campaign_id).all()
+
+
+def contact_status_counts(db_session, campaign_id):
+    """{status: contacts} for a campaign, hot and archived"""
+    counts = {}
+    for model in (CampaignContact, CampaignContactArchive):
+        for status, count in db_session.query(model.status, func.count(model.id)).filter(
+                model.campaign_id == campaign_id).group_by(model.status).all():
+            counts[status] = counts.get(status, 0) + count
+    return counts
+
+
+def completed_call_uuids(db_session, campaign_id):
+    """call_uuids of a campaign's completed contacts, hot and archived"""
+    return [row[0] for model in (CampaignContact, CampaignContactArchive)
+            for row in db_session.query(model.call_uuid).filter_by(campaign_id=campaign_id, status='completed').all()
+            if row[0]]
+
+
+def analysed_call_count(db_session, call_uuids):
+    """How many of these calls have a summary, a recording and a transcription"""
+    return sum(db_session.query(func.count(model.id)).filter(
+        model.call_uuid.in_(call_uuids),
+        model.summary.isnot(None),
+        model.recording_url.isnot(None),
+        model.transcription.isnot(None)
+    ).scalar() for model in (CallLog, CallLogArchive))
+
+
+def delete_campaign_archive(db_session, campaign_id):
+    """Mirror delete_campaign for archived rows: drop contacts, detach calls"""
+    db_session.query(CampaignContactArchive).filter_by(campaign_id=campaign_id).delete(synchronize_session=False)
+    db_session.query(CallLogArchive).filter_by(campaign_id=campaign_id).update(
+        {CallLogArchive.campaign_id: None}, synchronize_session=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old calls and campaign contacts to the archive tables")
+    parser.add_argument("--calls-after-days", type=int, default=ARCHIVE_CALLS_AFTER_DAYS)
+    parser.add_argument("--contacts-after-days", type=int, default=ARCHIVE_CONTACTS_AFTER_DAYS)
+    args = parser.parse_args()
+
+    calls, contacts = archive_old_data(args.calls_after_days, args.contacts_after_days)
+    print(f"Archived {calls} calls and {contacts} campaign contacts")
+
+
+if __name__ == "__main__":
+    main()
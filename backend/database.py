@@ -2,7 +2,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from models import Base
 import os
-from config import setup_logging, DATABASE_URL # Import DATABASE_URL from config
+from config import setup_logging, DATABASE_URL, MIGRATE_ON_STARTUP # Import DATABASE_URL from config
 import time
 
 
@@ -36,6 +36,16 @@ def init_db():
         logger.error(f"Error initializing database schema: {str(e)}") #
         raise
 
+    if MIGRATE_ON_STARTUP:
+        # Imported here: migrations.py uses this module's engine and sessions
+        from migrations import migrate
+        try:
+            migrate()
+        except Exception as e:
+            # Not fatal: the app keeps running on the current schema and the next start retries
+            logger.error(f"Error applying schema migrations: {str(e)}")
+
+
 def get_db_session():
     """
     Get a database session
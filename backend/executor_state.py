@@ -0,0 +1,236 @@
+import os
+import json
+import hashlib
+import socket
+import uuid
+import traceback
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from models import ExecutorNode, ExecutorLease
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("executor_state", "executor_state.log")
+
+# Identity of this process; set EXECUTOR_NODE_ID to keep it stable across restarts
+NODE_ID = os.getenv('EXECUTOR_NODE_ID') or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+HEARTBEAT_INTERVAL = 5  # How often nodes heartbeat and renew leases (seconds)
+LEASE_DURATION = 30  # How long a lease survives without renewal (seconds)
+LEADER_LEASE = "leader"  # Lease key held by the node that runs cluster-wide housekeeping
+CAMPAIGN_LEASE_PREFIX = "campaign:"  # Each running campaign is dialed only by the holder of its lease
+
+
+def _load_json(value):
+    try:
+        return json.loads(value) if value else {}
+    except json.JSONDecodeError:
+        logger.warning("Could not parse persisted executor state, starting fresh")
+        return {}
+
+
+def heartbeat(state=None):
+    """Record that this node is alive, together with a snapshot of its state"""
+    db_session = get_db_session_with_retry()
+    try:
+        now = datetime.now()
+        node = db_session.query(ExecutorNode).filter_by(node_id=NODE_ID).first()
+        if not node:
+            node = ExecutorNode(node_id=NODE_ID, hostname=socket.gethostname(), started_at=now)
+            db_session.add(node)
+
+        node.heartbeat_at = now
+        if state is not None:
+            node.state = json.dumps(state)
+
+        db_session.commit()
+    except IntegrityError:
+        db_session.rollback()
+    finally:
+        close_db_session(db_session)
+
+
+def retire_node():
+    """Remove this node from the membership so its campaigns rebalance immediately"""
+    db_session = get_db_session_with_retry()
+    try:
+        db_session.query(ExecutorNode).filter_by(node_id=NODE_ID).delete(synchronize_session=False)
+        db_session.commit()
+    except Exception as e:
+        logger.error(f"Error retiring node {NODE_ID}: {str(e)}")
+        db_session.rollback()
+    finally:
+        close_db_session(db_session)
+
+
+def get_live_nodes(max_age=LEASE_DURATION):
+    """IDs of nodes that have heartbeated within `max_age` seconds"""
+    db_session = get_db_session_with_retry()
+    try:
+        cutoff = datetime.now() - timedelta(seconds=max_age)
+        rows = db_session.query(ExecutorNode.node_id).filter(ExecutorNode.heartbeat_at >= cutoff).all()
+        return sorted(row[0] for row in rows)
+    finally:
+        close_db_session(db_session)
+
+
+def campaign_lease_key(campaign_id):
+    return f"{CAMPAIGN_LEASE_PREFIX}{campaign_id}"
+
+
+def owner_for(key, nodes):
+    """
+    Pick the node responsible for `key` by rendezvous hashing. Every node computes
+    the same answer from the same membership, and when a node joins or leaves only
+    the keys it wins or held move.
+    """
+    if not nodes:
+        return None
+    return max(nodes, key=lambda node_id: hashlib.sha1(f"{node_id}:{key}".encode()).hexdigest())
+
+
+def acquire_lease(lease_key, state=None, duration=LEASE_DURATION):
+    """
+    Acquire or renew a lease for this node.
+
+    The lease is granted if it is unheld, expired, released or already ours.
+    Takeover uses a compare-and-swap on the previous holder and expiry so two
+    nodes cannot both win. When `state` is given it is stored with the lease.
+
+    Returns (held, stored_state) where stored_state is the state that was saved
+    with the lease before this call (the previous holder's on takeover).
+    """
+    db_session = get_db_session_with_retry()
+    try:
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=duration)
+        lease = db_session.query(ExecutorLease).filter_by(lease_key=lease_key).first()
+
+        if not lease:
+            db_session.add(ExecutorLease(
+                lease_key=lease_key,
+                node_id=NODE_ID,
+                acquired_at=now,
+                expires_at=expires_at,
+                state=json.dumps(state) if state is not None else None
+            ))
+            try:
+                db_session.commit()
+            except IntegrityError:
+                # Another node created it first
+                db_session.rollback()
+                return False, None
+            logger.info(f"Node {NODE_ID} acquired new lease '{lease_key}'")
+            return True, {}
+
+        stored_state = _load_json(lease.state)
+        values = {ExecutorLease.expires_at: expires_at}
+        if state is not None:
+            values[ExecutorLease.state] = json.dumps(state)
+
+        if lease.node_id == NODE_ID:
+            updated = db_session.query(ExecutorLease).filter(
+                ExecutorLease.lease_key == lease_key,
+                ExecutorLease.node_id == NODE_ID
+            ).update(values, synchronize_session=False)
+            db_session.commit()
+            return updated == 1, stored_state
+
+        if lease.node_id is None or (lease.expires_at and lease.expires_at < now):
+            values[ExecutorLease.node_id] = NODE_ID
+            values[ExecutorLease.acquired_at] = now
+            holder_filter = (ExecutorLease.node_id.is_(None) if lease.node_id is None
+                             else ExecutorLease.node_id == lease.node_id)
+            updated = db_session.query(ExecutorLease).filter(
+                ExecutorLease.lease_key == lease_key,
+                holder_filter,
+                or_(ExecutorLease.expires_at.is_(None), ExecutorLease.expires_at == lease.expires_at)
+            ).update(values, synchronize_session=False)
+            db_session.commit()
+
+            if updated == 1:
+                logger.info(f"Node {NODE_ID} took over lease '{lease_key}' from {lease.node_id or 'nobody'}")
+                return True, stored_state
+            return False, None
+
+        return False, None
+
+    except Exception as e:
+        logger.error(f"Error acquiring lease '{lease_key}': {str(e)}")
+        logger.error(traceback.format_exc())
+        db_session.rollback()
+        return False, None
+    finally:
+        close_db_session(db_session)
+
+
+def release_lease(lease_key, state=None):
+    """Give up a lease held by this node, leaving `state` behind for the next holder"""
+    db_session = get_db_session_with_retry()
+    try:
+        values = {
+            ExecutorLease.node_id: None,
+            ExecutorLease.expires_at: datetime.now()
+        }
+        if state is not None:
+            values[ExecutorLease.state] = json.dumps(state)
+
+        released = db_session.query(ExecutorLease).filter(
+            ExecutorLease.lease_key == lease_key,
+            ExecutorLease.node_id == NODE_ID
+        ).update(values, synchronize_session=False)
+        db_session.commit()
+
+        if released:
+            logger.info(f"Node {NODE_ID} released lease '{lease_key}'")
+        return released == 1
+    except Exception as e:
+        logger.error(f"Error releasing lease '{lease_key}': {str(e)}")
+        db_session.rollback()
+        return False
+    finally:
+        close_db_session(db_session)
+
+
+def delete_campaign_leases(keep_campaign_ids):
+    """
+    Delete the campaign leases of campaigns not in keep_campaign_ids (finished
+    or deleted), so the lease table only holds campaigns that may still dial.
+    Only released or expired leases are deleted: a holder gives up a finished
+    campaign's lease on its next rebalance. Returns the number of leases deleted.
+    """
+    db_session = get_db_session_with_retry()
+    try:
+        keys = [row[0] for row in db_session.query(ExecutorLease.lease_key).filter(
+            ExecutorLease.lease_key.like(f"{CAMPAIGN_LEASE_PREFIX}%"),
+            or_(ExecutorLease.node_id.is_(None), ExecutorLease.expires_at < datetime.now())
+        ).all()]
+        keep = set(campaign_lease_key(campaign_id) for campaign_id in keep_campaign_ids)
+        stale = [key for key in keys if key not in keep]
+        if not stale:
+            return 0
+
+        # Re-checked in the DELETE, so a lease taken again meanwhile is kept
+        deleted = db_session.query(ExecutorLease).filter(
+            ExecutorLease.lease_key.in_(stale),
+            or_(ExecutorLease.node_id.is_(None), ExecutorLease.expires_at < datetime.now())
+        ).delete(synchronize_session=False)
+        db_session.commit()
+        logger.info(f"Deleted {deleted} leases of finished campaigns")
+        return deleted
+    except Exception as e:
+        logger.error(f"Error deleting campaign leases: {str(e)}")
+        db_session.rollback()
+        return 0
+    finally:
+        close_db_session(db_session)
+
+
+def get_leases():
+    """All leases, for diagnostics"""
+    db_session = get_db_session_with_retry()
+    try:
+        return [lease.to_dict() for lease in db_session.query(ExecutorLease).all()]
+    finally:
+        close_db_session(db_session)
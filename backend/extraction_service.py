@@ -0,0 +1,538 @@
+import itertools
+import json
+import queue
+import random
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+import openai
+from models import CallLog, CallAnalytics
+from database import close_db_session, get_db_session_with_retry
+from rate_limiter import TokenBucket
+from analysis_cache import analysis_cache, content_hash, prompt_version
+from campaign_rollup import update_rollup_for_call
+from transcript_classifier import classify_call
+from config import setup_logging, OPENAI_API_KEY
+import metrics
+
+# Set up logging
+logger = setup_logging("extraction_service", "extraction_service.log")
+
+EXTRACTION_MODEL = "gpt-3.5-turbo"
+MAX_CONCURRENCY = 8  # Chat completion requests in flight at once
+TOKENS_PER_MINUTE = 160000  # Account limit for the model (prompt + completion tokens)
+REQUEST_TIMEOUT = 60  # Per request to OpenAI (seconds)
+EXTRACT_TIMEOUT = 180  # How long an interactive caller waits for its result, including queueing (seconds)
+MAX_RETRIES = 4  # Retries of a request after rate limit, timeout or server errors
+RETRY_BASE_DELAY = 1.0  # First retry delay, doubled on every retry (seconds)
+RETRY_MAX_DELAY = 30.0  # Upper bound on a single retry delay (seconds)
+CHARS_PER_TOKEN = 4  # Rough token estimate for transcripts
+PROMPT_TOKENS = 250  # Tokens taken by the system prompt
+OUTPUT_TOKENS_PER_CALL = 300  # Expected completion tokens per extracted call
+PACK_MAX_TOKENS = 800  # Transcripts up to this size may share a request with others
+PACK_MAX_CALLS = 5  # Transcripts per packed request
+PACK_WINDOW = 0.5  # How long a short transcript waits for others to pack with (seconds)
+
+# USD per 1M tokens (prompt, completion)
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50)
+}
+
+PRIORITY_INTERACTIVE = 0  # Requests someone is waiting on (analyze_transcript)
+PRIORITY_BACKGROUND = 1  # Extractions queued after calls complete
+
+ENTITY_PROMPT = """You are an expert at analyzing call transcripts.
+Extract key information from this conversation between an Agent and a Customer.
+Return the results as a JSON object with the following fields:
+- customer_name: Extracted customer name, or null if not mentioned
+- contact_details: Extracted phone number or email, or null if not mentioned
+- topics: List of main topics discussed
+- products_mentioned: List of products or services mentioned
+- customer_needs: List of customer needs or pain points expressed
+- sentiment: Overall customer sentiment (positive, neutral, negative, mixed)
+- financial_figures: Any prices, costs, budgets mentioned
+- follow_up_actions: List of required follow-up actions
+
+Follow these rules:
+- Use null for fields where no information is available
+- Be concise and direct in your extraction
+- Format as valid JSON only, without explanation
+- Only include information explicitly mentioned in the transcript"""
+
+PACKED_PROMPT = ENTITY_PROMPT + """
+
+The input contains several separate calls, each starting with a line "### Call <number>".
+Analyze every call independently and return {"calls": {"<number>": {...fields...}}}
+with one entry per call."""
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+# Service metrics
+queue_depth = metrics.gauge("extraction.queue_depth", "Transcripts waiting for an extraction request")
+requests_sent = metrics.counter("extraction.requests", "Chat completion requests, by packed/single")
+tokens_used = metrics.counter("extraction.tokens", "Tokens used, by prompt/completion")
+retries = metrics.counter("extraction.retries", "Retried requests, by error type")
+failures = metrics.counter("extraction.failures", "Transcripts whose extraction failed")
+request_latency = metrics.histogram("extraction.request_seconds", "Time for one chat completion request")
+rate_limit_wait = metrics.histogram("extraction.rate_limit_wait_seconds", "Time requests waited for the TPM limiter")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def request_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0, 0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000000
+
+
+def format_transcript(transcription):
+    """Agent/Customer text of a stored transcription, as sent to the model"""
+    if isinstance(transcription, str):
+        transcription = json.loads(transcription)
+    messages = transcription.get("results", []) if isinstance(transcription, dict) else []
+
+    formatted_transcript = ""
+    for msg in messages:
+        role = "Agent" if msg.get("role") in ["MESSAGE_ROLE_AGENT", "assistant"] else "Customer"
+        text = msg.get("text", "")
+        if text:
+            formatted_transcript += f"{role}: {text}\n\n"
+    return formatted_transcript
+
+
+class _Job:
+    __slots__ = ("transcript", "content_hash", "call_id", "campaign_id", "api_key", "tokens", "packable",
+                 "priority", "future", "submitted")
+
+    def __init__(self, transcript, key, call_id, campaign_id, api_key, packable, priority):
+        self.transcript = transcript
+        self.content_hash = key
+        self.call_id = call_id
+        self.campaign_id = campaign_id
+        self.api_key = api_key
+        self.tokens = estimate_tokens(transcript)
+        self.packable = packable
+        self.priority = priority
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class _CampaignStats:
+    """Extraction throughput, token usage and cost of one campaign in this process"""
+
+    def __init__(self):
+        self.calls = 0
+        self.cache_hits = 0
+        self.failed = 0
+        self.requests = 0
+        self.packed_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.latency_total = 0.0
+        self.first_submitted = None
+        self.last_completed = None
+
+    def to_dict(self):
+        elapsed = (self.last_completed - self.first_submitted) if self.calls and self.last_completed else 0
+        minutes = elapsed / 60 if elapsed > 0 else None
+        total_tokens = self.prompt_tokens + self.completion_tokens
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "failed": self.failed,
+            "requests": self.requests,
+            "packed_calls": self.packed_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "avg_latency_seconds": round(self.latency_total / self.calls, 3) if self.calls else None,
+            "calls_per_minute": round(self.calls / minutes, 2) if minutes else None,
+            "tokens_per_minute": round(total_tokens / minutes) if minutes else None
+        }
+
+
+class ExtractionService:
+    """
+    Entity extraction with bounded concurrency.
+
+    Transcripts are queued (requests someone is waiting on ahead of background
+    work) and sent by at most `max_concurrency` workers sharing one OpenAI client
+    per API key. Every request first takes its estimated tokens from a
+    tokens-per-minute bucket; the estimate is corrected with the actual usage
+    afterwards. Short background transcripts are packed several to a request.
+    Transcripts already analysed (up to whitespace) with the same prompt and
+    model are answered from the analysis cache without a request.
+    """
+
+    def __init__(self, model=EXTRACTION_MODEL, max_concurrency=MAX_CONCURRENCY,
+                 tokens_per_minute=TOKENS_PER_MINUTE, pack_max_tokens=PACK_MAX_TOKENS,
+                 pack_max_calls=PACK_MAX_CALLS, pack_window=PACK_WINDOW):
+        self.model = model
+        self.prompt_version = prompt_version(ENTITY_PROMPT)
+        self.max_concurrency = max_concurrency
+        self.pack_max_tokens = pack_max_tokens
+        self.pack_max_calls = pack_max_calls
+        self.pack_window = pack_window
+        self.limiter = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.queue = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.slots = threading.Semaphore(max_concurrency)
+        self.clients = {}
+        self.inflight = {}  # call_id -> Future, so a call is only extracted once at a time
+        self.inflight_hashes = {}  # content hash -> Future, so identical transcripts share a request
+        self.campaigns = {}
+        self.lock = threading.Lock()
+        self.pool = None
+        self.dispatcher = None
+
+    def start(self):
+        with self.lock:
+            if self.dispatcher is not None:
+                return
+            self.pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="extraction")
+            self.dispatcher = threading.Thread(target=self._dispatch, name="extraction-dispatcher")
+            self.dispatcher.daemon = True
+            self.dispatcher.start()
+
+    def _client(self, api_key):
+        with self.lock:
+            client = self.clients.get(api_key)
+            if client is None:
+                # Retries are handled here, against the shared TPM budget
+                client = openai.OpenAI(api_key=api_key, timeout=REQUEST_TIMEOUT, max_retries=0)
+                self.clients[api_key] = client
+            return client
+
+    def _stats(self, campaign_id):
+        stats = self.campaigns.get(campaign_id)
+        if stats is None:
+            stats = _CampaignStats()
+            self.campaigns[campaign_id] = stats
+        return stats
+
+    def submit(self, transcript, call_id=None, campaign_id=None, api_key=None, interactive=False, use_cache=True):
+        """
+        Queue a formatted transcript. Returns a Future resolving to the extracted
+        entities as a JSON string. A call or an identical transcript already being
+        extracted shares the pending Future; with `use_cache`, a transcript
+        analysed before resolves immediately.
+        """
+        key = content_hash(transcript, self.prompt_version, self.model)
+        if use_cache:
+            cached = analysis_cache.get(key)
+            if cached is not None:
+                with self.lock:
+                    self._stats(campaign_id).cache_hits += 1
+                future = Future()
+                future.set_result(cached)
+                return future
+
+        api_key = api_key or OPENAI_API_KEY
+        if not api_key:
+            raise ValueError("OpenAI API key not configured")
+        self.start()
+
+        with self.lock:
+            if call_id is not None and call_id in self.inflight:
+                return self.inflight[call_id]
+            if use_cache and key in self.inflight_hashes:
+                self._stats(campaign_id).cache_hits += 1
+                return self.inflight_hashes[key]
+
+            job = _Job(transcript, key, call_id, campaign_id, api_key, packable=not interactive,
+                       priority=PRIORITY_INTERACTIVE if interactive else PRIORITY_BACKGROUND)
+            if call_id is not None:
+                self.inflight[call_id] = job.future
+            self.inflight_hashes[key] = job.future
+            stats = self._stats(campaign_id)
+            if stats.first_submitted is None:
+                stats.first_submitted = job.submitted
+
+        self._enqueue(job)
+        return job.future
+
+    def extract(self, transcript, call_id=None, campaign_id=None, api_key=None, use_cache=True,
+                timeout=EXTRACT_TIMEOUT):
+        """Extract entities for a caller that waits on the result"""
+        return self.submit(transcript, call_id=call_id, campaign_id=campaign_id, api_key=api_key,
+                           interactive=True, use_cache=use_cache).result(timeout=timeout)
+
+    def _enqueue(self, job):
+        self.queue.put((job.priority, next(self.sequence), job))
+        queue_depth.set(self.queue.qsize())
+
+    def _next_job(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)[2]
+        except queue.Empty:
+            return None
+
+    def _dispatch(self):
+        while True:
+            job = self._next_job()
+            pack = [job]
+
+            if job.packable and job.tokens <= self.pack_max_tokens:
+                deadline = time.monotonic() + self.pack_window
+                while len(pack) < self.pack_max_calls:
+                    other = self._next_job(timeout=max(deadline - time.monotonic(), 0))
+                    if other is None:
+                        break
+                    if other.packable and other.tokens <= self.pack_max_tokens and other.api_key == job.api_key:
+                        pack.append(other)
+                    else:
+                        # Leave it for the next request and send what we have
+                        self._enqueue(other)
+                        break
+
+            queue_depth.set(self.queue.qsize())
+            self.slots.acquire()
+            self.pool.submit(self._run, pack)
+
+    def _wait_for_tokens(self, amount):
+        started = time.monotonic()
+        while not self.limiter.try_acquire(amount):
+            time.sleep(min(max(self.limiter.wait_time(amount), 0.05), 1.0))
+        rate_limit_wait.observe(time.monotonic() - started)
+
+    def _request(self, jobs):
+        """Send one chat completion for the jobs; returns ({job index: entities JSON}, usage)"""
+        estimate = min(sum(job.tokens for job in jobs) + PROMPT_TOKENS + OUTPUT_TOKENS_PER_CALL * len(jobs),
+                       self.limiter.capacity)
+        self._wait_for_tokens(estimate)
+
+        if len(jobs) == 1:
+            system_prompt, content = ENTITY_PROMPT, jobs[0].transcript
+        else:
+            system_prompt = PACKED_PROMPT
+            content = "\n".join(f"### Call {index + 1}\n{job.transcript}" for index, job in enumerate(jobs))
+
+        started = time.monotonic()
+        try:
+            response = self._client(jobs[0].api_key).chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": content}
+                ],
+                temperature=0.2,
+                response_format={"type": "json_object"}
+            )
+        finally:
+            request_latency.observe(time.monotonic() - started)
+            requests_sent.inc(label="packed" if len(jobs) > 1 else "single")
+
+        usage = response.usage
+        self.limiter.adjust(estimate - usage.total_tokens)
+        tokens_used.inc(usage.prompt_tokens, label="prompt")
+        tokens_used.inc(usage.completion_tokens, label="completion")
+
+        result = response.choices[0].message.content
+        if len(jobs) == 1:
+            json.loads(result)  # Validate before storing
+            return {0: result}, usage
+
+        calls = json.loads(result).get("calls") or {}
+        results = {}
+        for index in range(len(jobs)):
+            entities = calls.get(str(index + 1))
+            if isinstance(entities, dict):
+                results[index] = json.dumps(entities)
+        return results, usage
+
+    def _run(self, jobs):
+        try:
+            attempt = 0
+            while True:
+                try:
+                    results, usage = self._request(jobs)
+                    break
+                except RETRYABLE_ERRORS as e:
+                    attempt += 1
+                    if attempt > MAX_RETRIES:
+                        self._fail(jobs, e)
+                        return
+                    retries.inc(label=type(e).__name__)
+                    delay = min(RETRY_BASE_DELAY * 2 ** (attempt - 1), RETRY_MAX_DELAY)
+                    logger.warning(f"Extraction request for {len(jobs)} calls failed ({type(e).__name__}), "
+                                   f"retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+                    time.sleep(delay * (0.5 + random.random()))
+                except Exception as e:
+                    if len(jobs) > 1:
+                        # A pack the model could not answer: send each call on its own
+                        logger.warning(f"Packed extraction of {len(jobs)} calls failed ({str(e)}), unpacking")
+                        self._unpack(jobs)
+                    else:
+                        self._fail(jobs, e)
+                    return
+
+            self._complete(jobs, results, usage)
+        except Exception as e:
+            logger.error(f"Error in extraction worker: {str(e)}")
+            logger.error(traceback.format_exc())
+            self._fail([job for job in jobs if not job.future.done()], e)
+        finally:
+            self.slots.release()
+
+    def _unpack(self, jobs):
+        for job in jobs:
+            job.packable = False
+            self._enqueue(job)
+
+    def _complete(self, jobs, results, usage):
+        now = time.monotonic()
+        total_tokens = sum(job.tokens for job in jobs)
+        missing = [job for index, job in enumerate(jobs) if index not in results]
+
+        with self.lock:
+            for index, job in enumerate(jobs):
+                # Share the request's usage between its calls by transcript size
+                share = job.tokens / total_tokens
+                prompt_tokens = round(usage.prompt_tokens * share)
+                completion_tokens = round(usage.completion_tokens * share)
+
+                stats = self._stats(job.campaign_id)
+                stats.prompt_tokens += prompt_tokens
+                stats.completion_tokens += completion_tokens
+                stats.cost_usd += request_cost(self.model, prompt_tokens, completion_tokens)
+                stats.requests += share
+                if index in results:
+                    stats.calls += 1
+                    stats.latency_total += now - job.submitted
+                    stats.last_completed = now
+                    if len(jobs) > 1:
+                        stats.packed_calls += 1
+                    self.inflight.pop(job.call_id, None)
+                    self.inflight_hashes.pop(job.content_hash, None)
+
+        for index, job in enumerate(jobs):
+            if index in results:
+                analysis_cache.put(job.content_hash, results[index], self.prompt_version, self.model)
+                job.future.set_result(results[index])
+
+        if missing:
+            logger.warning(f"Packed extraction returned no result for {len(missing)} of {len(jobs)} calls, unpacking")
+            self._unpack(missing)
+
+    def _fail(self, jobs, error):
+        logger.error(f"Extraction failed for calls {[job.call_id for job in jobs]}: {str(error)}")
+        failures.inc(len(jobs))
+        with self.lock:
+            for job in jobs:
+                self._stats(job.campaign_id).failed += 1
+                self.inflight.pop(job.call_id, None)
+                self.inflight_hashes.pop(job.content_hash, None)
+        for job in jobs:
+            job.future.set_exception(error)
+
+    def pending(self, call_id):
+        """The Future of a call currently being extracted, or None"""
+        with self.lock:
+            return self.inflight.get(call_id)
+
+    def campaign_stats(self, campaign_id):
+        with self.lock:
+            stats = self.campaigns.get(campaign_id)
+            result = stats.to_dict() if stats else _CampaignStats().to_dict()
+        result["requests"] = round(result["requests"], 2)
+        return result
+
+    def status(self):
+        with self.lock:
+            inflight = len(self.inflight)
+        return {
+            "model": self.model,
+            "queued": self.queue.qsize(),
+            "inflight_calls": inflight,
+            "max_concurrency": self.max_concurrency,
+            "tpm_available": round(self.limiter.export_state()["tokens"]),
+            "prompt_version": self.prompt_version,
+            "cache": analysis_cache.status()
+        }
+
+
+# Shared service used by analyze_transcript and the campaign executor
+extraction_service = ExtractionService()
+
+
+def store_entities(db_session, call_log, analysis_result):
+    """Save extracted entities in the call's CallAnalytics and fold them into the campaign rollup"""
+    analytics_record = db_session.query(CallAnalytics).filter_by(call_id=call_log.id).first()
+    if analytics_record:
+        analytics_record.entities_extracted = analysis_result
+    else:
+        db_session.add(CallAnalytics(call_id=call_log.id, entities_extracted=analysis_result))
+    db_session.commit()
+
+    try:
+        update_rollup_for_call(db_session, call_log.id)
+    except Exception as e:
+        db_session.rollback()
+        logger.error(f"Error updating campaign rollup for call ID {call_log.id}: {str(e)}")
+
+
+def _store_result(call_log_id, future):
+    if future.exception() is not None:
+        return
+
+    db_session = None
+    try:
+        db_session = get_db_session_with_retry()
+        call_log = db_session.query(CallLog).filter_by(id=call_log_id).first()
+        if call_log:
+            store_entities(db_session, call_log, future.result())
+    except Exception as e:
+        logger.error(f"Error storing extracted entities for call ID {call_log_id}: {str(e)}")
+        logger.error(traceback.format_exc())
+    finally:
+        if db_session:
+            close_db_session(db_session)
+
+
+def queue_call_extraction(call_log_id, refresh=False):
+    """
+    Queue background entity extraction for a call with a stored transcript and
+    store the result when it completes. Trivial calls (voicemail, wrong number,
+    no conversation) are labelled by the local classifier and stored right away.
+    Returns the Future, or None if no LLM extraction was needed.
+    """
+    pending = extraction_service.pending(call_log_id)
+    if pending is not None:
+        return pending
+
+    db_session = get_db_session_with_retry()
+    try:
+        call_log = db_session.query(CallLog).filter_by(id=call_log_id).first()
+        if not call_log:
+            return None
+
+        if not refresh:
+            existing = db_session.query(CallAnalytics.entities_extracted).filter_by(call_id=call_log_id).scalar()
+            if existing:
+                return None
+
+        entities = classify_call(call_log)
+        if entities:
+            store_entities(db_session, call_log, entities)
+            return None
+        if not call_log.transcription:
+            return None
+
+        try:
+            transcript = format_transcript(call_log.transcription)
+        except json.JSONDecodeError:
+            logger.warning(f"Invalid JSON in transcript data for call ID {call_log_id}")
+            return None
+        campaign_id = call_log.campaign_id
+    finally:
+        close_db_session(db_session)
+
+    if not transcript:
+        return None
+
+    future = extraction_service.submit(transcript, call_id=call_log_id, campaign_id=campaign_id)
+    future.add_done_callback(lambda done: _store_result(call_log_id, done))
+    return future
@@ -0,0 +1,151 @@
+import bisect
+import threading
+import time
+
+# In-process metrics exposed through /api/metrics
+
+
+class Counter:
+    """Monotonically increasing counter, optionally split by a label"""
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, label=None):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def value(self, label=None):
+        with self.lock:
+            return self.values.get(label, 0)
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def snapshot(self):
+        with self.lock:
+            values = dict(self.values)
+
+        result = {"type": "counter", "description": self.description, "total": sum(values.values())}
+        labelled = {str(label): value for label, value in values.items() if label is not None}
+        if labelled:
+            result["by_label"] = labelled
+        return result
+
+
+class Gauge:
+    """Value that can go up and down, e.g. a queue depth or a last-run timestamp"""
+
+    def __init__(self, name, description=""):
+        self.name = name
+        self.description = description
+        self.current = 0
+        self.updated_at = None
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        with self.lock:
+            self.current = value
+            self.updated_at = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {"type": "gauge", "description": self.description, "value": self.current,
+                    "updated_at": self.updated_at}
+
+
+class Histogram:
+    """Distribution of observed values (e.g. latencies in seconds) over fixed buckets"""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, description="", buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot counts values above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def _quantile(self, counts, count, q):
+        """Upper bound of the bucket containing the q-th quantile"""
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else "+Inf"
+        return "+Inf"
+
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+
+        cumulative = {}
+        running = 0
+        for bound, bucket_count in zip(list(self.buckets) + ["+Inf"], counts):
+            running += bucket_count
+            cumulative[str(bound)] = running
+
+        return {
+            "type": "histogram",
+            "description": self.description,
+            "count": count,
+            "sum": round(total, 6),
+            "mean": round(total / count, 6) if count else None,
+            "p50": self._quantile(counts, count, 0.5),
+            "p95": self._quantile(counts, count, 0.95),
+            "p99": self._quantile(counts, count, 0.99),
+            "buckets": cumulative
+        }
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name, description):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, description)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name, description=""):
+    """Get or register a counter"""
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name, description=""):
+    """Get or register a gauge"""
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name, description=""):
+    """Get or register a histogram with the default latency buckets"""
+    return _get_or_create(Histogram, name, description)
+
+
+def snapshot():
+    """Current value of every registered metric"""
+    with _registry_lock:
+        metrics = list(_registry.items())
+    return {name: metric.snapshot() for name, metric in sorted(metrics)}
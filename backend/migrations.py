@@ -0,0 +1,439 @@
+"""
+Versioned schema migrations.
+
+create_all() only creates missing tables. Everything else - new columns,
+indexes on existing tables, data backfills - is a migration: a function
+registered with @migration(version, name) that runs once per database and is
+recorded in schema_migrations. Migrations run at startup from init_db (unless
+MIGRATE_ON_STARTUP is off) and from the command line:
+
+    python migrations.py status
+    python migrations.py upgrade [--target VERSION]
+    python migrations.py mark-applied VERSION
+
+Migrations must be idempotent: a fresh database gets its schema from
+create_all() and then runs every migration as a no-op.
+"""
+import argparse
+import time
+import traceback
+from contextlib import contextmanager
+from sqlalchemy import inspect, text, and_, or_
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+from models import (Base, CallLog, CallMapping, CampaignContact, CallAnalytics, CallAnalyticsArchive, RecordingArchive,
+                    SchemaMigration)
+from database import engine, close_db_session, get_db_session
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("migrations", "migrations.log")
+
+LOCK_TIMEOUT_MS = 10 * 60 * 1000  # How long a node waits while another node runs migrations (ms)
+
+BACKFILL_BATCH_SIZE = 500  # First batch of a backfill; later batches adapt to BACKFILL_TARGET_SECONDS
+BACKFILL_MIN_BATCH = 50
+BACKFILL_MAX_BATCH = 2000  # Keeps IN (...) lists under SQL Server's 2100 parameter limit
+BACKFILL_TARGET_SECONDS = 0.5  # Short transactions hold locks on hot tables only briefly
+BACKFILL_DUTY_CYCLE = 0.5  # Share of wall time a backfill may keep the database busy
+
+MIGRATIONS = []
+
+
+class Migration:
+    def __init__(self, version, name, upgrade):
+        self.version = version
+        self.name = name
+        self.upgrade = upgrade
+
+    def __repr__(self):
+        return f"<Migration {self.version} {self.name}>"
+
+
+def migration(version, name):
+    """Register a migration; versions sort as strings, so keep them zero padded"""
+    def register(upgrade):
+        if any(existing.version == version for existing in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, name, upgrade))
+        MIGRATIONS.sort(key=lambda item: item.version)
+        return upgrade
+    return register
+
+
+class Throttle:
+    """
+    Paces a batched backfill. The batch size adapts so each transaction takes
+    about `target_seconds`, and after every batch the backfill sleeps long
+    enough to stay within `duty_cycle` of wall time. A slow batch (a busy
+    database) therefore shrinks the next batch and lengthens the pause.
+    """
+
+    def __init__(self, batch_size=BACKFILL_BATCH_SIZE, target_seconds=BACKFILL_TARGET_SECONDS,
+                 duty_cycle=BACKFILL_DUTY_CYCLE, min_batch=BACKFILL_MIN_BATCH, max_batch=BACKFILL_MAX_BATCH,
+                 sleep=time.sleep):
+        self.batch_size = batch_size
+        self.target_seconds = target_seconds
+        self.duty_cycle = duty_cycle
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.sleep = sleep
+
+    def record(self, elapsed):
+        """Account for a finished batch that took `elapsed` seconds. Returns the pause taken."""
+        if elapsed > self.target_seconds * 2:
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+        elif elapsed < self.target_seconds / 2:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+
+        pause = elapsed * (1 - self.duty_cycle) / self.duty_cycle
+        if pause > 0:
+            self.sleep(pause)
+        return pause
+
+
+class MigrationContext:
+    """Schema helpers for migrations; each one is a no-op if its change is already there"""
+
+    def __init__(self, bind=None):
+        self.engine = bind or engine
+        self.dialect = self.engine.dialect.name
+
+    def has_table(self, table_name):
+        return inspect(self.engine).has_table(table_name)
+
+    def has_column(self, table_name, column_name):
+        return column_name in [column["name"] for column in inspect(self.engine).get_columns(table_name)]
+
+    def has_index(self, table_name, index_name):
+        return index_name in [index["name"] for index in inspect(self.engine).get_indexes(table_name)]
+
+    def execute(self, statement, autocommit=False):
+        """Run one DDL/DML statement in its own transaction (or none, for DDL that refuses one)"""
+        if autocommit:
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                connection.execute(text(statement))
+        else:
+            with self.engine.begin() as connection:
+                connection.execute(text(statement))
+
+    def add_column(self, column):
+        """Add a model's column to its existing table. New columns must be nullable."""
+        table_name = column.table.name
+        if not self.has_table(table_name) or self.has_column(table_name, column.name):
+            return False
+        if not column.nullable:
+            raise ValueError(f"{table_name}.{column.name} must be nullable to be added to an existing table")
+
+        column_type = column.type.compile(dialect=self.engine.dialect)
+        self.execute(f"ALTER TABLE {table_name} ADD {column.name} {column_type} NULL")
+        logger.info(f"Added column {table_name}.{column.name} ({column_type})")
+        return True
+
+    def add_missing_columns(self):
+        """Add every nullable model column its existing table lacks"""
+        added = 0
+        for table in Base.metadata.sorted_tables:
+            if not self.has_table(table.name):
+                continue
+            for column in table.columns:
+                if column.nullable and self.add_column(column):
+                    added += 1
+        return added
+
+    def create_index(self, index, online=True):
+        """
+        Create a model's index if missing. On SQL Server the build is ONLINE, so
+        the table stays readable and writable while it runs; editions without
+        online index operations fall back to an offline build.
+        """
+        table_name = index.table.name
+        if not self.has_table(table_name) or self.has_index(table_name, index.name):
+            return False
+
+        statement = str(CreateIndex(index).compile(dialect=self.engine.dialect))
+        started = time.monotonic()
+        if self.dialect == "mssql" and online:
+            self.execute_online(statement, f"{statement} WITH (ONLINE = ON)", f"building {index.name}")
+        else:
+            self.execute(statement, autocommit=True)
+
+        logger.info(f"Created index {index.name} on {table_name} in {time.monotonic() - started:.1f}s")
+        return True
+
+    def compress_table(self, table_name, compression="PAGE", online=True):
+        """
+        Rebuild a table with data compression (SQL Server only). Like create_index,
+        the rebuild is ONLINE where the edition supports it and offline otherwise.
+        """
+        if self.dialect != "mssql" or not self.has_table(table_name):
+            return False
+
+        statement = f"ALTER TABLE {table_name} REBUILD WITH (DATA_COMPRESSION = {compression}"
+        started = time.monotonic()
+        if online:
+            self.execute_online(f"{statement})", f"{statement}, ONLINE = ON)", f"rebuilding {table_name}")
+        else:
+            self.execute(f"{statement})", autocommit=True)
+
+        logger.info(f"Rebuilt {table_name} with {compression} compression in {time.monotonic() - started:.1f}s")
+        return True
+
+    def execute_online(self, statement, online_statement, description):
+        """Run the ONLINE = ON form of a statement, falling back to the plain one on editions without it"""
+        try:
+            self.execute(online_statement, autocommit=True)
+        except DBAPIError as e:
+            # Check the driver's message only: str(e) also holds the statement, which always says ONLINE
+            if "ONLINE" not in str(e.orig).upper():
+                raise
+            logger.warning(f"Online operations unavailable, {description} offline: {str(e.orig)}")
+            self.execute(statement, autocommit=True)
+
+    def drop_foreign_key(self, table_name, referred_table):
+        """
+        Drop a table's foreign keys to `referred_table`. SQLite cannot drop
+        constraints (and does not enforce them unless asked), so it is skipped there.
+        """
+        if self.dialect == "sqlite" or not self.has_table(table_name):
+            return 0
+        dropped = 0
+        for foreign_key in inspect(self.engine).get_foreign_keys(table_name):
+            if foreign_key["referred_table"] == referred_table and foreign_key.get("name"):
+                self.execute(f"ALTER TABLE {table_name} DROP CONSTRAINT {foreign_key['name']}")
+                logger.info(f"Dropped foreign key {foreign_key['name']} from {table_name}")
+                dropped += 1
+        return dropped
+
+    def backfill(self, name, step, throttle=None):
+        return run_batches(name, step, throttle)
+
+
+def run_batches(name, step, throttle=None):
+    """
+    Run `step(session, last_key, batch_size) -> (rows_scanned, last_key)`
+    until it scans nothing, committing each batch separately and pacing
+    batches with a Throttle. Keyset steps (WHERE key > last_key ORDER BY key)
+    keep every batch an index seek however far the run has got.
+    """
+    throttle = throttle or Throttle()
+    last_key = None
+    total = 0
+    while True:
+        session = get_db_session()
+        started = time.monotonic()
+        try:
+            scanned, last_key = step(session, last_key, throttle.batch_size)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            close_db_session(session)
+
+        if not scanned:
+            break
+        total += scanned
+        throttle.record(time.monotonic() - started)
+
+    logger.info(f"{name}: {total} rows scanned")
+    return total
+
+
+# --- Migrations ---
+
+@migration("0001", "add columns added to models after their tables were created")
+def add_model_columns(context):
+    # The ad-hoc column sync init_db used to run on every start
+    context.add_missing_columns()
+
+
+@migration("0002", "composite indexes for the executor's hot queries")
+def add_executor_indexes(context):
+    for table in (CampaignContact.__table__, CallLog.__table__):
+        for index in table.indexes:
+            if len(index.columns) > 1:
+                context.create_index(index)
+
+
+def _backfill_call_logs_step(session, last_id, limit):
+    """Copy a batch of legacy call_mappings rows into call_logs"""
+    rows = session.query(CallMapping, CallLog).outerjoin(
+        CallLog, CallLog.call_uuid == CallMapping.plivo_call_uuid
+    ).filter(
+        CallMapping.id > (last_id or 0),
+        or_(
+            CallLog.id.is_(None),
+            and_(CallLog.ultravox_id.is_(None), CallMapping.ultravox_call_id.isnot(None))
+        )
+    ).order_by(CallMapping.id).limit(limit).all()
+    if not rows:
+        return 0, last_id
+
+    # ultravox_id is unique in call_logs; never copy one that is already in use
+    candidate_ids = [mapping.ultravox_call_id for mapping, _ in rows if mapping.ultravox_call_id]
+    used_ids = set(row[0] for row in session.query(CallLog.ultravox_id).filter(
+        CallLog.ultravox_id.in_(candidate_ids)
+    ).all()) if candidate_ids else set()
+
+    for mapping, call_log in rows:
+        ultravox_id = mapping.ultravox_call_id if mapping.ultravox_call_id not in used_ids else None
+        if ultravox_id:
+            used_ids.add(ultravox_id)
+
+        if call_log:
+            if ultravox_id:
+                call_log.ultravox_id = ultravox_id
+        else:
+            session.add(CallLog(
+                call_uuid=mapping.plivo_call_uuid,
+                ultravox_id=ultravox_id,
+                to_number=mapping.recipient_phone_number or "Unknown",
+                from_number=mapping.plivo_phone_number or "Unknown",
+                system_prompt=mapping.system_prompt,
+                initiation_time=mapping.timestamp
+            ))
+
+    return len(rows), rows[-1][0].id
+
+
+@migration("0003", "copy legacy call_mappings into call_logs")
+def backfill_call_logs_from_mappings(context):
+    context.backfill("Backfill call_logs from call_mappings", _backfill_call_logs_step)
+
+
+@migration("0004", "let call-keyed tables outlive the call_logs row; compress archive tables")
+def prepare_call_archival(context):
+    # Recordings and search rows stay put when data_archiver.py moves a call to call_logs_archive
+    context.drop_foreign_key("recording_archives", "call_logs")
+    context.drop_foreign_key("transcript_messages", "call_logs")
+
+    # Archive tables are written once and read rarely: trade CPU for a much smaller footprint
+    for table_name in ("call_logs_archive", "call_analytics_archive", "campaign_contacts_archive"):
+        context.compress_table(table_name)
+
+
+@migration("0005", "updated_at indexes for incremental exports")
+def add_export_indexes(context):
+    # Rows analysed before this migration keep a NULL updated_at; only a full export picks them up
+    context.add_column(CallAnalytics.__table__.c.updated_at)
+    context.add_column(CallAnalyticsArchive.__table__.c.updated_at)
+    for table in (CallLog.__table__, CallAnalytics.__table__, CampaignContact.__table__):
+        for index in table.indexes:
+            if list(index.columns) == [table.c.updated_at]:
+                context.create_index(index)
+
+
+@migration("0006", "node holding each archived recording")
+def add_recording_archive_node(context):
+    # Recordings archived before this migration keep a NULL node_url, i.e. count as shared storage
+    context.add_column(RecordingArchive.__table__.c.node_url)
+
+
+# --- Runner ---
+
+@contextmanager
+def _migration_lock():
+    """Let one node at a time migrate a shared SQL Server database"""
+    if engine.dialect.name != "mssql":
+        yield
+        return
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        result = connection.execute(text(
+            "DECLARE @result INT; "
+            "EXEC @result = sp_getapplock @Resource = 'schema_migrations', @LockMode = 'Exclusive', "
+            "@LockOwner = 'Session', @LockTimeout = :timeout; SELECT @result"
+        ), {"timeout": LOCK_TIMEOUT_MS}).scalar()
+        if result is None or result < 0:
+            raise RuntimeError(f"Could not acquire the schema migration lock (sp_getapplock returned {result})")
+        try:
+            yield
+        finally:
+            connection.execute(text(
+                "EXEC sp_releaseapplock @Resource = 'schema_migrations', @LockOwner = 'Session'"
+            ))
+
+
+def applied_versions():
+    session = get_db_session()
+    try:
+        return {row[0] for row in session.query(SchemaMigration.version).all()}
+    finally:
+        close_db_session(session)
+
+
+def pending_migrations(target=None):
+    applied = applied_versions()
+    return [item for item in MIGRATIONS
+            if item.version not in applied and (target is None or item.version <= target)]
+
+
+def _record(item, duration=None):
+    session = get_db_session()
+    try:
+        session.add(SchemaMigration(version=item.version, name=item.name,
+                                    duration_seconds=round(duration, 3) if duration is not None else None))
+        session.commit()
+    finally:
+        close_db_session(session)
+
+
+def migrate(target=None):
+    """Apply pending migrations in order, up to and including `target`. Returns the versions applied."""
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    applied = []
+    with _migration_lock():
+        context = MigrationContext()
+        for item in pending_migrations(target):
+            logger.info(f"Applying migration {item.version}: {item.name}")
+            started = time.monotonic()
+            try:
+                item.upgrade(context)
+            except Exception as e:
+                logger.error(f"Migration {item.version} failed: {str(e)}")
+                logger.error(traceback.format_exc())
+                raise
+            duration = time.monotonic() - started
+            _record(item, duration)
+            applied.append(item.version)
+            logger.info(f"Applied migration {item.version} in {duration:.1f}s")
+    return applied
+
+
+def mark_applied(version):
+    """Record a migration as applied without running it, e.g. after applying it by hand"""
+    item = next((item for item in MIGRATIONS if item.version == version), None)
+    if item is None:
+        raise ValueError(f"Unknown migration version {version}")
+    SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+    if version not in applied_versions():
+        _record(item)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Versioned schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="List migrations and whether each is applied")
+    upgrade = commands.add_parser("upgrade", help="Apply pending migrations")
+    upgrade.add_argument("--target", help="Stop after this version")
+    mark = commands.add_parser("mark-applied", help="Record a migration as applied without running it")
+    mark.add_argument("version")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+        applied = applied_versions()
+        for item in MIGRATIONS:
+            print(f"{'applied' if item.version in applied else 'pending':8} {item.version}  {item.name}")
+    elif args.command == "upgrade":
+        Base.metadata.create_all(bind=engine)
+        versions = migrate(args.target)
+        print(f"Applied {len(versions)} migrations{': ' + ', '.join(versions) if versions else ''}")
+    elif args.command == "mark-applied":
+        mark_applied(args.version)
+        print(f"Marked {args.version} as applied")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, String, DateTime, Integer, ForeignKey, Boolean, Text, Table,
+    Column, String, DateTime, Integer, Float, ForeignKey, Boolean, Text, Table, Index,
     DECIMAL  # Consider using DECIMAL for currency/financial figures if needed
 )
 from sqlalchemy.dialects.mssql import DATETIME2  # Use appropriate SQL Server types if needed
@@ -142,11 +142,19 @@ class CampaignContact(Base):
     call_uuid = Column(String(255), nullable=True, index=True)  # Added index
     additional_data = Column(Text)  # JSON serialized
     created_at = Column(DateTime, default=func.now())  #
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())  #
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), index=True)  # Incremental exports
 
     # Relationships
     campaign = relationship("Campaign", back_populates="contacts")  #
 
+    __table_args__ = (
+        # Executor hot path: next pending contact / status counts for a campaign
+        Index('ix_campaign_contacts_campaign_status', 'campaign_id', 'status'),
+        # Status sweeps across campaigns (update_call_statuses, stuck-call reaper) without key lookups
+        Index('ix_campaign_contacts_status_campaign', 'status', 'campaign_id',
+              mssql_include=['call_uuid', 'updated_at']),
+    )
+
     # If using ForeignKey for call_uuid:
     # call_log = relationship("CallLog")
 
@@ -203,6 +211,7 @@ class CallLog(Base):
     plivo_data = Column(Text)  # JSON serialized full response #
     ultravox_data = Column(Text)  # JSON serialized full response #
     transcription = Column(Text)  # JSON serialized #
+    transcript_indexed_at = Column(DateTime, nullable=True)  # When transcription was last split into transcript_messages
     recording_url = Column(Text)  #
     summary = Column(Text)  #
 
@@ -214,7 +223,7 @@ class CallLog(Base):
 
     # Metadata
     created_at = Column(DateTime, default=func.now(), index=True)  # Added index #
-    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())  #
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), index=True)  # Incremental exports
 
     # Relationships
     agent = relationship("Agent", back_populates="calls")  #
@@ -222,6 +231,12 @@ class CallLog(Base):
     analytics = relationship("CallAnalytics", uselist=False, back_populates="call",
                              cascade="all, delete-orphan")  # Added cascade
 
+    __table_args__ = (
+        # Recent calls for a campaign / agent, newest first
+        Index('ix_call_logs_campaign_created', 'campaign_id', 'created_at'),
+        Index('ix_call_logs_agent_created', 'agent_id', 'created_at'),
+    )
+
     def __repr__(self):
         return f"<CallLog id={self.id} call_uuid={self.call_uuid}>"  #
 
@@ -292,7 +307,10 @@ class CallAnalytics(Base):
     call_success = Column(Boolean, default=True)  #
     entities_extracted = Column(Text)  # JSON serialized #
     sentiment_analysis = Column(Text)  # JSON serialized #
+    transcript_metrics = Column(Text, nullable=True)  # JSON serialized (see transcript_metrics.py)
+    rollup_contribution = Column(Text, nullable=True)  # JSON serialized, what this call adds to its campaign rollup
     analyzed_at = Column(DateTime, default=func.now())  #
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=True, index=True)
 
     # Relationships
     call = relationship("CallLog", back_populates="analytics")  #
@@ -312,6 +330,11 @@ class CallAnalytics(Base):
         except json.JSONDecodeError:
             logger.warning(f"Could not parse sentiment_analysis JSON for analytics {self.id}")
             sentiment = {}
+        try:
+            transcript_metrics = json.loads(self.transcript_metrics or '{}')
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse transcript_metrics JSON for analytics {self.id}")
+            transcript_metrics = {}
 
         return {
             "id": self.id,  #
@@ -325,6 +348,7 @@ class CallAnalytics(Base):
             "call_success": self.call_success,  #
             "entities_extracted": entities,  #
             "sentiment_analysis": sentiment,  #
+            "transcript_metrics": transcript_metrics,
             "analyzed_at": self.analyzed_at.isoformat() if self.analyzed_at else None  #
         }
 
@@ -358,12 +382,13 @@ class SavedPhoneNumber(Base):
 
 
 # --- Legacy CallMapping ---
-# This table is kept for backward compatibility as mentioned in original code.
-# Consider migrating data from this table to CallLog and eventually removing it.
+# No longer written: CallLog.call_uuid / CallLog.ultravox_id hold the mapping and
+# migration 0003 (migrations.py) copies old rows across.
+# Kept read-only so the backfill can run; drop once every environment has run it.
 class CallMapping(Base):
     """
     Legacy model to store the mapping between Plivo call_uuid and Ultravox call_id.
-    Maintained for backward compatibility. New calls should use CallLog.
+    Read-only. Use CallLog for lookups.
     """
     __tablename__ = 'call_mappings'
 
@@ -435,3 +460,268 @@ class CallAnalysisStatus(Base):
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
+
+
+class ExecutorNode(Base):
+    """
+    Model to track campaign executor processes and their heartbeats
+    """
+    __tablename__ = 'executor_nodes'
+
+    node_id = Column(String(255), primary_key=True)
+    hostname = Column(String(255), nullable=True)
+    started_at = Column(DateTime, default=func.now())
+    heartbeat_at = Column(DateTime, default=func.now(), index=True)
+    state = Column(Text, nullable=True)  # JSON serialized snapshot of the node's executor state
+
+    def __repr__(self):
+        return f"<ExecutorNode node_id={self.node_id} heartbeat_at={self.heartbeat_at}>"
+
+    def to_dict(self):
+        try:
+            state = json.loads(self.state or '{}')
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse state JSON for executor node {self.node_id}")
+            state = {}
+
+        return {
+            "node_id": self.node_id,
+            "hostname": self.hostname,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "heartbeat_at": self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            "state": state
+        }
+
+
+class ExecutorLease(Base):
+    """
+    Model to store time-limited leases held by executor nodes (e.g. the 'leader' lease).
+    The holder's state is stored with the lease so the next holder can resume from it.
+    """
+    __tablename__ = 'executor_leases'
+
+    lease_key = Column(String(255), primary_key=True)
+    node_id = Column(String(255), nullable=True, index=True)  # NULL when released
+    acquired_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+    state = Column(Text, nullable=True)  # JSON serialized state handed over between holders
+
+    def __repr__(self):
+        return f"<ExecutorLease key={self.lease_key} node_id={self.node_id}>"
+
+    def to_dict(self):
+        return {
+            "lease_key": self.lease_key,
+            "node_id": self.node_id,
+            "acquired_at": self.acquired_at.isoformat() if self.acquired_at else None,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None
+        }
+
+
+class DialRateBucket(Base):
+    """
+    Model to store the outbound dialing token buckets (per caller ID and per
+    destination prefix) shared by every executor node. See rate_limiter.py.
+    """
+    __tablename__ = 'dial_rate_buckets'
+
+    bucket_key = Column(String(100), primary_key=True)  # "from:<number>" or "prefix:<digits>"
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime, nullable=False)  # When `tokens` was last refilled
+    version = Column(Integer, nullable=False, default=0)  # Bumped on every write, for compare-and-swap
+
+    def __repr__(self):
+        return f"<DialRateBucket key={self.bucket_key} tokens={self.tokens}>"
+
+
+class CacheVersion(Base):
+    """
+    Model to store version stamps for in-process caches. Writers bump the version
+    of a cache in the same transaction as the change; every node compares it with
+    the version its cache was loaded at.
+    """
+    __tablename__ = 'cache_versions'
+
+    cache_name = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<CacheVersion cache={self.cache_name} version={self.version}>"
+
+
+class CampaignAnalyticsRollup(Base):
+    """
+    Model to store the precomputed analysis rollup of a campaign. Maintained
+    incrementally by campaign_rollup.py as each call's analysis is stored.
+    """
+    __tablename__ = 'campaign_analytics_rollups'
+
+    campaign_id = Column(Integer, ForeignKey('campaigns.campaign_id'), primary_key=True)
+    analyzed_calls = Column(Integer, default=0)  # Calls with entity analysis
+    sentiment_counts = Column(Text, nullable=True)  # JSON serialized {sentiment: calls}
+    topic_counts = Column(Text, nullable=True)  # JSON serialized {topic: calls}
+    duration_counts = Column(Text, nullable=True)  # JSON serialized {seconds: calls}
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<CampaignAnalyticsRollup campaign_id={self.campaign_id} analyzed_calls={self.analyzed_calls}>"
+
+
+class AnalysisResult(Base):
+    """
+    Model to store memoized transcript analysis results, keyed by a hash of the
+    normalized transcript, the prompt version and the model (see analysis_cache.py)
+    """
+    __tablename__ = 'analysis_results'
+
+    content_hash = Column(String(64), primary_key=True)
+    prompt_version = Column(String(20), nullable=False)
+    model = Column(String(100), nullable=False)
+    result = Column(Text, nullable=False)  # JSON serialized entities
+    created_at = Column(DateTime, default=func.now())
+
+    def __repr__(self):
+        return f"<AnalysisResult hash={self.content_hash[:12]} model={self.model}>"
+
+
+class RecordingArchive(Base):
+    """
+    Model to track call recordings copied to local, content-addressed storage
+    (see recording_archiver.py). The row is created when a node claims the
+    recording, so each one is downloaded once.
+    """
+    __tablename__ = 'recording_archives'
+
+    id = Column(Integer, primary_key=True)
+    # No foreign key: the call may move to call_logs_archive (same id) when it ages out
+    call_id = Column(Integer, nullable=False, unique=True)
+    status = Column(String(20), default='pending', index=True)  # pending, archived, failed
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the stored file
+    storage_path = Column(String(500), nullable=True)  # Relative to RECORDING_ARCHIVE_DIR
+    format = Column(String(10), nullable=True)  # wav, opus, ...
+    size_bytes = Column(Integer, nullable=True)  # Stored size
+    source_bytes = Column(Integer, nullable=True)  # Size as downloaded, before transcoding
+    attempts = Column(Integer, default=0)
+    error_message = Column(Text, nullable=True)
+    node_url = Column(String(255), nullable=True)  # NODE_INTERNAL_URL of the node holding the file; NULL for shared storage
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    archived_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<RecordingArchive call_id={self.call_id} status={self.status}>"
+
+    def to_dict(self):
+        return {
+            "call_id": self.call_id,
+            "status": self.status,
+            "content_hash": self.content_hash,
+            "format": self.format,
+            "size_bytes": self.size_bytes,
+            "source_bytes": self.source_bytes,
+            "attempts": self.attempts,
+            "error_message": self.error_message,
+            "archived_at": self.archived_at.isoformat() if self.archived_at else None
+        }
+
+
+class TranscriptMessage(Base):
+    """
+    Model to store one transcript message per row, so calls can be searched by
+    what was said. The search index (SQLite FTS5 or SQL Server full-text) is
+    built over message_text; see transcript_search.py.
+    """
+    __tablename__ = 'transcript_messages'
+
+    id = Column(Integer, primary_key=True)
+    call_id = Column(Integer, nullable=False, index=True)  # call_logs.id, or call_logs_archive.id once archived
+    campaign_id = Column(Integer, nullable=True, index=True)  # Copied from the call, for filtering without a join
+    position = Column(Integer, nullable=False)  # Index of the message in the transcript
+    role = Column(String(10), nullable=False)  # agent or user
+    message_text = Column(Text, nullable=False)
+
+    def __repr__(self):
+        return f"<TranscriptMessage call_id={self.call_id} position={self.position}>"
+
+
+class SchemaMigration(Base):
+    """
+    Model to record which versioned schema migrations (see migrations.py) have
+    been applied to this database
+    """
+    __tablename__ = 'schema_migrations'
+
+    version = Column(String(20), primary_key=True)
+    name = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=func.now())
+    duration_seconds = Column(DECIMAL(10, 3), nullable=True)
+
+    def __repr__(self):
+        return f"<SchemaMigration version={self.version} name={self.name}>"
+
+
+class ExportWatermark(Base):
+    """
+    Model to record how far each incremental export (see parquet_export.py)
+    has got: rows updated up to exported_through have been written out
+    """
+    __tablename__ = 'export_watermarks'
+
+    dataset = Column(String(50), primary_key=True)
+    exported_through = Column(DateTime, nullable=False)  # Database time, like the updated_at columns it is compared to
+    rows_exported = Column(Integer, default=0)  # By the last run
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ExportWatermark dataset={self.dataset} exported_through={self.exported_through}>"
+
+
+# --- Cold storage ---
+# data_archiver.py moves old rows out of the hot tables into these copies. They
+# have the same columns (and keep the same ids) plus archived_at, but no
+# foreign keys and only the indexes the archive read paths need.
+
+def _archive_table(model, name, indexed):
+    columns = [Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False,
+                      nullable=column.nullable or column.primary_key, index=column.name in indexed)
+               for column in model.__table__.columns]
+    return Table(name, Base.metadata, *columns, Column('archived_at', DateTime, default=func.now()))
+
+
+class CallLogArchive(Base):
+    """
+    Model for call logs moved out of call_logs by data_archiver.py
+    """
+    __table__ = _archive_table(CallLog, 'call_logs_archive',
+                               {'call_uuid', 'ultravox_id', 'campaign_id', 'agent_id', 'created_at'})
+
+    def __repr__(self):
+        return f"<CallLogArchive id={self.id} call_uuid={self.call_uuid}>"
+
+    to_dict = CallLog.to_dict
+    to_dict_with_transcription = CallLog.to_dict_with_transcription
+
+
+class CallAnalyticsArchive(Base):
+    """
+    Model for the analytics of archived calls
+    """
+    __table__ = _archive_table(CallAnalytics, 'call_analytics_archive', {'call_id'})
+
+    def __repr__(self):
+        return f"<CallAnalyticsArchive id={self.id} call_id={self.call_id}>"
+
+    to_dict = CallAnalytics.to_dict
+
+
+class CampaignContactArchive(Base):
+    """
+    Model for contacts of completed campaigns moved out of campaign_contacts
+    """
+    __table__ = _archive_table(CampaignContact, 'campaign_contacts_archive', {'campaign_id', 'call_uuid'})
+
+    def __repr__(self):
+        return f"<CampaignContactArchive id={self.id} phone={self.phone}>"
+
+    to_dict = CampaignContact.to_dict
@@ -0,0 +1,327 @@
+"""
+Incremental Parquet export of calls and campaign contacts for offline analysis.
+
+Each run writes the rows updated since the dataset's watermark (see
+ExportWatermark) to
+
+    <PARQUET_EXPORT_DIR>/<dataset>/date=<created day>/campaign_id=<id>/part-<run>-<n>.parquet
+
+  - calls: CallLog with its CallAnalytics flattened into the same row
+  - contacts: CampaignContact outcomes
+
+campaign_id lives in the partition path only, as Hive-style readers expect
+(pyarrow.dataset(..., partitioning="hive"), Spark, DuckDB). Rows are
+streamed from the database with yield_per and written out in bounded
+batches. A row that changes again is exported again by a later run,
+in the same partition, so readers keep the latest updated_at per id.
+Archived rows only change in bulk moves, so incremental runs read the hot
+tables only; a --full run also reads the archive tables.
+
+pyarrow is optional: without it the export is disabled and the server only
+logs a warning.
+
+    python parquet_export.py [--full] [--dataset calls|contacts] [--output DIR]
+"""
+import argparse
+import os
+import threading
+import time
+import traceback
+from datetime import timedelta
+from sqlalchemy import select, union, literal, func, Boolean
+from models import (CallLog, CallAnalytics, CampaignContact, CallLogArchive, CallAnalyticsArchive,
+                    CampaignContactArchive, ExportWatermark)
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging, PARQUET_EXPORT_DIR, PARQUET_EXPORT_INTERVAL
+import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Set up logging
+logger = setup_logging("parquet_export", "parquet_export.log")
+
+EXPORT_BATCH_SIZE = 5000  # Rows fetched per round trip and buffered before writing
+EXPORT_SAFETY_LAG = 60  # Only export rows updated this long ago, so in-flight transactions are not skipped (seconds)
+PARQUET_COMPRESSION = "zstd"
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # Partition value for NULLs, as Hive-style readers expect
+
+_ARROW_TYPES = {
+    "int64": lambda: pa.int64(),
+    "string": lambda: pa.string(),
+    "bool": lambda: pa.bool_(),
+    "timestamp": lambda: pa.timestamp("ms"),
+}
+
+# (column name, type, source model, attribute)
+CALL_COLUMNS = [
+    ("id", "int64", "call", "id"),
+    ("call_uuid", "string", "call", "call_uuid"),
+    ("ultravox_id", "string", "call", "ultravox_id"),
+    ("campaign_id", "int64", "call", "campaign_id"),
+    ("agent_id", "string", "call", "agent_id"),
+    ("to_number", "string", "call", "to_number"),
+    ("from_number", "string", "call", "from_number"),
+    ("call_state", "string", "call", "call_state"),
+    ("call_duration", "int64", "call", "call_duration"),
+    ("initiation_time", "timestamp", "call", "initiation_time"),
+    ("answer_time", "timestamp", "call", "answer_time"),
+    ("end_time", "timestamp", "call", "end_time"),
+    ("hangup_cause", "string", "call", "hangup_cause"),
+    ("hangup_source", "string", "call", "hangup_source"),
+    ("language_hint", "string", "call", "language_hint"),
+    ("voice", "string", "call", "voice"),
+    ("summary", "string", "call", "summary"),
+    ("created_at", "timestamp", "call", "created_at"),
+    ("updated_at", "timestamp", "call", "updated_at"),
+    ("total_duration", "int64", "analytics", "total_duration"),
+    ("total_messages", "int64", "analytics", "total_messages"),
+    ("agent_messages", "int64", "analytics", "agent_messages"),
+    ("user_messages", "int64", "analytics", "user_messages"),
+    ("avg_agent_response_length", "int64", "analytics", "avg_agent_response_length"),
+    ("avg_user_response_length", "int64", "analytics", "avg_user_response_length"),
+    ("call_success", "bool", "analytics", "call_success"),
+    ("entities_extracted", "string", "analytics", "entities_extracted"),  # JSON
+    ("sentiment_analysis", "string", "analytics", "sentiment_analysis"),  # JSON
+    ("transcript_metrics", "string", "analytics", "transcript_metrics"),  # JSON
+    ("analyzed_at", "timestamp", "analytics", "analyzed_at"),
+    ("analytics_updated_at", "timestamp", "analytics", "updated_at"),
+]
+
+CONTACT_COLUMNS = [
+    ("id", "int64", "contact", "id"),
+    ("campaign_id", "int64", "contact", "campaign_id"),
+    ("name", "string", "contact", "name"),
+    ("phone", "string", "contact", "phone"),
+    ("status", "string", "contact", "status"),
+    ("call_uuid", "string", "contact", "call_uuid"),
+    ("additional_data", "string", "contact", "additional_data"),  # JSON
+    ("created_at", "timestamp", "contact", "created_at"),
+    ("updated_at", "timestamp", "contact", "updated_at"),
+]
+
+exported_rows = metrics.counter("parquet_export.rows", "Rows written to Parquet, by dataset")
+export_duration = metrics.histogram("parquet_export.run_seconds", "Time for one dataset export")
+
+
+def export_available():
+    return pa is not None
+
+
+def _columns(columns, **models):
+    return [getattr(models[source], attribute).label(name) for name, _, source, attribute in columns] + \
+        [literal(models["archived"], Boolean).label("archived")]
+
+
+def _calls_queries(session, low, high):
+    sources = [(CallLog, CallAnalytics, False)]
+    if low is None:
+        sources.append((CallLogArchive, CallAnalyticsArchive, True))
+
+    for call, analytics, archived in sources:
+        query = session.query(*_columns(CALL_COLUMNS, call=call, analytics=analytics, archived=archived)).outerjoin(
+            analytics, analytics.call_id == call.id)
+        if low is not None:
+            # Either half of the row may have changed; a UNION keeps both lookups on their updated_at index
+            changed = union(
+                select(call.id.label("id")).where(call.updated_at > low, call.updated_at <= high),
+                select(analytics.call_id.label("id")).where(analytics.updated_at > low, analytics.updated_at <= high)
+            ).subquery()
+            query = query.join(changed, changed.c.id == call.id)
+        yield query.order_by(call.created_at, call.id)
+
+
+def _contacts_queries(session, low, high):
+    sources = [(CampaignContact, False)]
+    if low is None:
+        sources.append((CampaignContactArchive, True))
+
+    for contact, archived in sources:
+        query = session.query(*_columns(CONTACT_COLUMNS, contact=contact, archived=archived))
+        if low is not None:
+            query = query.filter(contact.updated_at > low, contact.updated_at <= high)
+        yield query.order_by(contact.created_at, contact.id)
+
+
+DATASETS = {
+    "calls": (CALL_COLUMNS, _calls_queries),
+    "contacts": (CONTACT_COLUMNS, _contacts_queries),
+}
+
+
+def _partition_value(value):
+    return DEFAULT_PARTITION if value is None else value
+
+
+class _PartitionWriter:
+    """
+    Writes rows (without their campaign_id) to Hive-style date/campaign_id
+    partitions. Rows arrive ordered by day, so only the current day's files
+    are open at a time. Files are written under a temporary name and renamed
+    by commit().
+    """
+
+    def __init__(self, directory, columns, run_id, batch_size):
+        self.directory = directory
+        self.schema = pa.schema([(name, _ARROW_TYPES[kind]()) for name, kind, _, _ in columns
+                                 if name != "campaign_id"] + [("archived", pa.bool_())])
+        self.run_id = run_id
+        self.batch_size = batch_size
+        self.day = None
+        self.writers = {}  # campaign_id -> ParquetWriter for the current day
+        self.buffers = {}  # campaign_id -> rows not yet written
+        self.buffered = 0
+        self.files = []  # (temporary path, final path)
+        self.rows = 0
+
+    def add(self, day, campaign_id, row):
+        if day != self.day:
+            self._close_day()
+            self.day = day
+        self.buffers.setdefault(campaign_id, []).append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self._flush()
+
+    def _open(self, campaign_id):
+        directory = os.path.join(self.directory, f"date={self.day}", f"campaign_id={campaign_id}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{self.run_id}-{len(self.files)}.parquet")
+        self.files.append((path + ".tmp", path))
+        return pq.ParquetWriter(path + ".tmp", self.schema, compression=PARQUET_COMPRESSION)
+
+    def _flush(self):
+        for campaign_id, rows in self.buffers.items():
+            writer = self.writers.get(campaign_id)
+            if writer is None:
+                writer = self.writers[campaign_id] = self._open(campaign_id)
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), self.schema)],
+                schema=self.schema))
+            self.rows += len(rows)
+        self.buffers = {}
+        self.buffered = 0
+
+    def _close_day(self):
+        self._flush()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+    def commit(self):
+        self._close_day()
+        for temporary, path in self.files:
+            os.replace(temporary, path)
+        return self.rows
+
+    def abort(self):
+        for writer in self.writers.values():
+            try:
+                writer.close()
+            except Exception:
+                pass
+        for temporary, _ in self.files:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+
+def export_dataset(name, full=False, directory=PARQUET_EXPORT_DIR, batch_size=EXPORT_BATCH_SIZE):
+    """Export the rows of one dataset updated since its watermark. Returns the number of rows written."""
+    if not export_available():
+        raise RuntimeError("pyarrow is not installed; Parquet export is unavailable")
+
+    columns, queries = DATASETS[name]
+    names = [column[0] for column in columns]
+    day_index, campaign_index = names.index("created_at"), names.index("campaign_id")
+
+    started = time.monotonic()
+    db_session = get_db_session_with_retry()
+    try:
+        watermark = db_session.query(ExportWatermark).filter_by(dataset=name).first()
+        low = watermark.exported_through if watermark and not full else None
+        # Database time, as that is what the updated_at columns hold
+        high = db_session.query(func.now()).scalar() - timedelta(seconds=EXPORT_SAFETY_LAG)
+        if low is not None and high <= low:
+            return 0
+
+        writer = _PartitionWriter(os.path.join(directory, name), columns, high.strftime("%Y%m%dT%H%M%S"), batch_size)
+        try:
+            for query in queries(db_session, low, high):
+                for row in query.yield_per(batch_size):
+                    created_at = row[day_index]
+                    writer.add(_partition_value(created_at.date().isoformat() if created_at else None),
+                               _partition_value(row[campaign_index]),
+                               tuple(row[:campaign_index]) + tuple(row[campaign_index + 1:]))
+            rows = writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+        if watermark is None:
+            watermark = ExportWatermark(dataset=name)
+            db_session.add(watermark)
+        watermark.exported_through = high
+        watermark.rows_exported = rows
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        close_db_session(db_session)
+
+    exported_rows.inc(rows, label=name)
+    export_duration.observe(time.monotonic() - started)
+    logger.info(f"Exported {rows} {name} rows updated {'since ' + str(low) if low else 'ever'} "
+                f"through {high} in {time.monotonic() - started:.1f}s")
+    return rows
+
+
+def export_all(full=False, directory=PARQUET_EXPORT_DIR):
+    """Export every dataset. Returns {dataset: rows written}."""
+    return {name: export_dataset(name, full=full, directory=directory) for name in DATASETS}
+
+
+def start_parquet_export(interval=PARQUET_EXPORT_INTERVAL):
+    """Run export_all in the background every interval seconds, if enabled and pyarrow is installed"""
+    if interval <= 0:
+        return None
+    if not export_available():
+        logger.warning("PARQUET_EXPORT_INTERVAL is set but pyarrow is not installed; Parquet export disabled")
+        return None
+
+    stopping = threading.Event()
+
+    def run():
+        while not stopping.wait(interval):
+            try:
+                export_all()
+            except Exception as e:
+                logger.error(f"Error exporting Parquet: {str(e)}")
+                logger.error(traceback.format_exc())
+
+    thread = threading.Thread(target=run, name="parquet-export")
+    thread.daemon = True
+    thread.start()
+    return stopping
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export calls and campaign contacts to partitioned Parquet files")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and export everything, archives included")
+    parser.add_argument("--dataset", choices=sorted(DATASETS), help="Export one dataset only")
+    parser.add_argument("--output", default=PARQUET_EXPORT_DIR, help="Export directory")
+    args = parser.parse_args()
+
+    if not export_available():
+        raise SystemExit("pyarrow is not installed: pip install pyarrow")
+
+    for name in [args.dataset] if args.dataset else DATASETS:
+        rows = export_dataset(name, full=args.full, directory=args.output)
+        print(f"{name}: {rows} rows")
+
+
+if __name__ == "__main__":
+    main()
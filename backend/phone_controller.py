@@ -2,6 +2,7 @@ import logging
 from datetime import datetime
 from flask import Blueprint, request, jsonify
 from models import SavedPhoneNumber
+from caller_id_pool import get_number_health, get_active_calls_per_number
 from database import get_db_session, close_db_session, get_db_session_with_retry
 from config import setup_logging
 
@@ -45,6 +46,41 @@ def get_phone_numbers():
         close_db_session(db_session)
 
 
+@phone.route('/phone-numbers/health', methods=['GET'])
+def get_phone_number_health():
+    """
+    Get answer-rate health scores and active call counts for saved 'from' numbers
+    """
+    try:
+        db_session = get_db_session_with_retry()
+        from_numbers = db_session.query(SavedPhoneNumber).filter_by(number_type='from').order_by(
+            SavedPhoneNumber.last_used.asc()).all()
+
+        numbers = [saved.phone_number for saved in from_numbers]
+        health = get_number_health(db_session, numbers)
+        active_calls = get_active_calls_per_number(db_session, numbers)
+
+        results = []
+        for saved in from_numbers:
+            entry = saved.to_dict()
+            entry["health"] = health.get(saved.phone_number)
+            entry["active_calls"] = active_calls.get(saved.phone_number, 0)
+            results.append(entry)
+
+        return jsonify({
+            "status": "success",
+            "phone_numbers": results
+        })
+    except Exception as e:
+        logger.error(f"Error in get_phone_number_health: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        close_db_session(db_session)
+
+
 @phone.route('/phone-numbers/<int:number_id>', methods=['GET'])
 def get_phone_number(number_id):
     """
@@ -1,10 +1,13 @@
 import os
+import signal
+import sys
 from flask import Flask, Response, request, jsonify, current_app
 from datetime import datetime
 import json
 from flask_cors import CORS
 import logging
 import threading
+import time
 import traceback
 
 # Import from configuration and utilities
@@ -15,9 +18,19 @@ from analysis_controller import analysis
 from agent_controller import agent
 from phone_controller import phone
 from campaign_controller import campaign
+from search_controller import search
 from database import init_db, get_db_session, close_db_session, get_db_session_with_retry
-from models import CallLog, CallMapping, Agent
+from models import CallLog, Agent
 import campaign_executor  # Import the campaign executor module
+import metrics
+import webhook_writer
+from answer_payloads import answer_payloads, build_ultravox_payload
+from agent_cache import agent_cache
+from recording_archiver import recording_archiver
+from recording_peaks import on_recording_archived
+from transcript_search import ensure_search_index, start_transcript_backfill
+from data_archiver import start_archiver
+from parquet_export import start_parquet_export
 
 
 # Create a filter to ignore frequent endpoint logs
@@ -43,11 +56,17 @@ logging.getLogger('werkzeug').addFilter(EndpointFilter())
 # Set up logging
 logger = setup_logging("plivo_server", "plivo_server.log")
 
+# Webhook metrics
+answer_latency = metrics.histogram("webhooks.answer_latency_seconds", "Time to return Stream XML from answer_url")
+answer_cache_misses = metrics.counter("webhooks.answer_payload_cache_misses",
+                                      "Answered calls with no payload prepared by this node's make_call_api")
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
 # Initialize the database
 init_db()
+ensure_search_index()
 
 # Register the API blueprints
 app.register_blueprint(api, url_prefix='/api')
@@ -55,156 +74,117 @@ app.register_blueprint(analysis, url_prefix='/api')
 app.register_blueprint(agent, url_prefix='/api')
 app.register_blueprint(phone, url_prefix='/api')
 app.register_blueprint(campaign, url_prefix='/api')
+app.register_blueprint(search, url_prefix='/api')
+
+
+def payload_from_call_log(call_uuid):
+    """
+    Rebuild the answer payload of a call whose payload was prepared by another
+    node. make_call_api records the prompt, language, voice and max duration in
+    CallLog; the remaining settings come from the call's agent, as they did when
+    the call was placed. Returns (payload_json, call_info), or (None, None) if
+    the call has no CallLog row.
+    """
+    db_session = get_db_session_with_retry()
+    try:
+        call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
+        if not call_log:
+            return None, None
+        call_info = {
+            "system_prompt": call_log.system_prompt or SYSTEM_PROMPT,
+            "language_hint": call_log.language_hint or "hi",
+            "voice": call_log.voice or "Maushmi",
+            "max_duration": call_log.max_duration or "180s"
+        }
+        agent_id = call_log.agent_id
+    finally:
+        close_db_session(db_session)
+
+    agent_config = agent_cache.get(agent_id) if agent_id else None
+    settings = agent_config.settings if agent_config else {}
+    recording_enabled = settings.get("recording_enabled")
+    payload_json = answer_payloads.render(build_ultravox_payload(
+        system_prompt=call_info["system_prompt"],
+        language_hint=call_info["language_hint"],
+        voice=call_info["voice"],
+        max_duration=call_info["max_duration"],
+        vad_settings=settings.get("vad_settings") or DEFAULT_VAD_SETTINGS,
+        initial_messages=[],
+        inactivity_messages=settings.get("inactivity_messages") or [{"duration": "8s", "message": "are you there?"}],
+        recording_enabled=recording_enabled if recording_enabled is not None else True
+    ))
+    return payload_json, call_info
 
 
 @app.route('/answer_url', methods=['GET'])
 def answer_url():
     """
     This endpoint is called by Plivo when a call is answered.
-    Updated to work with new database schema.
+    Everything between the answer and the Stream XML is dead air for the callee, so
+    the payload comes pre-serialized from make_call_api and DB bookkeeping is left
+    to the background webhook writer.
     """
+    started = time.perf_counter()
     call_uuid = request.args.get('CallUUID', 'unknown')
-    logger.info(f"Call answered - CallUUID: {call_uuid}")
-    logger.info(f"Request args: {request.args}")
-
-    # Use the max_duration from request args or default to "180s"
-    max_duration = request.args.get('max_duration', "180s")
-
-    # Check if custom parameters were set for this request
-    system_prompt = current_app.config.get("CUSTOM_SYSTEM_PROMPT", SYSTEM_PROMPT)
-    language_hint = current_app.config.get("CUSTOM_LANGUAGE_HINT", "hi")
-    voice = current_app.config.get("CUSTOM_VOICE", "Maushmi")
-    vad_settings = current_app.config.get("CUSTOM_VAD_SETTINGS", DEFAULT_VAD_SETTINGS)
-
-    # Ensure initial_messages is properly formatted
-    initial_messages = current_app.config.get("CUSTOM_INITIAL_MESSAGES", [])
-
-    # Format initial messages correctly for Ultravox API
-    formatted_initial_messages = []
-    # for msg in initial_messages:
-    #     if isinstance(msg, str):
-    #         formatted_initial_messages.append({"text": msg})
-    #     elif isinstance(msg, dict) and "text" in msg:
-    #         formatted_initial_messages.append({"text": msg["text"]})
-
-    inactivity_messages = current_app.config.get("CUSTOM_INACTIVITY_MESSAGES",
-                                                 [{"duration": "8s", "message": "are you there?"}])
-    recording_enabled = current_app.config.get("CUSTOM_RECORDING_ENABLED", True)
-
-    logger.info(f"Using system_prompt: {system_prompt[:50]}...")
-    logger.info(f"Using language_hint: {language_hint}")
-    logger.info(f"Using voice: {voice}")
-    logger.info(f"Using max_duration: {max_duration}")
-    logger.info(f"Using vad_settings: {vad_settings}")
-    logger.info(f"Using initial_messages: {formatted_initial_messages}")
-    logger.info(f"Using inactivity_messages: {inactivity_messages}")
-    logger.info(f"Using recording_enabled: {recording_enabled}")
-
-    # Set up the Ultravox payload
-    ultravox_payload = {
-        "systemPrompt": system_prompt,
-        "temperature": 0.2,
-        "languageHint": language_hint,
-        "voice": voice,
-        "initialMessages": formatted_initial_messages,
-        "maxDuration": max_duration,
-        "inactivityMessages": inactivity_messages,
-        "selectedTools": [],
-        "recordingEnabled": recording_enabled,
-        "transcriptOptional": True,
-        "medium": {"plivo": {}},
-        "vadSettings": vad_settings
-    }
 
     try:
-        # Get join URL from Ultravox API
-        join_url, call_id = get_join_url(ultravox_payload)
+        payload_json, call_info = answer_payloads.get(call_uuid)
+
+        if payload_json is None:
+            # Placed by another node's make_call_api: rebuild from the CallLog row it wrote
+            answer_cache_misses.inc()
+            payload_json, call_info = payload_from_call_log(call_uuid)
+
+        if payload_json is None:
+            # Call not placed through make_call_api: build the payload
+            # from the custom parameters set in the app context
+            call_info = {
+                "system_prompt": current_app.config.get("CUSTOM_SYSTEM_PROMPT") or SYSTEM_PROMPT,
+                "language_hint": current_app.config.get("CUSTOM_LANGUAGE_HINT") or "hi",
+                "voice": current_app.config.get("CUSTOM_VOICE") or "Maushmi",
+                # Use the max_duration from request args or default to "180s"
+                "max_duration": request.args.get('max_duration', "180s")
+            }
+            payload_json = answer_payloads.render(build_ultravox_payload(
+                system_prompt=call_info["system_prompt"],
+                language_hint=call_info["language_hint"],
+                voice=call_info["voice"],
+                max_duration=call_info["max_duration"],
+                vad_settings=current_app.config.get("CUSTOM_VAD_SETTINGS") or DEFAULT_VAD_SETTINGS,
+                initial_messages=[],
+                inactivity_messages=current_app.config.get("CUSTOM_INACTIVITY_MESSAGES") or
+                                    [{"duration": "8s", "message": "are you there?"}],
+                recording_enabled=current_app.config.get("CUSTOM_RECORDING_ENABLED", True)
+            ))
 
-        # Store call ID for future reference
-        logger.info(f"Ultravox call ID: {call_id}")
+        # Get join URL from Ultravox API
+        join_url, call_id = get_join_url(payload_json)
 
         # Store the call_id in app context for use when the call is hung up
         current_app.config["CURRENT_ULTRAVOX_CALL_ID"] = call_id
         current_app.config["CURRENT_PLIVO_CALL_UUID"] = call_uuid
 
-        # Get phone numbers from request
-        recipient_number = request.args.get('To', '')
-        from_number = request.args.get('From', '')
-
-        # Update the database with call information
-        try:
-            db_session = get_db_session_with_retry()
-
-            # First check if a CallLog record already exists for this call_uuid
-            call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
-
-            if call_log:
-                # Update the existing record
-                logger.info(f"Updating existing call record: {call_uuid}")
-                call_log.ultravox_id = call_id
-                if not call_log.to_number:
-                    call_log.to_number = recipient_number
-                if not call_log.from_number:
-                    call_log.from_number = from_number
-                call_log.system_prompt = system_prompt
-                call_log.language_hint = language_hint
-                call_log.voice = voice
-                call_log.max_duration = max_duration
-            else:
-                # Create a new CallLog record
-                logger.info(f"Creating new call record: {call_uuid}")
-                new_call = CallLog(
-                    call_uuid=call_uuid,
-                    ultravox_id=call_id,
-                    to_number=recipient_number,
-                    from_number=from_number,
-                    system_prompt=system_prompt,
-                    language_hint=language_hint,
-                    voice=voice,
-                    max_duration=max_duration,
-                    initiation_time=datetime.now()
-                )
-                db_session.add(new_call)
-
-            # Also maintain the legacy mapping for backward compatibility
-            # Check if mapping already exists
-            existing_mapping = db_session.query(CallMapping).filter_by(plivo_call_uuid=call_uuid).first()
-
-            if existing_mapping:
-                logger.info(f"Updating existing call mapping: {call_uuid} -> {call_id}")
-                existing_mapping.ultravox_call_id = call_id
-                existing_mapping.recipient_phone_number = recipient_number
-                existing_mapping.plivo_phone_number = from_number
-                existing_mapping.system_prompt = system_prompt
-            else:
-                # Create a new mapping
-                logger.info(f"Creating new call mapping: {call_uuid} -> {call_id}")
-                new_mapping = CallMapping(
-                    plivo_call_uuid=call_uuid,
-                    ultravox_call_id=call_id,
-                    recipient_phone_number=recipient_number,
-                    plivo_phone_number=from_number,
-                    system_prompt=system_prompt
-                )
-                db_session.add(new_mapping)
-
-            db_session.commit()
-            logger.info(f"Database updated successfully for call {call_uuid}")
-        except Exception as e:
-            logger.error(f"Error updating database in answer_url: {str(e)}")
-            logger.error(traceback.format_exc())
-        finally:
-            close_db_session(db_session)
-
         # Validate the join_url format
         if not join_url.startswith("wss://"):
             logger.error(f"Invalid join_url format: {join_url}")
             return Response("Error: Invalid join URL format", status=500)
 
+        # Record the call in the database off the request path
+        webhook_writer.record_answer(
+            call_uuid=call_uuid,
+            ultravox_id=call_id,
+            to_number=request.args.get('To', ''),
+            from_number=request.args.get('From', ''),
+            system_prompt=call_info.get("system_prompt"),
+            language_hint=call_info.get("language_hint"),
+            voice=call_info.get("voice"),
+            max_duration=call_info.get("max_duration")
+        )
+
+        logger.info(f"Call answered - CallUUID: {call_uuid}, Ultravox call ID: {call_id}")
+
         # Properly formatted XML response for Plivo - simplified to avoid whitespace issues
         xml_response = f'<Response><Stream keepCallAlive="true" contentType="audio/x-l16;rate=16000" bidirectional="true">{join_url}</Stream></Response>'
-
-        logger.info(f"Sending XML response to Plivo: {xml_response}")
         return Response(xml_response, mimetype='application/xml')
 
     except Exception as e:
@@ -212,116 +192,45 @@ def answer_url():
         logger.error(error_msg)
         logger.error(traceback.format_exc())
         return Response(f"Error: {str(e)}", status=500)
+    finally:
+        answer_latency.observe(time.perf_counter() - started)
 
 
 @app.route('/hangup_url', methods=['POST'])
 def hangup_url():
     """
     This endpoint is called by Plivo when a call is hung up.
-    Updated to work with new database schema.
+    The CallLog update is buffered by the webhook writer, which coalesces it with
+    the call's answer update and writes it in the next batch.
     """
-    logger.info("Call hung up")
-    logger.info(f"Hangup data: {request.form}")
-
     # Log important call details
     call_uuid = request.form.get('CallUUID', 'unknown')
     call_status = request.form.get('CallStatus', 'unknown')
     duration = request.form.get('Duration', 'unknown')
     hangup_cause = request.form.get('HangupCause', 'unknown')
 
-    logger.info(f"Call {call_uuid} ended with status {call_status}")
-    logger.info(f"Call duration: {duration} seconds, Hangup cause: {hangup_cause}")
+    logger.info(f"Call {call_uuid} ended with status {call_status}, "
+                f"duration: {duration} seconds, hangup cause: {hangup_cause}")
 
     # Get the Ultravox call ID from app context if available
     ultravox_call_id = current_app.config.get("CURRENT_ULTRAVOX_CALL_ID")
-    logger.info(f"Hangup handler app context Ultravox ID: {ultravox_call_id}")
 
-    # Get call details from the request form
-    recipient_number = request.form.get('To', '')
-    plivo_number = request.form.get('From', '')
-    bill_duration = request.form.get('BillDuration', '0')
-    total_cost = request.form.get('TotalCost', '0')
-
-    # Update the database with call information
     try:
-        db_session = get_db_session_with_retry()
-
-        # Update CallLog record
-        call_log = db_session.query(CallLog).filter_by(call_uuid=call_uuid).first()
-
-        if call_log:
-            # Update existing record
-            logger.info(f"Updating existing call record on hangup: {call_uuid}")
-            if ultravox_call_id and not call_log.ultravox_id:
-                call_log.ultravox_id = ultravox_call_id
-
-            # Update call details
-            call_log.call_state = call_status
-            call_log.call_duration = int(duration) if duration and duration != 'unknown' else None
-            call_log.hangup_cause = hangup_cause if hangup_cause != 'unknown' else None
-            call_log.end_time = datetime.now()
-
-            # Store additional data
-            plivo_data = call_log.plivo_data
-            if plivo_data:
-                try:
-                    plivo_data_dict = json.loads(plivo_data)
-                except:
-                    plivo_data_dict = {}
-            else:
-                plivo_data_dict = {}
-
-            plivo_data_dict.update({
-                'bill_duration': bill_duration,
-                'total_cost': total_cost,
-                'hangup_data': {k: request.form.get(k) for k in request.form}
-            })
-
-            call_log.plivo_data = json.dumps(plivo_data_dict)
-        else:
-            # Create new record if it doesn't exist
-            logger.info(f"Creating new call record on hangup: {call_uuid}")
-            new_call = CallLog(
-                call_uuid=call_uuid,
-                ultravox_id=ultravox_call_id,
-                to_number=recipient_number,
-                from_number=plivo_number,
-                call_state=call_status,
-                call_duration=int(duration) if duration and duration != 'unknown' else None,
-                hangup_cause=hangup_cause if hangup_cause != 'unknown' else None,
-                initiation_time=datetime.now() - (datetime.now() - datetime.now()),  # Approximate
-                end_time=datetime.now(),
-                plivo_data=json.dumps({
-                    'bill_duration': bill_duration,
-                    'total_cost': total_cost,
-                    'hangup_data': {k: request.form.get(k) for k in request.form}
-                })
-            )
-            db_session.add(new_call)
-
-        # Update legacy CallMapping
-        if ultravox_call_id:
-            # Check if mapping exists
-            mapping = db_session.query(CallMapping).filter_by(plivo_call_uuid=call_uuid).first()
-
-            if not mapping:
-                # Create new mapping
-                new_mapping = CallMapping(
-                    plivo_call_uuid=call_uuid,
-                    ultravox_call_id=ultravox_call_id,
-                    recipient_phone_number=recipient_number,
-                    plivo_phone_number=plivo_number
-                )
-                db_session.add(new_mapping)
-                logger.info(f"Created new legacy mapping on hangup: {call_uuid} -> {ultravox_call_id}")
-
-        db_session.commit()
-        logger.info(f"Database updated successfully for call {call_uuid} on hangup")
+        webhook_writer.record_hangup(
+            call_uuid=call_uuid,
+            ultravox_id=ultravox_call_id,
+            to_number=request.form.get('To', ''),
+            from_number=request.form.get('From', ''),
+            call_state=call_status,
+            call_duration=int(duration) if duration and duration != 'unknown' else None,
+            hangup_cause=hangup_cause if hangup_cause != 'unknown' else None,
+            bill_duration=request.form.get('BillDuration', '0'),
+            total_cost=request.form.get('TotalCost', '0'),
+            hangup_data={k: request.form.get(k) for k in request.form}
+        )
     except Exception as e:
-        logger.error(f"Error updating database in hangup_url: {str(e)}")
+        logger.error(f"Error recording hangup for call {call_uuid}: {str(e)}")
         logger.error(traceback.format_exc())
-    finally:
-        close_db_session(db_session)
 
     # Clear the stored call IDs
     current_app.config["CURRENT_ULTRAVOX_CALL_ID"] = None
@@ -359,10 +268,13 @@ def home():
             "/api/recent_calls - List recent calls",
             "/api/call_transcription/<call_id> - Get call transcription",
             "/api/call_recording/<call_id> - Get call recording URL",
+            "/api/call_recording/<call_id>/audio - Archived call recording",
+            "/api/call_recording/<call_id>/peaks - Waveform peaks for an archived recording",
             "/api/call_analytics/<call_id>/<call_uuid> - Get call analytics",
             "/api/agents - Manage agents",
             "/api/campaigns - Manage campaigns",
-            "/api/phone-numbers - Manage saved phone numbers"
+            "/api/phone-numbers - Manage saved phone numbers",
+            "/api/search/transcripts - Search call transcripts"
         ],
         "timestamp": datetime.now().isoformat()
     })
@@ -394,7 +306,23 @@ def campaign_executor_status():
     """Get the campaign executor status"""
     return jsonify({
         "status": "success",
-        "running": campaign_executor.running
+        "running": campaign_executor.running,
+        "node_id": campaign_executor.executor_state.NODE_ID,
+        "is_leader": campaign_executor.is_leader,
+        "owned_campaigns": sorted(campaign_executor.owned_campaigns),
+        "rate_limits": campaign_executor.dial_limiter.status(),
+        "scheduler": campaign_executor.campaign_scheduler.status(),
+        "reaped_calls": campaign_executor.reaped_calls.snapshot()
+    })
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Get in-process counters and gauges (reaper, executor, webhooks)"""
+    return jsonify({
+        "status": "success",
+        "metrics": metrics.snapshot(),
+        "timestamp": datetime.now().isoformat()
     })
 
 
@@ -421,8 +349,25 @@ if __name__ == '__main__':
     app.config["CURRENT_ULTRAVOX_CALL_ID"] = None
     app.config["CURRENT_PLIVO_CALL_UUID"] = None
 
+    # Turn SIGTERM into a normal exit so atexit handlers (e.g. draining the
+    # webhook write buffer) run on a graceful shutdown
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     # Initialize campaign executor
     logger.info("Initializing campaign executor")
     campaign_executor.initialize()
 
+    # Copy finished calls' recordings to local storage before their signed URLs expire
+    recording_archiver.on_archived.append(on_recording_archived)
+    recording_archiver.start()
+
+    # Index transcripts stored before transcript search existed
+    start_transcript_backfill()
+
+    # Move aged calls and finished campaigns' contacts to the archive tables
+    start_archiver()
+
+    # Incremental Parquet export for offline analysis, when PARQUET_EXPORT_INTERVAL is set
+    start_parquet_export()
+
     app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,217 @@
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from models import DialRateBucket
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("rate_limiter", "rate_limiter.log")
+
+# Default limits for outbound dialing
+FROM_NUMBER_CALLS_PER_SECOND = 0.2  # One call every 5 seconds per caller ID
+FROM_NUMBER_BURST = 1  # Calls a caller ID may place back-to-back
+CARRIER_CALLS_PER_SECOND = 1.0  # Calls per second per destination prefix
+CARRIER_BURST = 2  # Calls a destination prefix may receive back-to-back
+CARRIER_PREFIX_LENGTH = 5  # Digits (including '+') used to group destinations by carrier
+FROM_NUMBER_KEY_PREFIX = "from:"  # dial_rate_buckets keys of caller ID buckets
+CARRIER_KEY_PREFIX = "prefix:"  # dial_rate_buckets keys of destination prefix buckets
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Tokens refill continuously at `rate` per second
+    up to `capacity`.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def available(self, amount=1):
+        """Check whether `amount` tokens could be taken right now"""
+        with self.lock:
+            self._refill(time.monotonic())
+            return self.tokens >= amount
+
+    def try_acquire(self, amount=1):
+        """Take `amount` tokens if available, without blocking"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    def adjust(self, amount):
+        """
+        Return (positive) or charge (negative) tokens after the fact, e.g. when the
+        actual cost of a request differs from what was taken up front. A charge
+        may leave the bucket below zero, delaying later acquisitions.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def export_state(self):
+        """Token level with a wall-clock timestamp, so it can be restored in another process"""
+        with self.lock:
+            self._refill(time.monotonic())
+            return {"tokens": self.tokens, "at": time.time()}
+
+    def import_state(self, state):
+        """Restore a level saved by export_state, crediting the time that has passed since"""
+        with self.lock:
+            elapsed = max(time.time() - state.get("at", time.time()), 0)
+            self.tokens = min(self.capacity, float(state.get("tokens", self.capacity)) + elapsed * self.rate)
+            self.updated = time.monotonic()
+
+    def wait_time(self, amount=1):
+        """Seconds until `amount` tokens will be available"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                return 0
+            return (amount - self.tokens) / self.rate if self.rate > 0 else float('inf')
+
+
+class DialRateLimiter:
+    """
+    Rate limiter for outbound calls keyed by caller ID (from number) and by
+    destination prefix (a proxy for the terminating carrier).
+
+    The buckets live in the dial_rate_buckets table rather than in process
+    memory: every executor node dials, and a caller ID or carrier shared by
+    campaigns on different nodes must still get one budget, not one per node.
+    Levels are refilled on read and taken with a compare-and-swap on the row
+    version, so concurrent nodes cannot spend the same token.
+    """
+
+    def __init__(self, from_rate=FROM_NUMBER_CALLS_PER_SECOND, from_burst=FROM_NUMBER_BURST,
+                 carrier_rate=CARRIER_CALLS_PER_SECOND, carrier_burst=CARRIER_BURST,
+                 prefix_length=CARRIER_PREFIX_LENGTH):
+        self.from_rate = from_rate
+        self.from_burst = from_burst
+        self.carrier_rate = carrier_rate
+        self.carrier_burst = carrier_burst
+        self.prefix_length = prefix_length
+
+    def destination_prefix(self, phone):
+        """Group a destination number by its leading digits"""
+        if not phone:
+            return ""
+        if not phone.startswith('+'):
+            phone = '+' + phone
+        return phone[:self.prefix_length]
+
+    def _buckets_for(self, from_number, to_number):
+        """(bucket_key, rate, capacity) of the caller ID and destination prefix buckets"""
+        return [
+            (f"{FROM_NUMBER_KEY_PREFIX}{from_number}", self.from_rate, self.from_burst),
+            (f"{CARRIER_KEY_PREFIX}{self.destination_prefix(to_number)}", self.carrier_rate, self.carrier_burst)
+        ]
+
+    def _load(self, db_session, buckets, now):
+        """Bucket rows by key, creating missing buckets full"""
+        keys = [key for key, _, _ in buckets]
+        rows = {row.bucket_key: row for row in
+                db_session.query(DialRateBucket).filter(DialRateBucket.bucket_key.in_(keys)).all()}
+
+        missing = [(key, capacity) for key, _, capacity in buckets if key not in rows]
+        if missing:
+            for key, capacity in missing:
+                db_session.add(DialRateBucket(bucket_key=key, tokens=float(capacity), updated_at=now, version=0))
+            try:
+                db_session.commit()
+            except IntegrityError:
+                # Another node created it first
+                db_session.rollback()
+            rows = {row.bucket_key: row for row in
+                    db_session.query(DialRateBucket).filter(DialRateBucket.bucket_key.in_(keys)).all()}
+        return rows
+
+    @staticmethod
+    def _level(row, rate, capacity, now):
+        """Tokens in a bucket row after refilling it up to `now`"""
+        elapsed = max((now - row.updated_at).total_seconds(), 0) if row.updated_at else 0
+        return min(float(capacity), row.tokens + elapsed * rate)
+
+    def try_acquire(self, from_number, to_number):
+        """
+        Take one token from both the caller ID bucket and the destination prefix
+        bucket. Either both are taken or neither is; losing a race with another
+        node counts as no budget, and the caller tries again next cycle.
+        """
+        buckets = self._buckets_for(from_number, to_number)
+        db_session = get_db_session_with_retry()
+        try:
+            now = datetime.now()
+            rows = self._load(db_session, buckets, now)
+            levels = {key: self._level(rows[key], rate, capacity, now) for key, rate, capacity in buckets}
+            if any(level < 1 for level in levels.values()):
+                return False
+
+            for key, _, _ in buckets:
+                updated = db_session.query(DialRateBucket).filter(
+                    DialRateBucket.bucket_key == key,
+                    DialRateBucket.version == rows[key].version
+                ).update({
+                    DialRateBucket.tokens: levels[key] - 1,
+                    DialRateBucket.updated_at: now,
+                    DialRateBucket.version: rows[key].version + 1
+                }, synchronize_session=False)
+                if updated != 1:
+                    db_session.rollback()
+                    return False
+
+            db_session.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error taking dial token for {from_number} -> {to_number}: {str(e)}")
+            db_session.rollback()
+            return False
+        finally:
+            close_db_session(db_session)
+
+    def can_dial(self, from_number, to_number):
+        """Check whether a call could be placed right now, without taking tokens"""
+        buckets = self._buckets_for(from_number, to_number)
+        db_session = get_db_session_with_retry()
+        try:
+            now = datetime.now()
+            rows = self._load(db_session, buckets, now)
+            return all(self._level(rows[key], rate, capacity, now) >= 1 for key, rate, capacity in buckets)
+        finally:
+            close_db_session(db_session)
+
+    def status(self):
+        """Snapshot of bucket levels for diagnostics"""
+        db_session = get_db_session_with_retry()
+        try:
+            now = datetime.now()
+            status = {"from_numbers": {}, "carrier_prefixes": {}}
+            for row in db_session.query(DialRateBucket).all():
+                if row.bucket_key.startswith(FROM_NUMBER_KEY_PREFIX):
+                    key = row.bucket_key[len(FROM_NUMBER_KEY_PREFIX):]
+                    status["from_numbers"][key] = round(self._level(row, self.from_rate, self.from_burst, now), 2)
+                elif row.bucket_key.startswith(CARRIER_KEY_PREFIX):
+                    key = row.bucket_key[len(CARRIER_KEY_PREFIX):]
+                    status["carrier_prefixes"][key] = round(
+                        self._level(row, self.carrier_rate, self.carrier_burst, now), 2)
+            return status
+        finally:
+            close_db_session(db_session)
+
+
+# Shared limiter used by the campaign executor
+dial_limiter = DialRateLimiter()
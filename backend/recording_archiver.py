@@ -0,0 +1,386 @@
+import hashlib
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from models import CallLog, RecordingArchive
+from database import close_db_session, get_db_session_with_retry
+from config import (setup_logging, ULTRAVOX_API_KEY, ULTRAVOX_API_BASE_URL, RECORDING_ARCHIVE_DIR,
+                    RECORDING_ARCHIVE_FORMAT, NODE_INTERNAL_URL)
+import metrics
+
+# Set up logging
+logger = setup_logging("recording_archiver", "recording_archiver.log")
+
+ARCHIVE_WORKERS = 2  # Recordings downloaded in parallel
+SWEEP_INTERVAL = 30  # How often ended calls are checked for unarchived recordings (seconds)
+ARCHIVE_DELAY = 60  # Time after hangup before the first attempt, while Ultravox finalizes the recording (seconds)
+LOOKBACK_HOURS = 72  # Calls that ended longer ago than this are not picked up by the sweep
+SWEEP_BATCH_SIZE = 50  # Calls queued per sweep
+MAX_ATTEMPTS = 5  # Attempts per recording before giving up
+RETRY_INTERVAL = 300  # Time between attempts for a recording that failed (seconds)
+CLAIM_TIMEOUT = 600  # A 'pending' claim older than this is considered abandoned (seconds)
+DOWNLOAD_TIMEOUT = (10, 60)  # Connect and read timeouts for the recording download (seconds)
+CHUNK_SIZE = 64 * 1024  # Bytes read from the download at a time
+OPUS_BITRATE = "24k"  # Speech-quality Opus; roughly a tenth of 16-bit PCM WAV
+TRANSCODE_TIMEOUT = 300  # Upper bound for one ffmpeg run (seconds)
+STABLE_URL = "/api/call_recording/{call_id}/audio"  # Local endpoint serving archived recordings
+PROXIED_HEADER = "X-Recording-Proxied"  # Set on requests forwarded to the holding node, so they are never forwarded again
+
+# Archiver metrics
+archived_recordings = metrics.counter("recordings.archived", "Recordings archived, by stored format")
+archive_failures = metrics.counter("recordings.archive_failures", "Failed archive attempts, by reason")
+archived_bytes = metrics.counter("recordings.archived_bytes", "Bytes written to the recording archive")
+archive_duration = metrics.histogram("recordings.archive_seconds", "Time to download, transcode and store a recording")
+
+
+class RecordingNotReady(Exception):
+    """Ultravox has no recording for the call (yet)"""
+
+
+def stable_url(ultravox_id):
+    return STABLE_URL.format(call_id=ultravox_id)
+
+
+def archive_path(storage_path):
+    """Absolute path of an archived file"""
+    return os.path.join(RECORDING_ARCHIVE_DIR, storage_path)
+
+
+def _transcoding_enabled():
+    return RECORDING_ARCHIVE_FORMAT == "opus" and shutil.which("ffmpeg") is not None
+
+
+def _download(ultravox_id, temp_path):
+    """Stream the recording to temp_path. Returns the number of bytes written."""
+    response = requests.get(
+        f"{ULTRAVOX_API_BASE_URL}/calls/{ultravox_id}/recording",
+        headers={'X-API-Key': ULTRAVOX_API_KEY},
+        stream=True,
+        timeout=DOWNLOAD_TIMEOUT,
+        allow_redirects=True  # The API redirects to a signed storage URL
+    )
+    with response:
+        if response.status_code in (404, 425):
+            raise RecordingNotReady(f"{response.status_code} - {response.reason}")
+        response.raise_for_status()
+
+        size = 0
+        with open(temp_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                file.write(chunk)
+                size += len(chunk)
+
+    if size == 0:
+        raise RecordingNotReady("empty recording")
+    return size
+
+
+def _transcode_opus(source_path, target_path):
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", source_path,
+         "-c:a", "libopus", "-b:a", OPUS_BITRATE, "-application", "voip", target_path],
+        check=True, timeout=TRANSCODE_TIMEOUT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store(temp_path, extension):
+    """
+    Move a finished file into content-addressed storage. Identical recordings
+    share one file. Returns (content_hash, storage_path, size).
+    """
+    content_hash = _file_hash(temp_path)
+    storage_path = os.path.join(content_hash[:2], f"{content_hash}.{extension}")
+    target = archive_path(storage_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    if os.path.exists(target):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, target)
+    return content_hash, storage_path, os.path.getsize(target)
+
+
+class RecordingArchiver:
+    """
+    Copies call recordings from Ultravox to local storage once, after hangup.
+
+    A sweep thread queues ended calls without an archived recording; worker
+    threads claim each call through its recording_archives row (so only one
+    node downloads it), stream the recording to disk, optionally transcode it
+    to Opus and store it under its sha256. CallLog.recording_url then points at
+    the stable local endpoint instead of the expiring signed URL.
+
+    With a node-local RECORDING_ARCHIVE_DIR, the row records the holding node's
+    NODE_INTERNAL_URL and other nodes proxy the file from it (see holder_url).
+    """
+
+    def __init__(self, workers=ARCHIVE_WORKERS, sweep_interval=SWEEP_INTERVAL):
+        self.workers = workers
+        self.sweep_interval = sweep_interval
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.stopping = threading.Event()
+        self.on_archived = []  # Callables (call_log_id, absolute_path) run after a recording is stored
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            os.makedirs(RECORDING_ARCHIVE_DIR, exist_ok=True)
+            if RECORDING_ARCHIVE_FORMAT == "opus" and not _transcoding_enabled():
+                logger.warning("RECORDING_ARCHIVE_FORMAT is 'opus' but ffmpeg was not found; "
+                               "archiving recordings in their original format")
+
+            self.stopping.clear()
+            sweeper = threading.Thread(target=self._sweep_loop, name="recording-sweeper")
+            self.threads.append(sweeper)
+            for index in range(self.workers):
+                self.threads.append(threading.Thread(target=self._work, name=f"recording-archiver-{index}"))
+            for thread in self.threads:
+                thread.daemon = True
+                thread.start()
+        logger.info(f"Recording archiver started with {self.workers} workers")
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for thread in threads:
+            thread.join(timeout=1)
+
+    def enqueue(self, call_log_id):
+        """Queue a call whose recording should be archived"""
+        with self.lock:
+            if call_log_id in self.queued:
+                return
+            self.queued.add(call_log_id)
+        self.queue.put(call_log_id)
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                call_log_id = self.queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.archive(call_log_id)
+            except Exception as e:
+                logger.error(f"Error archiving recording for call {call_log_id}: {str(e)}")
+                logger.error(traceback.format_exc())
+            finally:
+                with self.lock:
+                    self.queued.discard(call_log_id)
+
+    def _sweep_loop(self):
+        while not self.stopping.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error in recording archive sweep: {str(e)}")
+                logger.error(traceback.format_exc())
+
+    def sweep(self):
+        """Queue ended calls whose recording is not archived or is due for a retry"""
+        now = datetime.now()
+        db_session = get_db_session_with_retry()
+        try:
+            call_log_ids = [row[0] for row in db_session.query(CallLog.id).outerjoin(
+                RecordingArchive, RecordingArchive.call_id == CallLog.id
+            ).filter(
+                CallLog.ultravox_id.isnot(None),
+                CallLog.end_time <= now - timedelta(seconds=ARCHIVE_DELAY),
+                CallLog.end_time >= now - timedelta(hours=LOOKBACK_HOURS),
+                or_(
+                    RecordingArchive.id.is_(None),
+                    and_(RecordingArchive.status == 'failed',
+                         RecordingArchive.attempts < MAX_ATTEMPTS,
+                         RecordingArchive.updated_at <= now - timedelta(seconds=RETRY_INTERVAL)),
+                    and_(RecordingArchive.status == 'pending',
+                         RecordingArchive.updated_at <= now - timedelta(seconds=CLAIM_TIMEOUT))
+                )
+            ).order_by(CallLog.end_time).limit(SWEEP_BATCH_SIZE).all()]
+        finally:
+            close_db_session(db_session)
+
+        for call_log_id in call_log_ids:
+            self.enqueue(call_log_id)
+        return len(call_log_ids)
+
+    def _claim(self, db_session, call_log_id):
+        """Mark the call's archive as pending for this worker. Returns the row, or None if not ours to do."""
+        now = datetime.now()
+        archive = db_session.query(RecordingArchive).filter_by(call_id=call_log_id).with_for_update().first()
+
+        if archive is None:
+            try:
+                with db_session.begin_nested():
+                    archive = RecordingArchive(call_id=call_log_id, status='pending', attempts=1)
+                    db_session.add(archive)
+            except IntegrityError:
+                return None  # Another node claimed it first
+            db_session.commit()
+            return archive
+
+        if archive.status == 'archived':
+            return None
+        if archive.status == 'pending' and archive.updated_at and \
+                archive.updated_at > now - timedelta(seconds=CLAIM_TIMEOUT):
+            return None
+        if archive.status == 'failed' and (archive.attempts or 0) >= MAX_ATTEMPTS:
+            return None
+
+        archive.status = 'pending'
+        archive.attempts = (archive.attempts or 0) + 1
+        archive.updated_at = now
+        db_session.commit()
+        return archive
+
+    def archive(self, call_log_id):
+        """
+        Archive one call's recording now. Returns the RecordingArchive status
+        ('archived', 'failed'), or None if there was nothing to do.
+        """
+        db_session = get_db_session_with_retry()
+        temp_paths = []
+        started = time.monotonic()
+        try:
+            call_log = db_session.query(CallLog).filter_by(id=call_log_id).first()
+            if not call_log or not call_log.ultravox_id:
+                return None
+
+            archive = self._claim(db_session, call_log_id)
+            if archive is None:
+                return None
+
+            os.makedirs(RECORDING_ARCHIVE_DIR, exist_ok=True)
+            download_path = os.path.join(RECORDING_ARCHIVE_DIR, f".{uuid.uuid4().hex}.part")
+            temp_paths.append(download_path)
+
+            try:
+                source_bytes = _download(call_log.ultravox_id, download_path)
+
+                stored_path, extension = download_path, "wav"
+                if _transcoding_enabled():
+                    opus_path = os.path.join(RECORDING_ARCHIVE_DIR, f".{uuid.uuid4().hex}.opus.part")
+                    temp_paths.append(opus_path)
+                    _transcode_opus(download_path, opus_path)
+                    stored_path, extension = opus_path, "opus"
+
+                content_hash, storage_path, size = _store(stored_path, extension)
+            except RecordingNotReady as e:
+                archive_failures.inc(label="not_ready")
+                return self._fail(db_session, archive, f"Recording not available: {str(e)}")
+            except subprocess.CalledProcessError as e:
+                archive_failures.inc(label="transcode")
+                stderr = e.stderr.decode('utf-8', 'replace')[-500:] if e.stderr else ""
+                return self._fail(db_session, archive, f"ffmpeg failed: {stderr}")
+            except Exception as e:
+                archive_failures.inc(label="error")
+                logger.error(traceback.format_exc())
+                return self._fail(db_session, archive, str(e))
+
+            archive.status = 'archived'
+            archive.content_hash = content_hash
+            archive.storage_path = storage_path
+            archive.format = extension
+            archive.size_bytes = size
+            archive.source_bytes = source_bytes
+            archive.error_message = None
+            archive.archived_at = datetime.now()
+            archive.node_url = NODE_INTERNAL_URL
+            call_log.recording_url = stable_url(call_log.ultravox_id)
+            db_session.commit()
+
+            archived_recordings.inc(label=extension)
+            archived_bytes.inc(size)
+            archive_duration.observe(time.monotonic() - started)
+            logger.info(f"Archived recording for call {call_log.call_uuid}: {source_bytes} bytes -> "
+                        f"{size} bytes {extension} ({content_hash[:12]})")
+
+            for callback in self.on_archived:
+                try:
+                    callback(call_log_id, archive_path(storage_path))
+                except Exception as e:
+                    logger.error(f"Error in archive callback for call {call_log_id}: {str(e)}")
+            return 'archived'
+        finally:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.remove(path)
+            close_db_session(db_session)
+
+    def _fail(self, db_session, archive, message):
+        logger.warning(f"Archiving recording for call {archive.call_id} failed "
+                       f"(attempt {archive.attempts}/{MAX_ATTEMPTS}): {message}")
+        archive.status = 'failed'
+        archive.error_message = message[:2000]
+        db_session.commit()
+        return 'failed'
+
+    def status(self):
+        with self.lock:
+            running = bool(self.threads)
+            queued = len(self.queued)
+        return {
+            "running": running,
+            "queued": queued,
+            "directory": RECORDING_ARCHIVE_DIR,
+            "format": "opus" if _transcoding_enabled() else "original"
+        }
+
+
+# Shared archiver, started by plivo_server
+recording_archiver = RecordingArchiver()
+
+
+def held_here(archive):
+    """True if this node can read the archive's file: shared storage, or archived by this node"""
+    return archive.node_url is None or archive.node_url == NODE_INTERNAL_URL
+
+
+def holder_url(archive, path):
+    """URL of `path` on the node holding an archive's file, or None if it is readable here"""
+    return None if held_here(archive) else archive.node_url + path
+
+
+def get_archived_recording(db_session, call_log_id):
+    """
+    (absolute path, RecordingArchive) of an archived recording, or (None, None).
+    A recording held by another node gives (None, RecordingArchive); fetch it
+    from holder_url().
+    """
+    archive = db_session.query(RecordingArchive).filter_by(call_id=call_log_id, status='archived').first()
+    if not archive or not archive.storage_path:
+        return None, None
+    path = archive_path(archive.storage_path)
+    if os.path.exists(path):
+        return path, archive
+    if not held_here(archive):
+        return None, archive
+
+    # Lost from the storage that holds it: let the next archive attempt download it again
+    logger.warning(f"Archived recording for call {call_log_id} is missing from {path}")
+    archive.status = 'failed'
+    archive.attempts = 0
+    archive.error_message = "Archived file missing"
+    db_session.commit()
+    return None, None
@@ -0,0 +1,245 @@
+import hashlib
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+import requests
+from config import setup_logging
+import metrics
+
+# Set up logging
+logger = setup_logging("recording_cache", "recording_cache.log")
+
+RECORDING_CACHE_DIR = os.getenv('RECORDING_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                    'recording_cache'))
+MAX_CACHE_BYTES = int(os.getenv('RECORDING_CACHE_MAX_BYTES', 2 * 1024 ** 3))  # Evict least recently played beyond this
+CHUNK_SIZE = 64 * 1024  # Bytes read from upstream / written to disk at a time
+FETCH_TIMEOUT = 10  # Connect/read timeout for upstream recording requests (seconds)
+CACHE_SUFFIX = ".audio"
+
+# Cache metrics
+lookups = metrics.counter("recordings.cache_lookups", "Recording cache lookups, by hit/miss")
+fetched_bytes = metrics.counter("recordings.upstream_bytes", "Recording bytes downloaded from upstream")
+cached_bytes = metrics.gauge("recordings.cache_bytes", "Bytes held in the on-disk recording cache")
+
+
+class UpstreamError(Exception):
+    """The signed recording URL could not be fetched"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def cache_key(call_id):
+    """
+    Cache key for a call's recording. Keyed by call ID, so the recording stays
+    cached when its signed URL is refreshed; proxy_audio only uses the key once
+    the requested URL is the one recorded for that call.
+    """
+    return "call-" + hashlib.sha256(str(call_id).encode("utf-8")).hexdigest()[:40]
+
+
+def content_type(path):
+    """Audio MIME type of a cached recording, from its leading bytes"""
+    with open(path, 'rb') as file:
+        head = file.read(12)
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[:4] == b"OggS":
+        return "audio/ogg"
+    if head[:3] == b"ID3" or head[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    return "application/octet-stream"
+
+
+def open_upstream(url, range_header=None):
+    """Streaming GET of a recording; raises UpstreamError for a non-2xx response"""
+    headers = {'Range': range_header} if range_header else {}
+    response = requests.get(url, headers=headers, stream=True, timeout=FETCH_TIMEOUT, allow_redirects=True)
+    if not response.ok:
+        response.close()
+        raise UpstreamError(response.status_code, f"{response.status_code} - {response.reason}")
+    return response
+
+
+class RecordingCache:
+    """
+    On-disk LRU cache of call recordings.
+
+    Files are written to a temporary name and renamed into place once complete,
+    so a cached file is always whole. Recency is tracked in memory (seeded from
+    file mtimes at startup) and the least recently used files are removed once
+    the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory=RECORDING_CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.fetch_locks = {}  # key -> [lock, threads using it], removed when the last one is done
+        self.loaded = False
+
+    def _load(self):
+        """Index files left by a previous run, oldest first"""
+        with self.lock:
+            if self.loaded:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            files = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith(".part"):
+                    os.remove(path)  # Interrupted download
+                elif name.endswith(CACHE_SUFFIX):
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, name[:-len(CACHE_SUFFIX)], stat.st_size))
+            for _, key, size in sorted(files):
+                self.entries[key] = size
+                self.total_bytes += size
+            self.loaded = True
+            cached_bytes.set(self.total_bytes)
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """Path of a cached recording (marking it recently used), or None"""
+        self._load()
+        with self.lock:
+            hit = key in self.entries
+            if hit:
+                self.entries.move_to_end(key)
+        lookups.inc(label="hit" if hit else "miss")
+        if not hit:
+            return None
+
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # Keep recency across restarts
+        except FileNotFoundError:
+            with self.lock:
+                self.total_bytes -= self.entries.pop(key, 0)
+            return None
+        return path
+
+    @contextmanager
+    def _fetch_lock(self, key):
+        """Serialize fetches of one recording; the lock is dropped once no fetch of it is left"""
+        with self.lock:
+            entry = self.fetch_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.fetch_locks[key]
+
+    def _temp_path(self, key):
+        return os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.part")
+
+    def _commit(self, key, temp_path):
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, self.path_for(key))
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+        self._evict()
+
+    def _evict(self):
+        removed = []
+        with self.lock:
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                key, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                removed.append(key)
+            cached_bytes.set(self.total_bytes)
+
+        for key in removed:
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+        if removed:
+            logger.info(f"Evicted {len(removed)} recordings from the cache")
+
+    def fetch(self, key, url):
+        """Download a recording into the cache, unless already there. Returns its path."""
+        self._load()
+        with self._fetch_lock(key):
+            path = self.get(key)
+            if path:
+                return path
+
+            temp_path = self._temp_path(key)
+            started = time.monotonic()
+            try:
+                with open_upstream(url) as response, open(temp_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        file.write(chunk)
+                        fetched_bytes.inc(len(chunk))
+                self._commit(key, temp_path)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+            logger.info(f"Cached recording {key} in {time.monotonic() - started:.2f}s")
+            return self.path_for(key)
+
+    def fetch_async(self, key, url):
+        """Fill the cache in the background, e.g. while a seek is served from upstream"""
+        def run():
+            try:
+                self.fetch(key, url)
+            except Exception as e:
+                logger.error(f"Error caching recording {key}: {str(e)}")
+
+        thread = threading.Thread(target=run, name=f"recording-fetch-{key}")
+        thread.daemon = True
+        thread.start()
+
+    def stream_and_cache(self, key, response):
+        """
+        Yield an upstream response chunk by chunk while writing it to the cache.
+        The file is only added if the whole recording was read; if the client
+        goes away first, the partial file is dropped.
+        """
+        self._load()
+        temp_path = self._temp_path(key)
+        complete = False
+        try:
+            with open(temp_path, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    file.write(chunk)
+                    fetched_bytes.inc(len(chunk))
+                    yield chunk
+            complete = True
+        finally:
+            response.close()
+            if complete:
+                try:
+                    self._commit(key, temp_path)
+                except Exception as e:
+                    logger.error(f"Error caching recording {key}: {str(e)}")
+                    logger.error(traceback.format_exc())
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def status(self):
+        self._load()
+        with self.lock:
+            return {"directory": self.directory, "recordings": len(self.entries),
+                    "bytes": self.total_bytes, "max_bytes": self.max_bytes}
+
+
+# Shared cache used by proxy_audio
+recording_cache = RecordingCache()
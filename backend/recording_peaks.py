@@ -0,0 +1,151 @@
+import os
+import shutil
+import struct
+import subprocess
+import time
+import uuid
+import wave
+import numpy as np
+from config import setup_logging
+from recording_cache import content_type
+import metrics
+
+# Set up logging
+logger = setup_logging("recording_peaks", "recording_peaks.log")
+
+PEAK_BINS = 1600  # min/max pairs per recording; the player resamples them to its canvas width
+PEAKS_SUFFIX = ".peaks"  # Peaks file stored next to the archived recording
+DECODE_SAMPLE_RATE = 8000  # Rate ffmpeg decodes non-WAV recordings at; plenty for a waveform outline
+DECODE_TIMEOUT = 120  # Upper bound for one ffmpeg decode (seconds)
+
+# Binary format, little endian: magic, sample rate (uint32), bins (uint32), duration in seconds
+# (float32), then `bins` interleaved (min, max) int8 pairs scaled to [-127, 127]
+PEAKS_MAGIC = b"WPK1"
+HEADER = struct.Struct("<4sIIf")
+
+peaks_generated = metrics.counter("recordings.peaks_generated", "Waveform peak files generated")
+peaks_duration = metrics.histogram("recordings.peaks_seconds", "Time to decode a recording and compute its peaks")
+
+
+def peaks_path(audio_path):
+    return audio_path + PEAKS_SUFFIX
+
+
+def _read_wav(path):
+    """(interleaved integer samples, full-scale value, sample rate, duration) of a PCM WAV file"""
+    with wave.open(path, 'rb') as recording:
+        channels = recording.getnchannels()
+        width = recording.getsampwidth()
+        rate = recording.getframerate()
+        frames = recording.readframes(recording.getnframes())
+
+    if width == 1:
+        samples = np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128  # 8-bit WAV is unsigned
+    elif width in (2, 4):
+        samples = np.frombuffer(frames, dtype=f"<i{width}")
+    else:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+
+    duration = len(samples) / channels / rate if rate else 0.0
+    return samples, float(2 ** (8 * width - 1)), rate, duration
+
+
+def _decode_ffmpeg(path):
+    """Decode any format ffmpeg understands (e.g. Opus archives) to 16-bit mono"""
+    if shutil.which("ffmpeg") is None:
+        raise ValueError(f"Cannot decode {content_type(path)} recordings without ffmpeg")
+    result = subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", path,
+         "-f", "s16le", "-ac", "1", "-ar", str(DECODE_SAMPLE_RATE), "-"],
+        check=True, timeout=DECODE_TIMEOUT, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    samples = np.frombuffer(result.stdout, dtype="<i2")
+    return samples, 32768.0, DECODE_SAMPLE_RATE, len(samples) / DECODE_SAMPLE_RATE
+
+
+def _read_samples(path):
+    if content_type(path) == "audio/wav":
+        try:
+            return _read_wav(path)
+        except (wave.Error, ValueError) as e:
+            # e.g. float or compressed WAV
+            logger.info(f"Falling back to ffmpeg for {path}: {str(e)}")
+    return _decode_ffmpeg(path)
+
+
+def compute_peaks(samples, full_scale, bins=PEAK_BINS):
+    """
+    Downsample samples to `bins` (min, max) pairs, interleaved, as int8.
+    Multi-channel audio can be passed interleaved: every bin spans whole frames
+    closely enough for a waveform outline.
+    """
+    count = len(samples)
+    bins = min(bins, count)
+    if bins == 0:
+        return np.zeros(0, dtype=np.int8)
+
+    starts = np.arange(bins, dtype=np.int64) * count // bins
+    scale = 127.0 / full_scale
+    peaks = np.empty(bins * 2, dtype=np.int8)
+    peaks[0::2] = np.clip(np.round(np.minimum.reduceat(samples, starts) * scale), -127, 127)
+    peaks[1::2] = np.clip(np.round(np.maximum.reduceat(samples, starts) * scale), -127, 127)
+    return peaks
+
+
+def generate_peaks(audio_path, bins=PEAK_BINS):
+    """Compute and store the peaks file for a recording. Returns its path."""
+    started = time.monotonic()
+    samples, full_scale, rate, duration = _read_samples(audio_path)
+    peaks = compute_peaks(samples, full_scale, bins)
+
+    target = peaks_path(audio_path)
+    temp_path = f"{target}.{uuid.uuid4().hex}.part"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(HEADER.pack(PEAKS_MAGIC, rate, len(peaks) // 2, duration))
+            file.write(peaks.tobytes())
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    peaks_generated.inc()
+    peaks_duration.observe(time.monotonic() - started)
+    logger.info(f"Generated {len(peaks) // 2} peaks for {os.path.basename(audio_path)} "
+                f"({duration:.1f}s) in {time.monotonic() - started:.2f}s")
+    return target
+
+
+def ensure_peaks(audio_path):
+    """Path of the recording's peaks file, generating it if missing or in an older format"""
+    target = peaks_path(audio_path)
+    try:
+        with open(target, 'rb') as file:
+            if file.read(len(PEAKS_MAGIC)) == PEAKS_MAGIC:
+                return target
+    except FileNotFoundError:
+        pass
+    return generate_peaks(audio_path)
+
+
+def read_peaks(path):
+    """Peaks file contents as a JSON-serializable dict"""
+    with open(path, 'rb') as file:
+        data = file.read()
+    _, rate, bins, duration = HEADER.unpack_from(data)
+    peaks = np.frombuffer(data, dtype=np.int8, offset=HEADER.size, count=bins * 2)
+    return {
+        "sample_rate": rate,
+        "duration": round(float(duration), 3),
+        "bins": bins,
+        "bits": 8,
+        "peaks": peaks.tolist()
+    }
+
+
+def on_recording_archived(call_log_id, audio_path):
+    """RecordingArchiver callback: precompute peaks so the player never waits on a decode"""
+    try:
+        generate_peaks(audio_path)
+    except Exception as e:
+        logger.error(f"Error generating peaks for call {call_log_id}: {str(e)}")
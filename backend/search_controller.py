@@ -0,0 +1,69 @@
+import traceback
+from flask import Blueprint, request, jsonify
+from database import close_db_session, get_db_session_with_retry
+from transcript_search import search_transcripts, search_backend, ROLES, MAX_RESULTS
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("search_controller", "search_controller.log")
+
+# Create a Blueprint for search API routes
+search = Blueprint('search', __name__)
+
+
+@search.route('/search/transcripts', methods=['GET'])
+def search_call_transcripts():
+    """
+    Find calls by what was said.
+
+    Query parameters:
+        q: words that must all appear in a message
+        phrase: 'true' to match q as an exact phrase
+        role: only messages spoken by 'agent' or 'user'
+        campaign_id: only calls from this campaign
+        limit, offset: paging (limit at most MAX_RESULTS)
+    """
+    db_session = None
+    try:
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({
+                "status": "error",
+                "message": "q is required"
+            }), 400
+
+        role = request.args.get('role')
+        if role and role not in ROLES:
+            return jsonify({
+                "status": "error",
+                "message": f"role must be one of: {', '.join(ROLES)}"
+            }), 400
+
+        phrase = request.args.get('phrase', 'false').lower() in ['true', '1', 'yes', 't']
+        campaign_id = request.args.get('campaign_id', type=int)
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_RESULTS)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+
+        db_session = get_db_session_with_retry()
+        results, has_more = search_transcripts(db_session, query, phrase=phrase, role=role,
+                                               campaign_id=campaign_id, limit=limit, offset=offset)
+
+        return jsonify({
+            "status": "success",
+            "query": query,
+            "backend": search_backend(),
+            "results": results,
+            "limit": limit,
+            "offset": offset,
+            "has_more": has_more
+        })
+    except Exception as e:
+        logger.error(f"Error in search_call_transcripts: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        if db_session:
+            close_db_session(db_session)
@@ -0,0 +1,54 @@
+"""status_for (Python) and status_case (SQL) must map every call to the same contact status"""
+import itertools
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, insert, select
+from call_status_rules import CALL_STATE_RULES, HANGUP_CAUSE_RULES, status_case, status_for
+
+UNKNOWN_CAUSE = "SOMETHING_NEW"
+
+
+def _variants(values):
+    """Each value as written, in other cases and with trailing padding (as a CHAR column returns it)"""
+    for value in values:
+        yield value
+        yield value.lower()
+        yield value.upper()
+        yield value + "   "
+    yield None
+    yield ""
+
+
+def test_status_for_and_status_case_agree():
+    call_states = list(dict.fromkeys(_variants(list(CALL_STATE_RULES) + [UNKNOWN_CAUSE])))
+    hangup_causes = list(dict.fromkeys(_variants(list(HANGUP_CAUSE_RULES) + [UNKNOWN_CAUSE])))
+    pairs = list(itertools.product(call_states, hangup_causes))
+
+    engine = create_engine("sqlite://")
+    calls = Table("calls", MetaData(), Column("id", Integer, primary_key=True),
+                  Column("call_state", String(50)), Column("hangup_cause", String(50)))
+    calls.create(engine)
+
+    with engine.begin() as connection:
+        connection.execute(insert(calls), [
+            {"id": index, "call_state": call_state, "hangup_cause": hangup_cause}
+            for index, (call_state, hangup_cause) in enumerate(pairs)
+        ])
+        rows = connection.execute(
+            select(calls.c.id, status_case(calls.c.call_state, calls.c.hangup_cause))
+        ).all()
+
+    sql_statuses = dict(rows)
+    mismatches = [
+        (call_state, hangup_cause, status_for(call_state, hangup_cause), sql_statuses[index])
+        for index, (call_state, hangup_cause) in enumerate(pairs)
+        if status_for(call_state, hangup_cause) != sql_statuses[index]
+    ]
+    assert not mismatches
+
+
+def test_status_for_examples():
+    assert status_for("ANSWER", None) == "completed"
+    assert status_for("busy", "USER_BUSY") == "no-answer"
+    assert status_for("in-progress ", "normal_clearing") == "completed"
+    assert status_for(None, UNKNOWN_CAUSE) == "failed"
+    assert status_for(None, None) is None
+    assert status_for("ringing", "") is None
@@ -0,0 +1,157 @@
+import json
+import re
+import metrics
+
+# Rule-based labels for calls that do not need an LLM analysis. Anything the
+# rules do not recognize is left for the extraction service.
+
+MIN_USER_TURNS = 2  # Calls with fewer customer turns than this are too short to analyse
+MAX_SHORT_CALL_CHARS = 120  # ...unless the customer said more than this in total
+WRONG_NUMBER_MAX_USER_TURNS = 4  # Wrong-number phrases only label calls with fewer customer turns than this
+
+# Plivo hangup causes (codes or display names, normalized) meaning nobody picked up
+NO_CONVERSATION_CAUSES = {
+    "NO_ANSWER", "NO_USER_RESPONSE", "USER_BUSY", "BUSY_LINE", "CALL_REJECTED", "REJECTED",
+    "UNALLOCATED_NUMBER", "INVALID_NUMBER", "ORIGINATOR_CANCEL", "CANCELED", "RING_TIMEOUT"
+}
+MACHINE_CAUSES = {"MACHINE_DETECTED", "VOICEMAIL", "ANSWERING_MACHINE"}
+
+VOICEMAIL_PATTERNS = [
+    r"leave (a|your) (brief )?message",
+    r"after the (tone|beep)",
+    r"voice ?mail",
+    r"mailbox",
+    r"not available (right now|at the moment|to take your call)",
+    r"(is|are) unable to (take|answer) (your|the) call",
+    r"record your message",
+]
+
+NETWORK_MESSAGE_PATTERNS = [
+    r"the (number|subscriber) you (have )?(dialed|dialled|called|are calling)",
+    r"(switched|switch) off",
+    r"out of (coverage|network|service) area",
+    r"not reachable",
+    r"does not exist",
+    r"please (check the number|try again later)",
+    r"कृपया (बाद में|थोड़ी देर बाद)",
+    r"उपलब्ध नहीं है",
+    r"(पहुँच से बाहर|पहुंच से बाहर|व्यस्त) (है|हैं)",
+    r"स्विच ऑफ",
+    r"abhi (vyast|uplabdh nahi)",
+]
+
+WRONG_NUMBER_PATTERNS = [
+    r"wrong number",
+    r"galat number",
+    r"गलत नंबर",
+    r"(i|we) (did not|didn't|never) (make|fill|submit|send) (any|an|the|this) (inquiry|enquiry|request|form)",
+    r"(no|not) (one|body) (by|with) that name",
+    r"you have the wrong (person|number)",
+]
+
+_VOICEMAIL = [re.compile(pattern, re.IGNORECASE) for pattern in VOICEMAIL_PATTERNS]
+_NETWORK_MESSAGE = [re.compile(pattern, re.IGNORECASE) for pattern in NETWORK_MESSAGE_PATTERNS]
+_WRONG_NUMBER = [re.compile(pattern, re.IGNORECASE) for pattern in WRONG_NUMBER_PATTERNS]
+
+FOLLOW_UP = {
+    "no_conversation": ["Retry the call later"],
+    "voicemail": ["Retry the call later"],
+    "network_message": ["Verify the number and retry later"],
+    "wrong_number": ["Correct or remove the contact number"],
+    "too_short": ["Retry the call later"],
+}
+
+classified_calls = metrics.counter("analysis.rule_classified_calls", "Calls labelled by the local classifier, by label")
+llm_calls = metrics.counter("analysis.llm_routed_calls", "Calls passed on to the LLM by the local classifier")
+
+
+def _normalize_cause(hangup_cause):
+    return re.sub(r"[\s-]+", "_", hangup_cause.strip()).upper() if hangup_cause else ""
+
+
+def _messages(transcription):
+    if not transcription:
+        return []
+    if isinstance(transcription, str):
+        try:
+            transcription = json.loads(transcription)
+        except json.JSONDecodeError:
+            return []
+    messages = transcription.get("results", []) if isinstance(transcription, dict) else []
+    return [msg for msg in messages if isinstance(msg, dict) and (msg.get("text") or "").strip()]
+
+
+def _is_user(msg):
+    return msg.get("role") not in ["MESSAGE_ROLE_AGENT", "assistant"]
+
+
+def _matches(patterns, text):
+    return any(pattern.search(text) for pattern in patterns)
+
+
+def classify(transcription, hangup_cause=None):
+    """
+    Label a trivial call from its transcript and Plivo hangup cause. Returns one
+    of the FOLLOW_UP labels, or None for a conversation that needs the LLM.
+    """
+    cause = _normalize_cause(hangup_cause)
+    if not transcription and cause not in NO_CONVERSATION_CAUSES | MACHINE_CAUSES:
+        return None  # Transcript not fetched yet
+
+    messages = _messages(transcription)
+    user_messages = [msg for msg in messages if _is_user(msg)]
+    user_text = " ".join(msg["text"] for msg in user_messages)
+
+    if cause in MACHINE_CAUSES:
+        return "voicemail"
+    if not user_messages:
+        # Nobody spoke back: a voicemail greeting can still show up as agent-side audio
+        all_text = " ".join(msg["text"] for msg in messages)
+        if _matches(_VOICEMAIL, all_text):
+            return "voicemail"
+        if _matches(_NETWORK_MESSAGE, all_text):
+            return "network_message"
+        return "no_conversation"
+
+    if len(user_messages) < WRONG_NUMBER_MAX_USER_TURNS and _matches(_WRONG_NUMBER, user_text):
+        # Only a short call; in a real conversation the phrase may be incidental
+        return "wrong_number"
+    if len(user_messages) < MIN_USER_TURNS:
+        if _matches(_VOICEMAIL, user_text):
+            return "voicemail"
+        if _matches(_NETWORK_MESSAGE, user_text):
+            return "network_message"
+        if len(user_text) <= MAX_SHORT_CALL_CHARS:
+            return "too_short"
+
+    return None
+
+
+def entities_for(label):
+    """entities_extracted JSON for a rule-labelled call, in the LLM's schema"""
+    return json.dumps({
+        "customer_name": None,
+        "contact_details": None,
+        "topics": [],
+        "products_mentioned": [],
+        "customer_needs": [],
+        "sentiment": None,
+        "financial_figures": None,
+        "follow_up_actions": FOLLOW_UP[label],
+        "call_classification": label,
+        "classified_by": "rules"
+    })
+
+
+def classify_call(call_log):
+    """
+    Run the fast path for a CallLog. Returns entities_extracted JSON for a
+    trivial call, or None if the call should go to the LLM.
+    """
+    label = classify(call_log.transcription, call_log.hangup_cause)
+    if label is None:
+        llm_calls.inc()
+        return None
+
+    classified_calls.inc(label=label)
+    return entities_for(label)
@@ -0,0 +1,313 @@
+import json
+import time
+import numpy as np
+from datetime import datetime
+from models import CallLog, CallAnalytics
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging
+
+# Set up logging
+logger = setup_logging("transcript_metrics", "transcript_metrics.log")
+
+AGENT_ROLES = ("MESSAGE_ROLE_AGENT", "assistant")
+USER_ROLES = ("MESSAGE_ROLE_USER", "user")
+ROLE_AGENT, ROLE_USER, ROLE_OTHER = 0, 1, 2
+LONG_SILENCE_SECONDS = 3.0  # Gaps between messages at least this long count as long silences
+LENGTH_HISTOGRAM_BINS = (0, 20, 50, 100, 200, 400, 800)  # Response length buckets in characters
+LOAD_BATCH_SIZE = 1000  # Transcripts fetched per round trip
+WRITE_BATCH_SIZE = 1000  # CallAnalytics rows written per bulk statement
+
+
+def _role_code(role):
+    if role in AGENT_ROLES:
+        return ROLE_AGENT
+    if role in USER_ROLES:
+        return ROLE_USER
+    return ROLE_OTHER
+
+
+def _seconds(value):
+    """Parse an Ultravox duration ('1.250s') or number to seconds; NaN if absent"""
+    if value is None:
+        return np.nan
+    try:
+        return float(str(value).rstrip('s'))
+    except ValueError:
+        return np.nan
+
+
+def _messages(transcription):
+    """Messages from a stored transcription (JSON string or already parsed)"""
+    if not transcription:
+        return []
+    if isinstance(transcription, str):
+        try:
+            transcription = json.loads(transcription)
+        except json.JSONDecodeError:
+            return []
+    if isinstance(transcription, dict):
+        return transcription.get("results", []) or []
+    return transcription if isinstance(transcription, list) else []
+
+
+class TranscriptColumns:
+    """Messages of many calls flattened into parallel arrays, one entry per message"""
+
+    def __init__(self, call_ids, transcripts):
+        self.call_ids = np.asarray(call_ids, dtype=np.int64)
+
+        call_index, roles, lengths, starts, ends = [], [], [], [], []
+        for index, transcription in enumerate(transcripts):
+            for message in _messages(transcription):
+                timespan = message.get("timespan") or {}
+                call_index.append(index)
+                roles.append(_role_code(message.get("role")))
+                lengths.append(len(message.get("text") or ""))
+                starts.append(_seconds(timespan.get("start")))
+                ends.append(_seconds(timespan.get("end")))
+
+        self.call_index = np.asarray(call_index, dtype=np.int64)
+        self.role = np.asarray(roles, dtype=np.int8)
+        self.length = np.asarray(lengths, dtype=np.int64)
+        self.start = np.asarray(starts, dtype=np.float64)
+        self.end = np.asarray(ends, dtype=np.float64)
+
+    @property
+    def num_calls(self):
+        return len(self.call_ids)
+
+
+def _per_call_sum(columns, values, mask=None):
+    weights = values if mask is None else np.where(mask, values, 0)
+    return np.bincount(columns.call_index, weights=weights, minlength=columns.num_calls)
+
+
+def _safe_divide(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), 0.0)
+
+
+def compute_call_metrics(columns):
+    """
+    Per-call metrics for every call in `columns`, computed over whole arrays at once.
+    Returns a dict of arrays aligned with columns.call_ids.
+    """
+    n = columns.num_calls
+    is_agent = columns.role == ROLE_AGENT
+    is_user = columns.role == ROLE_USER
+    has_text = columns.length > 0
+    ones = np.ones(len(columns.role))
+
+    total_messages = _per_call_sum(columns, ones)
+    agent_messages = _per_call_sum(columns, ones, is_agent)
+    user_messages = _per_call_sum(columns, ones, is_user)
+
+    agent_chars = _per_call_sum(columns, columns.length, is_agent)
+    user_chars = _per_call_sum(columns, columns.length, is_user)
+    agent_text_messages = _per_call_sum(columns, ones, is_agent & has_text)
+    user_text_messages = _per_call_sum(columns, ones, is_user & has_text)
+
+    max_agent_length = np.zeros(n)
+    max_user_length = np.zeros(n)
+    np.maximum.at(max_agent_length, columns.call_index[is_agent], columns.length[is_agent])
+    np.maximum.at(max_user_length, columns.call_index[is_user], columns.length[is_user])
+
+    # Turns: a new turn starts whenever the speaker changes within a call
+    speaking = columns.role != ROLE_OTHER
+    call_index = columns.call_index[speaking]
+    role = columns.role[speaking]
+    new_turn = np.ones(len(role), dtype=bool)
+    if len(role) > 1:
+        new_turn[1:] = (role[1:] != role[:-1]) | (call_index[1:] != call_index[:-1])
+    turns = np.bincount(call_index[new_turn], minlength=n)
+
+    # Talk time from message timespans, falling back to characters when calls lack timing
+    spoken = np.clip(np.nan_to_num(columns.end - columns.start, nan=0.0), 0, None)
+    agent_talk = _per_call_sum(columns, spoken, is_agent)
+    user_talk = _per_call_sum(columns, spoken, is_user)
+    timed = (agent_talk + user_talk) > 0
+    talk_ratio = np.where(
+        timed,
+        _safe_divide(agent_talk, agent_talk + user_talk),
+        _safe_divide(agent_chars, agent_chars + user_chars)
+    )
+
+    # Silence gaps between consecutive timed messages of the same call
+    max_gap = np.zeros(n)
+    total_gap = np.zeros(n)
+    gap_count = np.zeros(n)
+    long_silences = np.zeros(n)
+    has_time = ~np.isnan(columns.start) & ~np.isnan(columns.end)
+    if has_time.any():
+        t_call = columns.call_index[has_time]
+        t_start = columns.start[has_time]
+        t_end = columns.end[has_time]
+        order = np.lexsort((t_start, t_call))
+        t_call, t_start, t_end = t_call[order], t_start[order], t_end[order]
+
+        same_call = t_call[1:] == t_call[:-1]
+        gaps = np.clip(t_start[1:] - t_end[:-1], 0, None)[same_call]
+        gap_calls = t_call[1:][same_call]
+
+        np.maximum.at(max_gap, gap_calls, gaps)
+        total_gap = np.bincount(gap_calls, weights=gaps, minlength=n)
+        gap_count = np.bincount(gap_calls, minlength=n).astype(np.float64)
+        long_silences = np.bincount(gap_calls, weights=(gaps >= LONG_SILENCE_SECONDS).astype(np.float64), minlength=n)
+
+    return {
+        "total_messages": total_messages.astype(np.int64),
+        "agent_messages": agent_messages.astype(np.int64),
+        "user_messages": user_messages.astype(np.int64),
+        "avg_agent_response_length": (agent_chars // np.maximum(agent_text_messages, 1)).astype(np.int64),
+        "avg_user_response_length": (user_chars // np.maximum(user_text_messages, 1)).astype(np.int64),
+        "max_agent_response_length": max_agent_length.astype(np.int64),
+        "max_user_response_length": max_user_length.astype(np.int64),
+        "turns": turns.astype(np.int64),
+        "agent_talk_seconds": agent_talk,
+        "user_talk_seconds": user_talk,
+        "talk_ratio": talk_ratio,
+        "max_silence_seconds": max_gap,
+        "avg_silence_seconds": _safe_divide(total_gap, gap_count),
+        "long_silences": long_silences.astype(np.int64)
+    }
+
+
+def _distribution(values):
+    if len(values) == 0:
+        return None
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(p50), 3),
+        "p90": round(float(p90), 3),
+        "p99": round(float(p99), 3),
+        "max": round(float(values.max()), 3)
+    }
+
+
+def compute_aggregate_metrics(columns, call_metrics):
+    """Campaign-wide distributions over the per-call metrics and all responses"""
+    with_messages = call_metrics["total_messages"] > 0
+    aggregate = {
+        "calls": int(columns.num_calls),
+        "calls_with_transcript": int(with_messages.sum()),
+        "messages": int(call_metrics["total_messages"].sum())
+    }
+
+    for name in ("turns", "talk_ratio", "max_silence_seconds", "avg_silence_seconds", "total_messages"):
+        aggregate[name] = _distribution(call_metrics[name][with_messages])
+
+    bins = np.asarray(LENGTH_HISTOGRAM_BINS + (np.iinfo(np.int64).max,))
+    for label, role in (("agent", ROLE_AGENT), ("user", ROLE_USER)):
+        lengths = columns.length[(columns.role == role) & (columns.length > 0)]
+        counts, _ = np.histogram(lengths, bins=bins)
+        aggregate[f"{label}_response_length"] = _distribution(lengths)
+        aggregate[f"{label}_response_length_histogram"] = {
+            f"{low}+" if i == len(LENGTH_HISTOGRAM_BINS) - 1 else f"{low}-{LENGTH_HISTOGRAM_BINS[i + 1] - 1}": int(count)
+            for i, (low, count) in enumerate(zip(LENGTH_HISTOGRAM_BINS, counts))
+        }
+
+    return aggregate
+
+
+def _row_metrics(call_metrics, i):
+    """Per-call metrics of row i as plain Python values"""
+    return {name: (round(float(values[i]), 3) if values.dtype.kind == 'f' else int(values[i]))
+            for name, values in call_metrics.items()}
+
+
+def metrics_for_transcript(transcription):
+    """Metrics for a single call's stored transcription"""
+    columns = TranscriptColumns([0], [transcription])
+    return _row_metrics(compute_call_metrics(columns), 0)
+
+
+def _load_campaign_transcripts(db_session, campaign_id):
+    rows = db_session.query(
+        CallLog.id, CallLog.transcription, CallLog.call_duration, CallLog.call_state
+    ).filter(
+        CallLog.campaign_id == campaign_id,
+        CallLog.transcription.isnot(None)
+    ).yield_per(LOAD_BATCH_SIZE)
+
+    call_ids, transcripts, call_info = [], [], {}
+    for call_id, transcription, call_duration, call_state in rows:
+        call_ids.append(call_id)
+        transcripts.append(transcription)
+        call_info[call_id] = (call_duration, call_state)
+    return call_ids, transcripts, call_info
+
+
+def _write_call_analytics(db_session, call_ids, call_metrics, call_info):
+    """Insert or update CallAnalytics for every call with bulk statements"""
+    existing = {}
+    for start in range(0, len(call_ids), WRITE_BATCH_SIZE):
+        chunk = [int(call_id) for call_id in call_ids[start:start + WRITE_BATCH_SIZE]]
+        existing.update(db_session.query(CallAnalytics.call_id, CallAnalytics.id).filter(
+            CallAnalytics.call_id.in_(chunk)).all())
+
+    now = datetime.now()
+    updates, inserts = [], []
+    for i, call_id in enumerate(call_ids):
+        row = _row_metrics(call_metrics, i)
+        values = {
+            "total_messages": row["total_messages"],
+            "agent_messages": row["agent_messages"],
+            "user_messages": row["user_messages"],
+            "avg_agent_response_length": row["avg_agent_response_length"],
+            "avg_user_response_length": row["avg_user_response_length"],
+            "transcript_metrics": json.dumps(row),
+            "analyzed_at": now
+        }
+        if call_id in existing:
+            updates.append(dict(values, id=existing[call_id]))
+        else:
+            call_duration, call_state = call_info[call_id]
+            inserts.append(dict(values, call_id=int(call_id), total_duration=call_duration,
+                                call_success=call_state == 'ANSWER'))
+
+    for start in range(0, len(updates), WRITE_BATCH_SIZE):
+        db_session.bulk_update_mappings(CallAnalytics, updates[start:start + WRITE_BATCH_SIZE])
+    for start in range(0, len(inserts), WRITE_BATCH_SIZE):
+        db_session.bulk_insert_mappings(CallAnalytics, inserts[start:start + WRITE_BATCH_SIZE])
+    db_session.commit()
+
+    return len(updates), len(inserts)
+
+
+def compute_campaign_metrics(campaign_id, write=True):
+    """
+    Compute transcript metrics for every transcribed call of a campaign and,
+    when `write` is set, store the per-call results in CallAnalytics.
+    Returns the campaign-wide aggregate.
+    """
+    started = time.monotonic()
+    db_session = get_db_session_with_retry()
+    try:
+        call_ids, transcripts, call_info = _load_campaign_transcripts(db_session, campaign_id)
+        loaded = time.monotonic()
+
+        columns = TranscriptColumns(call_ids, transcripts)
+        call_metrics = compute_call_metrics(columns)
+        aggregate = compute_aggregate_metrics(columns, call_metrics)
+        computed = time.monotonic()
+
+        updated = inserted = 0
+        if write and call_ids:
+            updated, inserted = _write_call_analytics(db_session, call_ids, call_metrics, call_info)
+
+        aggregate["timing"] = {
+            "load_seconds": round(loaded - started, 3),
+            "compute_seconds": round(computed - loaded, 3),
+            "write_seconds": round(time.monotonic() - computed, 3)
+        }
+        aggregate["written"] = {"updated": updated, "inserted": inserted}
+
+        logger.info(f"Transcript metrics for campaign {campaign_id}: {len(call_ids)} calls, "
+                    f"{aggregate['messages']} messages, timing {aggregate['timing']}")
+        return aggregate
+    except Exception:
+        db_session.rollback()
+        raise
+    finally:
+        close_db_session(db_session)
@@ -0,0 +1,332 @@
+import html
+import json
+import threading
+import time
+import traceback
+from datetime import datetime
+from sqlalchemy import text
+from models import CallLog, TranscriptMessage
+from database import engine, close_db_session, get_db_session_with_retry
+from data_archiver import load_call_logs
+from config import setup_logging
+import metrics
+
+# Set up logging
+logger = setup_logging("transcript_search", "transcript_search.log")
+
+MAX_RESULTS = 100  # Upper bound for one page of search results
+SNIPPET_WORDS = 12  # Words of context around a match in a snippet
+BACKFILL_BATCH_SIZE = 200  # Calls indexed per backfill transaction
+BACKFILL_PAUSE = 0.5  # Pause between backfill batches, leaving the database to live traffic (seconds)
+
+FTS_TABLE = "transcript_messages_fts"  # SQLite FTS5 table (external content over transcript_messages)
+FULLTEXT_CATALOG = "transcript_catalog"  # SQL Server full-text catalog
+FULLTEXT_KEY_INDEX = "ux_transcript_messages_id"  # Unique single-column index SQL Server full-text requires
+
+# Markers placed around matches before the snippet is HTML-escaped, then swapped for <mark>
+_MATCH_START, _MATCH_END = "\x02", "\x03"
+
+ROLES = ("agent", "user")
+
+# Search metrics
+searches = metrics.counter("search.transcript_queries", "Transcript searches, by index backend")
+search_latency = metrics.histogram("search.transcript_query_seconds", "Time to run a transcript search")
+indexed_calls = metrics.counter("search.indexed_calls", "Call transcripts split into the search index")
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def transcript_messages(transcription):
+    """(position, role, text) for each non-empty message of a stored transcription"""
+    if not transcription:
+        return []
+    try:
+        data = json.loads(transcription) if isinstance(transcription, str) else transcription
+    except json.JSONDecodeError:
+        return []
+
+    messages = data.get("results", []) if isinstance(data, dict) else []
+    result = []
+    for position, msg in enumerate(messages):
+        if not isinstance(msg, dict) or not (msg.get("text") or "").strip():
+            continue
+        role = "agent" if msg.get("role") in ["MESSAGE_ROLE_AGENT", "assistant"] else "user"
+        result.append((position, role, msg["text"].strip()))
+    return result
+
+
+def index_transcript(db_session, call_log):
+    """
+    (Re)build a call's rows in transcript_messages from its transcription. The
+    full-text index follows the table (FTS5 triggers / SQL Server change
+    tracking). The caller commits.
+    """
+    if call_log.id is None:
+        db_session.flush()
+
+    db_session.query(TranscriptMessage).filter_by(call_id=call_log.id).delete(synchronize_session=False)
+    db_session.add_all([
+        TranscriptMessage(call_id=call_log.id, campaign_id=call_log.campaign_id, position=position,
+                          role=role, message_text=message)
+        for position, role, message in transcript_messages(call_log.transcription)
+    ])
+    call_log.transcript_indexed_at = datetime.now()
+    indexed_calls.inc()
+
+
+def _ensure_sqlite_fts(connection):
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    ), {"name": FTS_TABLE}).first()
+
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"message_text, content='transcript_messages', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2')"
+    ))
+    # Keep the external-content index in step with transcript_messages
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS transcript_messages_ai AFTER INSERT ON transcript_messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, message_text) VALUES (new.id, new.message_text); END"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS transcript_messages_ad AFTER DELETE ON transcript_messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_text) VALUES ('delete', old.id, old.message_text); END"
+    ))
+    connection.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS transcript_messages_au AFTER UPDATE ON transcript_messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message_text) VALUES ('delete', old.id, old.message_text); "
+        f"INSERT INTO {FTS_TABLE}(rowid, message_text) VALUES (new.id, new.message_text); END"
+    ))
+    if not exists:
+        # Pick up any rows written before the index existed
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def _ensure_mssql_fulltext(connection):
+    if not connection.execute(text("SELECT FULLTEXTSERVICEPROPERTY('IsFullTextInstalled')")).scalar():
+        raise RuntimeError("Full-text search is not installed on this server")
+
+    connection.execute(text(
+        f"IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{FULLTEXT_KEY_INDEX}' "
+        f"AND object_id = OBJECT_ID('transcript_messages')) "
+        f"CREATE UNIQUE INDEX {FULLTEXT_KEY_INDEX} ON transcript_messages(id)"
+    ))
+    connection.execute(text(
+        f"IF NOT EXISTS (SELECT 1 FROM sys.fulltext_catalogs WHERE name = '{FULLTEXT_CATALOG}') "
+        f"CREATE FULLTEXT CATALOG {FULLTEXT_CATALOG}"
+    ))
+    # Neutral language: transcripts mix English and Hindi. Change tracking keeps the
+    # index current as rows are written, populating it in the background.
+    connection.execute(text(
+        f"IF NOT EXISTS (SELECT 1 FROM sys.fulltext_indexes WHERE object_id = OBJECT_ID('transcript_messages')) "
+        f"CREATE FULLTEXT INDEX ON transcript_messages(message_text LANGUAGE 0) "
+        f"KEY INDEX {FULLTEXT_KEY_INDEX} ON {FULLTEXT_CATALOG} WITH CHANGE_TRACKING AUTO"
+    ))
+
+
+def ensure_search_index():
+    """
+    Create the full-text index for the current database if it is missing.
+    Returns the backend searches will use: 'fts5', 'fulltext' or, where neither
+    is available, 'like' (a scan, only suitable for small databases).
+    """
+    global _backend
+    with _backend_lock:
+        dialect = engine.dialect.name
+        backend = "like"
+        try:
+            # Full-text DDL cannot run inside a user transaction on SQL Server
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                if dialect == "sqlite":
+                    _ensure_sqlite_fts(connection)
+                    backend = "fts5"
+                elif dialect == "mssql":
+                    _ensure_mssql_fulltext(connection)
+                    backend = "fulltext"
+        except Exception as e:
+            logger.warning(f"Full-text index unavailable on {dialect}, transcript search will scan: {str(e)}")
+
+        _backend = backend
+        logger.info(f"Transcript search backend: {backend}")
+        return backend
+
+
+def search_backend():
+    return _backend or ensure_search_index()
+
+
+def _terms(query):
+    """Words of a user query, stripped of the quotes both query syntaxes use"""
+    return [term for term in (word.replace('"', '') for word in query.split()) if term]
+
+
+def _match_expression(terms, phrase, joiner):
+    if phrase:
+        return '"' + " ".join(terms) + '"'
+    return joiner.join(f'"{term}"' for term in terms)
+
+
+def _snippet(message, terms):
+    """Window of words around the first match, with matched words marked"""
+    words = message.split()
+    lowered = [term.lower() for term in terms]
+
+    def matches(word):
+        word = word.lower()
+        return any(term in word for term in lowered)
+
+    first = next((index for index, word in enumerate(words) if matches(word)), 0)
+    start = max(0, first - SNIPPET_WORDS // 3)
+    window = words[start:start + SNIPPET_WORDS]
+    snippet = " ".join(f"{_MATCH_START}{word}{_MATCH_END}" if matches(word) else word for word in window)
+    if start > 0:
+        snippet = "…" + snippet
+    if start + SNIPPET_WORDS < len(words):
+        snippet += "…"
+    return snippet
+
+
+def _render_snippet(snippet):
+    """HTML-escape a snippet, keeping only our own <mark> tags"""
+    return html.escape(snippet).replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>")
+
+
+def _filters(role, campaign_id, params):
+    clauses = []
+    if role:
+        clauses.append("m.role = :role")
+        params["role"] = role
+    if campaign_id is not None:
+        clauses.append("m.campaign_id = :campaign_id")
+        params["campaign_id"] = campaign_id
+    return "".join(f" AND {clause}" for clause in clauses)
+
+
+def _search_fts5(db_session, terms, phrase, role, campaign_id, limit, offset):
+    params = {"query": _match_expression(terms, phrase, " "), "limit": limit, "offset": offset,
+              "start": _MATCH_START, "end": _MATCH_END, "words": SNIPPET_WORDS}
+    rows = db_session.execute(text(
+        f"SELECT m.id, m.call_id, m.position, m.role, "
+        f"snippet({FTS_TABLE}, 0, :start, :end, '…', :words) AS snippet, bm25({FTS_TABLE}) AS score "
+        f"FROM {FTS_TABLE} JOIN transcript_messages m ON m.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :query{_filters(role, campaign_id, params)} "
+        f"ORDER BY score LIMIT :limit OFFSET :offset"
+    ), params).all()
+    # bm25() is lower-is-better; flip it so every backend ranks higher scores first
+    return [(row.id, row.call_id, row.position, row.role, row.snippet, -row.score) for row in rows]
+
+
+def _search_fulltext(db_session, terms, phrase, role, campaign_id, limit, offset):
+    params = {"query": _match_expression(terms, phrase, " AND "), "limit": limit, "offset": offset}
+    rows = db_session.execute(text(
+        f"SELECT m.id, m.call_id, m.position, m.role, m.message_text, ft.[RANK] AS score "
+        f"FROM CONTAINSTABLE(transcript_messages, message_text, :query) AS ft "
+        f"JOIN transcript_messages m ON m.id = ft.[KEY] "
+        f"WHERE 1 = 1{_filters(role, campaign_id, params)} "
+        f"ORDER BY ft.[RANK] DESC, m.id DESC OFFSET :offset ROWS FETCH NEXT :limit ROWS ONLY"
+    ), params).all()
+    return [(row.id, row.call_id, row.position, row.role, _snippet(row.message_text, terms), row.score)
+            for row in rows]
+
+
+def _search_like(db_session, terms, phrase, role, campaign_id, limit, offset):
+    query = db_session.query(TranscriptMessage)
+    for term in ([" ".join(terms)] if phrase else terms):
+        query = query.filter(TranscriptMessage.message_text.ilike(f"%{term}%"))
+    if role:
+        query = query.filter(TranscriptMessage.role == role)
+    if campaign_id is not None:
+        query = query.filter(TranscriptMessage.campaign_id == campaign_id)
+    rows = query.order_by(TranscriptMessage.id.desc()).offset(offset).limit(limit).all()
+    return [(row.id, row.call_id, row.position, row.role, _snippet(row.message_text, terms), None) for row in rows]
+
+
+_SEARCHES = {"fts5": _search_fts5, "fulltext": _search_fulltext, "like": _search_like}
+
+
+def search_transcripts(db_session, query, phrase=False, role=None, campaign_id=None, limit=20, offset=0):
+    """
+    Ranked transcript messages matching every word of `query` (or the exact
+    phrase), optionally limited to one speaker role and/or campaign.
+    Returns (results, has_more).
+    """
+    terms = _terms(query)
+    if not terms:
+        return [], False
+
+    backend = search_backend()
+    started = time.monotonic()
+    # One extra row tells us whether there is another page
+    rows = _SEARCHES[backend](db_session, terms, phrase, role, campaign_id, limit + 1, offset)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    calls = load_call_logs(db_session, {row[1] for row in rows})
+
+    results = []
+    for message_id, call_id, position, role_name, snippet, score in rows:
+        call = calls.get(call_id)
+        results.append({
+            "message_id": message_id,
+            "call_log_id": call_id,
+            "call_id": call.ultravox_id if call else None,
+            "call_uuid": call.call_uuid if call else None,
+            "campaign_id": call.campaign_id if call else None,
+            "to_number": call.to_number if call else None,
+            "created_at": call.created_at.isoformat() if call and call.created_at else None,
+            "role": role_name,
+            "position": position,
+            "snippet": _render_snippet(snippet),
+            "score": round(float(score), 4) if score is not None else None
+        })
+
+    searches.inc(label=backend)
+    search_latency.observe(time.monotonic() - started)
+    return results, has_more
+
+
+def backfill_transcript_index(batch_size=BACKFILL_BATCH_SIZE, pause=BACKFILL_PAUSE):
+    """
+    Index calls whose transcription was stored before the search index existed,
+    in small batches with a pause in between. Returns the number of calls indexed.
+    """
+    total = 0
+    last_id = 0
+    while True:
+        db_session = get_db_session_with_retry()
+        try:
+            calls = db_session.query(CallLog).filter(
+                CallLog.id > last_id,
+                CallLog.transcription.isnot(None),
+                CallLog.transcript_indexed_at.is_(None)
+            ).order_by(CallLog.id).limit(batch_size).all()
+            if not calls:
+                break
+
+            for call_log in calls:
+                index_transcript(db_session, call_log)
+            db_session.commit()
+            last_id = calls[-1].id
+            total += len(calls)
+        except Exception as e:
+            logger.error(f"Error backfilling transcript index after call {last_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            db_session.rollback()
+            break
+        finally:
+            close_db_session(db_session)
+        time.sleep(pause)
+
+    if total:
+        logger.info(f"Backfilled transcript search index for {total} calls")
+    return total
+
+
+def start_transcript_backfill():
+    """Run backfill_transcript_index in the background"""
+    thread = threading.Thread(target=backfill_transcript_index, name="transcript-index-backfill")
+    thread.daemon = True
+    thread.start()
+    return thread
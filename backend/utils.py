@@ -4,26 +4,30 @@ import logging
 from config import ULTRAVOX_API_BASE_URL, ULTRAVOX_API_KEY
 
 
+# Keep-alive session so answered calls reuse the TLS connection to Ultravox
+_ultravox_session = requests.Session()
+
+
 def get_join_url(ultravox_payload):
     """
     This function calls the Ultravox API using the provided payload.
+    The payload may be a dict or an already serialized JSON string.
     It returns the joinUrl and call ID from the response.
     """
     # Get the logger that was set up in the main modules
     logger = logging.getLogger("plivo_server")
-    logger.info(f"System Prompt:\n {json.dumps(ultravox_payload)}")
-    logger.info(f"Getting joinUrl with payload: {json.dumps(ultravox_payload)}")
 
     api_url = f"{ULTRAVOX_API_BASE_URL}/calls?enableGreetingPrompt=true"
-    payload = json.dumps(ultravox_payload)
+    payload = ultravox_payload if isinstance(ultravox_payload, str) else json.dumps(ultravox_payload)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Getting joinUrl with payload: {payload}")
     headers = {
         'Content-Type': 'application/json',
         'X-API-Key': ULTRAVOX_API_KEY
     }
 
     try:
-        logger.info(f"Sending request to Ultravox API")
-        response = requests.post(api_url, headers=headers, data=payload)
+        response = _ultravox_session.post(api_url, headers=headers, data=payload)
 
         # Accept both 200 and 201 as valid responses (201 means "Created")
         if response.status_code not in [200, 201]:
@@ -35,8 +39,7 @@ def get_join_url(ultravox_payload):
         join_url = data.get("joinUrl")
         call_id = data.get("callId", "unknown")
 
-        logger.info(f"Received joinUrl: {join_url}")
-        logger.info(f"Call ID: {call_id}")
+        logger.info(f"Ultravox call {call_id} created")
 
         if not join_url:
             error_msg = "joinUrl not found in response"
@@ -0,0 +1,314 @@
+import atexit
+import json
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from datetime import datetime
+from models import CallLog
+from database import close_db_session, get_db_session_with_retry
+from config import setup_logging
+import metrics
+
+# Set up logging
+logger = setup_logging("webhook_writer", "webhook_writer.log")
+
+FLUSH_INTERVAL = 0.25  # How often buffered webhook updates are written (seconds)
+MAX_BATCH_SIZE = 200  # Calls written per transaction
+MAX_BUFFERED_CALLS = 10000  # Calls buffered before webhooks block on a flush
+MAX_ATTEMPTS = 3  # Flushes a call's update is retried before it is dropped
+SHUTDOWN_TIMEOUT = 10  # Time allowed to drain the buffer on shutdown (seconds)
+
+# Writer metrics
+buffer_depth = metrics.gauge("webhooks.write_buffer_calls", "Calls with webhook updates waiting to be written")
+coalesced_events = metrics.counter("webhooks.coalesced_events", "Webhook events merged into an already buffered call")
+flushed_calls = metrics.counter("webhooks.flushed_calls", "Calls written by the webhook writer")
+write_failures = metrics.counter("webhooks.write_failures", "Call updates dropped after repeated write failures")
+write_latency = metrics.histogram("webhooks.write_latency_seconds", "Time from first buffered webhook to committed DB write")
+flush_duration = metrics.histogram("webhooks.flush_duration_seconds", "Time to write one batch")
+
+
+class _PendingCall:
+    """All not-yet-written webhook updates for one call UUID"""
+
+    def __init__(self, call_uuid):
+        self.call_uuid = call_uuid
+        self.answer = None
+        self.hangup = None
+        self.first_queued = time.monotonic()
+        self.attempts = 0
+
+    def merge(self, event_type, fields):
+        """Fold an event in; a later event of the same type replaces the earlier one"""
+        if event_type == "answer":
+            self.answer = fields
+        elif event_type == "hangup":
+            self.hangup = fields
+        else:
+            raise ValueError(f"Unknown webhook event type: {event_type}")
+
+
+def _apply_answer(db_session, call_log, call_uuid, event):
+    """Fill in the CallLog for an answered call"""
+    if call_log:
+        call_log.ultravox_id = event["ultravox_id"]
+        if not call_log.to_number:
+            call_log.to_number = event["to_number"]
+        if not call_log.from_number:
+            call_log.from_number = event["from_number"]
+        call_log.system_prompt = event["system_prompt"]
+        call_log.language_hint = event["language_hint"]
+        call_log.voice = event["voice"]
+        call_log.max_duration = event["max_duration"]
+    else:
+        call_log = CallLog(
+            call_uuid=call_uuid,
+            ultravox_id=event["ultravox_id"],
+            to_number=event["to_number"],
+            from_number=event["from_number"],
+            system_prompt=event["system_prompt"],
+            language_hint=event["language_hint"],
+            voice=event["voice"],
+            max_duration=event["max_duration"],
+            initiation_time=event["received_at"]
+        )
+        db_session.add(call_log)
+
+    return call_log
+
+
+def _apply_hangup(db_session, call_log, call_uuid, event):
+    """Record the final state of a call from Plivo's hangup webhook"""
+    plivo_update = {
+        'bill_duration': event["bill_duration"],
+        'total_cost': event["total_cost"],
+        'hangup_data': event["hangup_data"]
+    }
+
+    if call_log:
+        if event["ultravox_id"] and not call_log.ultravox_id:
+            call_log.ultravox_id = event["ultravox_id"]
+
+        call_log.call_state = event["call_state"]
+        call_log.call_duration = event["call_duration"]
+        call_log.hangup_cause = event["hangup_cause"]
+        call_log.end_time = event["received_at"]
+
+        try:
+            plivo_data = json.loads(call_log.plivo_data) if call_log.plivo_data else {}
+        except json.JSONDecodeError:
+            plivo_data = {}
+        plivo_data.update(plivo_update)
+        call_log.plivo_data = json.dumps(plivo_data)
+    else:
+        call_log = CallLog(
+            call_uuid=call_uuid,
+            ultravox_id=event["ultravox_id"],
+            to_number=event["to_number"],
+            from_number=event["from_number"],
+            call_state=event["call_state"],
+            call_duration=event["call_duration"],
+            hangup_cause=event["hangup_cause"],
+            initiation_time=event["received_at"],  # Approximate
+            end_time=event["received_at"],
+            plivo_data=json.dumps(plivo_update)
+        )
+        db_session.add(call_log)
+
+    return call_log
+
+
+class WebhookWriter:
+    """
+    Write-behind buffer for webhook DB updates.
+
+    Updates are coalesced per call UUID (an answer and a hangup for the same call
+    become a single row write) and flushed in batched transactions every
+    FLUSH_INTERVAL. Calls in a batch are loaded with a single query. The
+    buffer is drained on graceful shutdown.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_batch_size=MAX_BATCH_SIZE,
+                 max_buffered=MAX_BUFFERED_CALLS):
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.max_buffered = max_buffered
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.wakeup = threading.Event()
+        self.flush_lock = threading.Lock()  # Serializes flushes between the thread and shutdown
+        self.stopping = False
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name="webhook-writer")
+            self.thread.daemon = True
+            self.thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, event_type, call_uuid, **fields):
+        """Buffer an update for a call; blocks only if the buffer is full"""
+        fields["received_at"] = datetime.now()
+        self.start()
+
+        with self.not_full:
+            while len(self.pending) >= self.max_buffered and call_uuid not in self.pending and not self.stopping:
+                self.wakeup.set()
+                self.not_full.wait(self.flush_interval)
+
+            pending = self.pending.get(call_uuid)
+            if pending is None:
+                pending = _PendingCall(call_uuid)
+                self.pending[call_uuid] = pending
+            else:
+                coalesced_events.inc(label=event_type)
+            pending.merge(event_type, fields)
+            depth = len(self.pending)
+
+        buffer_depth.set(depth)
+        if depth >= self.max_batch_size:
+            self.wakeup.set()
+
+    def _take_batch(self):
+        with self.lock:
+            batch = []
+            while self.pending and len(batch) < self.max_batch_size:
+                batch.append(self.pending.popitem(last=False)[1])
+            self.not_full.notify_all()
+            return batch
+
+    def _requeue(self, batch):
+        """Put failed calls back, without overwriting newer updates that arrived meanwhile"""
+        with self.lock:
+            for pending in batch:
+                pending.attempts += 1
+                if pending.attempts >= MAX_ATTEMPTS:
+                    write_failures.inc()
+                    logger.error(f"Dropping webhook updates for call {pending.call_uuid} after {pending.attempts} attempts")
+                    continue
+                newer = self.pending.get(pending.call_uuid)
+                if newer is None:
+                    self.pending[pending.call_uuid] = pending
+                    self.pending.move_to_end(pending.call_uuid, last=False)
+                else:
+                    newer.answer = newer.answer or pending.answer
+                    newer.hangup = newer.hangup or pending.hangup
+                    newer.first_queued = min(newer.first_queued, pending.first_queued)
+
+    def _write_batch(self, batch):
+        started = time.monotonic()
+        db_session = None
+        try:
+            db_session = get_db_session_with_retry()
+            call_uuids = [pending.call_uuid for pending in batch]
+            call_logs = {log.call_uuid: log for log in
+                         db_session.query(CallLog).filter(CallLog.call_uuid.in_(call_uuids)).all()}
+
+            for pending in batch:
+                call_log = call_logs.get(pending.call_uuid)
+                if pending.answer:
+                    call_log = _apply_answer(db_session, call_log, pending.call_uuid, pending.answer)
+                if pending.hangup:
+                    call_log = _apply_hangup(db_session, call_log, pending.call_uuid, pending.hangup)
+
+            db_session.commit()
+
+            now = time.monotonic()
+            for pending in batch:
+                write_latency.observe(now - pending.first_queued)
+            flushed_calls.inc(len(batch))
+            return True
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(batch)} webhook updates: {str(e)}")
+            logger.error(traceback.format_exc())
+            if db_session:
+                db_session.rollback()
+            return False
+        finally:
+            flush_duration.observe(time.monotonic() - started)
+            if db_session:
+                close_db_session(db_session)
+
+    def flush(self):
+        """Write everything currently buffered. Returns the number of calls written."""
+        written = 0
+        with self.flush_lock:
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+
+                if self._write_batch(batch):
+                    written += len(batch)
+                elif len(batch) > 1:
+                    # Isolate the failing call so it does not hold back the rest
+                    for pending in batch:
+                        if self._write_batch([pending]):
+                            written += 1
+                        else:
+                            self._requeue([pending])
+                    break
+                else:
+                    self._requeue(batch)
+                    break
+
+        with self.lock:
+            buffer_depth.set(len(self.pending))
+        return written
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in webhook writer: {str(e)}")
+                logger.error(traceback.format_exc())
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Stop the flush thread and drain the buffer"""
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval * 4)
+
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            self.flush()
+            if self.pending:
+                time.sleep(self.flush_interval)
+
+        if self.pending:
+            logger.error(f"Shutting down with {len(self.pending)} unwritten webhook updates")
+        else:
+            logger.info("Webhook writer drained")
+
+    def status(self):
+        with self.lock:
+            depth = len(self.pending)
+        return {"buffered_calls": depth, "running": self.thread is not None and self.thread.is_alive()}
+
+
+# Shared writer used by the Plivo webhooks
+webhook_writer = WebhookWriter()
+
+
+def record_answer(call_uuid, ultravox_id, to_number, from_number, system_prompt, language_hint, voice, max_duration):
+    """Buffer the CallLog bookkeeping for an answered call"""
+    webhook_writer.submit("answer", call_uuid, ultravox_id=ultravox_id, to_number=to_number,
+                          from_number=from_number, system_prompt=system_prompt, language_hint=language_hint,
+                          voice=voice, max_duration=max_duration)
+
+
+def record_hangup(call_uuid, ultravox_id, to_number, from_number, call_state, call_duration, hangup_cause,
+                  bill_duration, total_cost, hangup_data):
+    """Buffer the CallLog update for a call that has ended"""
+    webhook_writer.submit("hangup", call_uuid, ultravox_id=ultravox_id, to_number=to_number,
+                          from_number=from_number, call_state=call_state, call_duration=call_duration,
+                          hangup_cause=hangup_cause, bill_duration=bill_duration, total_cost=total_cost,
+                          hangup_data=hangup_data)
@@ -50,6 +50,7 @@ const Analysis = ({callId: ultravoxCallId, callUuid, onClose, serverStatus}) =>
     const [error, setError] = useState(null);
     const [transcription, setTranscription] = useState([]);
     const [recordingUrl, setRecordingUrl] = useState(null);
+    const [recordingSource, setRecordingSource] = useState(null);
     const [recordingError, setRecordingError] = useState(null);
     const [analytics, setAnalytics] = useState(null);
     const [isPlaying, setIsPlaying] = useState(false);
@@ -221,12 +222,16 @@ const Analysis = ({callId: ultravoxCallId, callUuid, onClose, serverStatus}) =>
             if (responseData.status === 'success' && responseData.url) {
                 console.log("ANALYSIS COMPONENT - Successfully retrieved recording URL:", responseData.url);
 
-                // Create proxy URL - encode the original URL
+                // Archived recordings are served by our own stable endpoint; signed
+                // URLs go through the proxy - encode the original URL
                 const originalUrl = responseData.url;
-                const proxyUrl = `${API_BASE_URL}/proxy_audio/${encodeURIComponent(originalUrl)}`;
+                const proxyUrl = responseData.source === 'archive'
+                    ? originalUrl
+                    : `${API_BASE_URL}/proxy_audio/${encodeURIComponent(originalUrl)}?call_id=${encodeURIComponent(ultravoxCallId)}`;
 
                 console.log("ANALYSIS COMPONENT - Using proxy URL:", proxyUrl);
                 setRecordingUrl(proxyUrl);
+                setRecordingSource(responseData.source);
                 setRecordingError(null);
                 setRecordingRetryCount(0); // Reset retry count on success
                 return Promise.resolve(true);
@@ -718,16 +723,24 @@ const Analysis = ({callId: ultravoxCallId, callUuid, onClose, serverStatus}) =>
 
                                                 <div className="p-4 bg-dark-700/30 rounded-lg mb-4">
                                                     <div className="text-center p-3">
-                                                        <audio
-                                                            ref={audioRef}
-                                                            controls
-                                                            className="w-full"
-                                                            src={recordingUrl}
-                                                            preload="auto"
-                                                            onError={handleAudioError}
-                                                        >
-                                                            Your browser does not support the audio element.
-                                                        </audio>
+                                                        {/* Archived recordings have precomputed peaks, so the waveform draws before the audio loads */}
+                                                        {recordingSource === 'archive' ? (
+                                                            <WaveformPlayer
+                                                                audioUrl={recordingUrl}
+                                                                peaksUrl={`${API_BASE_URL}/call_recording/${ultravoxCallId}/peaks`}
+                                                            />
+                                                        ) : (
+                                                            <audio
+                                                                ref={audioRef}
+                                                                controls
+                                                                className="w-full"
+                                                                src={recordingUrl}
+                                                                preload="auto"
+                                                                onError={handleAudioError}
+                                                            >
+                                                                Your browser does not support the audio element.
+                                                            </audio>
+                                                        )}
                                                     </div>
 
                                                     <p className="text-sm text-gray-400 text-center mt-2">
@@ -17,6 +17,7 @@ const CampaignResults = ({
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
     const [campaignStats, setCampaignStats] = useState(null);
+    const [campaignAnalytics, setCampaignAnalytics] = useState(null);
     const [contacts, setContacts] = useState([]);
     const [filteredContacts, setFilteredContacts] = useState([]);
 
@@ -55,68 +56,7 @@ const CampaignResults = ({
         );
 
         if (completedContacts.length > 0) {
-            // Get all call UUIDs from completed contacts
-            const callUuids = completedContacts.map(contact => contact.call_uuid);
-
-            // Use the batch API to get all statuses at once
-            const fetchBatchStatus = async () => {
-                try {
-                    setCheckingAnalysis(true);
-
-                    const response = await fetch(`${API_BASE_URL}/call_analysis_status_batch`, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json'
-                        },
-                        body: JSON.stringify({call_uuids: callUuids})
-                    });
-
-                    if (!response.ok) {
-                        throw new Error(`Error fetching batch analysis status: ${response.status}`);
-                    }
-
-                    const data = await response.json();
-
-                    if (data.status === 'success') {
-                        // Convert the results to our expected format
-                        const newStatuses = {};
-
-                        Object.entries(data.results).forEach(([callUuid, statusData]) => {
-                            newStatuses[callUuid] = {
-                                callUuid,
-                                vtCallId: statusData.ultravox_id,
-                                hasAnalysis: statusData.is_complete,
-                                details: {
-                                    transcript: statusData.has_transcript,
-                                    recording: statusData.has_recording,
-                                    summary: statusData.has_summary
-                                },
-                                lastChecked: statusData.last_checked
-                            };
-                        });
-
-                        // Update our state
-                        setAnalysisStatus(newStatuses);
-
-                        // Calculate and update progress
-                        const completeCount = Object.values(newStatuses).filter(status => status.hasAnalysis).length;
-                        const progress = Math.round((completeCount / completedContacts.length) * 100);
-                        setAnalysisProgress(progress);
-                    } else {
-                        console.error('Error in batch API response:', data.message);
-                        // Fall back to individual checks if batch fails
-                        fetchAnalysisStatus(callUuids);
-                    }
-                } catch (error) {
-                    console.error('Error fetching batch analysis status:', error);
-                    // Fall back to individual checks
-                    fetchAnalysisStatus(callUuids);
-                } finally {
-                    setCheckingAnalysis(false);
-                }
-            };
-
-            fetchBatchStatus();
+            fetchAnalysisStatus(completedContacts.map(contact => contact.call_uuid));
         }
     }, [contacts]);
 
@@ -296,145 +236,62 @@ const CampaignResults = ({
         }
     };
 
-    // Function to fetch analysis status for completed calls
+    // Function to fetch analysis status for completed calls, all in one batch request
     const fetchAnalysisStatus = async (callUuids) => {
         if (!callUuids || callUuids.length === 0) return;
 
         setCheckingAnalysis(true);
 
         try {
-            // Batch the call UUIDs to avoid making too many API calls at once
-            const batchSize = 10;
-            const statuses = {...analysisStatus};
-
-            for (let i = 0; i < callUuids.length; i += batchSize) {
-                const batchUuids = callUuids.slice(i, i + batchSize);
+            const response = await fetch(`${API_BASE_URL}/call_analysis_status_batch`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({call_uuids: callUuids})
+            });
 
-                // Use Promise.all to fetch all statuses in parallel
-                await Promise.all(batchUuids.map(async (callUuid) => {
-                    try {
-                        // Fetch the analysis status from our API endpoint
-                        const response = await fetch(`${API_BASE_URL}/call_analysis_status/${callUuid}`);
+            if (!response.ok) {
+                throw new Error(`Error fetching batch analysis status: ${response.status}`);
+            }
 
-                        if (response.ok) {
-                            const data = await response.json();
+            const data = await response.json();
 
-                            if (data.status === 'success' && data.analysis_status) {
-                                const analysisData = data.analysis_status;
-
-                                // Determine if VT call ID is available and all components are ready
-                                const hasAnalysis = analysisData.is_complete;
-                                const vtCallId = analysisData.ultravox_id;
-
-                                // Store in our state
-                                statuses[callUuid] = {
-                                    callUuid,
-                                    vtCallId,
-                                    hasAnalysis,
-                                    details: {
-                                        transcript: analysisData.has_transcript,
-                                        recording: analysisData.has_recording,
-                                        summary: analysisData.has_summary
-                                    },
-                                    lastChecked: analysisData.last_checked
-                                };
-                            } else {
-                                // If we don't have data, fall back to checking the mapping
-                                await checkAnalysisMappingFallback(callUuid, statuses);
-                            }
-                        } else {
-                            // If the endpoint fails, fall back to checking the mapping
-                            await checkAnalysisMappingFallback(callUuid, statuses);
-                        }
-                    } catch (error) {
-                        console.error(`Error fetching analysis status for call ${callUuid}:`, error);
-                        // Fall back to checking the mapping if our API fails
-                        await checkAnalysisMappingFallback(callUuid, statuses);
-                    }
-                }));
+            if (data.status !== 'success') {
+                throw new Error(data.message || 'Failed to fetch analysis status');
             }
 
-            // Update our state with all the fetched statuses
+            // Convert the results to our expected format
+            const statuses = {};
+
+            Object.entries(data.results).forEach(([callUuid, statusData]) => {
+                statuses[callUuid] = {
+                    callUuid,
+                    vtCallId: statusData.ultravox_id,
+                    hasAnalysis: statusData.is_complete,
+                    details: {
+                        transcript: statusData.has_transcript,
+                        recording: statusData.has_recording,
+                        summary: statusData.has_summary
+                    },
+                    lastChecked: statusData.last_checked
+                };
+            });
+
+            // Update our state
             setAnalysisStatus(statuses);
 
-            // Calculate and update analysis progress
-            const completedCalls = contacts.filter(contact => contact.status === 'completed').length;
-            if (completedCalls > 0) {
-                const completedAnalyses = Object.values(statuses).filter(status => status && status.hasAnalysis).length;
-                const progress = Math.round((completedAnalyses / completedCalls) * 100);
-                setAnalysisProgress(progress);
-            } else {
-                setAnalysisProgress(0);
-            }
+            // Calculate and update progress
+            const completeCount = Object.values(statuses).filter(status => status.hasAnalysis).length;
+            setAnalysisProgress(Math.round((completeCount / callUuids.length) * 100));
         } catch (error) {
+            // Statuses are left as they were; the next refresh tries again
             console.error('Error fetching analysis status:', error);
         } finally {
             setCheckingAnalysis(false);
         }
     };
 
-    // Fallback function to check analysis components directly
-    const checkAnalysisMappingFallback = async (callUuid, statuses) => {
-        try {
-            // Get the VT call ID mapping
-            const mappingResponse = await fetch(`${API_BASE_URL}/call_mapping/${callUuid}`);
-
-            if (!mappingResponse.ok) {
-                statuses[callUuid] = {callUuid, hasAnalysis: false, reason: 'mapping-error'};
-                return;
-            }
-
-            const mappingData = await mappingResponse.json();
-
-            if (mappingData.status !== 'success' || !mappingData.mapping.ultravox_call_id) {
-                statuses[callUuid] = {callUuid, hasAnalysis: false, reason: 'no-mapping'};
-                return;
-            }
-
-            const vtCallId = mappingData.mapping.ultravox_call_id;
-
-            // Check transcription
-            const transcriptResponse = await fetch(`${API_BASE_URL}/call_transcription/${vtCallId}`);
-            const hasTranscript = transcriptResponse.ok;
-
-            // Check recording
-            const recordingResponse = await fetch(`${API_BASE_URL}/call_recording/${vtCallId}`);
-            const hasRecording = recordingResponse.ok;
-
-            // Check analytics (for summary)
-            const analyticsResponse = await fetch(`${API_BASE_URL}/call_analytics/${vtCallId}/${callUuid}`);
-            let hasSummary = false;
-
-            if (analyticsResponse.ok) {
-                const analyticsData = await analyticsResponse.json();
-                hasSummary = analyticsData.status === 'success' &&
-                    analyticsData.analytics &&
-                    analyticsData.analytics.ultravox &&
-                    analyticsData.analytics.ultravox.summary;
-            }
-
-            const allAvailable = hasTranscript && hasRecording && hasSummary;
-
-            statuses[callUuid] = {
-                callUuid,
-                vtCallId,
-                hasAnalysis: allAvailable,
-                details: {
-                    transcript: hasTranscript,
-                    recording: hasRecording,
-                    summary: hasSummary
-                }
-            };
-        } catch (error) {
-            console.error(`Error in analysis mapping fallback for call ${callUuid}:`, error);
-            statuses[callUuid] = {
-                callUuid,
-                hasAnalysis: false,
-                reason: `Error: ${error.message}`
-            };
-        }
-    };
-
     // Main function to check analysis availability
     const checkAnalysisAvailability = async () => {
         try {
@@ -519,6 +376,16 @@ const CampaignResults = ({
             // Log the URLs we're trying to fetch for debugging
             const statsUrl = `${API_BASE_URL}/campaigns/${campaign.campaign_id}/stats`;
             const contactsUrl = `${API_BASE_URL}/campaigns/${campaign.campaign_id}/contacts`;
+            const analyticsUrl = `${API_BASE_URL}/campaigns/${campaign.campaign_id}/analytics`;
+
+            // Sentiment, topics, funnel and durations come precomputed in one request;
+            // start it now and read it after the stats
+            const analyticsRequest = fetchWithRetry(analyticsUrl, {
+                headers: {'Content-Type': 'application/json'}
+            }).catch(analyticsError => {
+                console.error('Error fetching campaign analytics:', analyticsError);
+                return null;
+            });
 
             console.log("Fetching stats from:", statsUrl);
 
@@ -539,6 +406,15 @@ const CampaignResults = ({
                 throw new Error(statsData.message || 'Failed to fetch campaign statistics');
             }
 
+            // The analytics panels are optional; the page still works without them
+            const analyticsResponse = await analyticsRequest;
+            if (analyticsResponse && analyticsResponse.ok) {
+                const analyticsData = await analyticsResponse.json();
+                if (analyticsData.status === 'success') {
+                    setCampaignAnalytics(analyticsData.analytics);
+                }
+            }
+
             console.log("Fetching contacts from:", contactsUrl);
 
             // Use fetchWithRetry for contacts too
@@ -629,43 +505,14 @@ const CampaignResults = ({
         setStatusFilter(e.target.value);
     };
 
-    // Export results to CSV
+    // Export results to CSV; the server streams the file with call outcomes and extracted entities
     const exportToCSV = () => {
         if (!contacts || contacts.length === 0) return;
 
-        // Create CSV header
-        const headers = [
-            'Name',
-            'Phone',
-            'Status',
-            'Call UUID',
-            'Duration',
-            'Timestamp'
-        ];
-
-        // Create CSV rows
-        const rows = contacts.map(contact => [
-            contact.name || '',
-            contact.phone || '',
-            contact.status || '',
-            contact.call_uuid || '',
-            contact.additional_data?.duration || '',
-            contact.updated_at || ''
-        ]);
-
-        // Combine header and rows
-        const csvContent = [
-            headers.join(','),
-            ...rows.map(row => row.join(','))
-        ].join('\n');
-
-        // Create download link
-        const blob = new Blob([csvContent], {type: 'text/csv;charset=utf-8;'});
-        const url = URL.createObjectURL(blob);
         const link = document.createElement('a');
 
         // Set link attributes and trigger download
-        link.setAttribute('href', url);
+        link.setAttribute('href', `${API_BASE_URL}/campaigns/${campaign.campaign_id}/export.csv`);
         link.setAttribute('download', `${campaign.campaign_name}_results.csv`);
         link.style.visibility = 'hidden';
         document.body.appendChild(link);
@@ -1051,7 +898,7 @@ const CampaignResults = ({
                                 <div className="bg-dark-800/50 p-4 rounded-lg">
                                     <div className="text-sm text-gray-400 mb-1">Avg. Call Duration</div>
                                     <div
-                                        className="text-2xl font-bold text-white">{campaignStats.average_call_duration || 0}s
+                                        className="text-2xl font-bold text-white">{campaignAnalytics?.duration?.avg ?? campaignStats.average_call_duration ?? 0}s
                                     </div>
                                 </div>
                             </div>
@@ -1180,6 +1027,142 @@ const CampaignResults = ({
                         </div>
                     </div>
 
+                    {/* Call Analytics - precomputed campaign rollup */}
+                    {campaignAnalytics && (
+                        <div className="grid grid-cols-1 md:grid-cols-2 gap-6 mb-6">
+                            {/* Sentiment */}
+                            <div
+                                className="bg-dark-700/30 p-5 rounded-lg border border-dark-600 hover:border-primary-500/30 transition-colors shadow-md">
+                                <h4 className="font-medium text-white mb-4 flex items-center">
+                                    <div
+                                        className="w-8 h-8 rounded-full bg-green-900/30 border border-green-500/20 flex items-center justify-center mr-3">
+                                        <MessageSquare size={16} className="text-green-400"/>
+                                    </div>
+                                    Sentiment
+                                    <span className="ml-auto text-xs text-gray-400">
+                                        {campaignAnalytics.analyzed_calls} analyzed calls
+                                    </span>
+                                </h4>
+
+                                <div className="space-y-3">
+                                    {Object.entries(campaignAnalytics.sentiment.counts).map(([name, calls]) => (
+                                        <div key={name}>
+                                            <div className="flex justify-between text-sm mb-1">
+                                                <span className="text-gray-400 capitalize">{name}</span>
+                                                <span className="text-white">
+                                                    {calls} ({campaignAnalytics.sentiment.percentages[name] || 0}%)
+                                                </span>
+                                            </div>
+                                            <div className="w-full bg-dark-600 rounded-full h-2">
+                                                <div
+                                                    className="bg-gradient-to-r from-primary-600 to-primary-400 h-2 rounded-full"
+                                                    style={{width: `${campaignAnalytics.sentiment.percentages[name] || 0}%`}}
+                                                ></div>
+                                            </div>
+                                        </div>
+                                    ))}
+                                </div>
+                            </div>
+
+                            {/* Top Topics */}
+                            <div
+                                className="bg-dark-700/30 p-5 rounded-lg border border-dark-600 hover:border-primary-500/30 transition-colors shadow-md">
+                                <h4 className="font-medium text-white mb-4 flex items-center">
+                                    <div
+                                        className="w-8 h-8 rounded-full bg-accent-900/30 border border-accent-500/20 flex items-center justify-center mr-3">
+                                        <FileText size={16} className="text-accent-400"/>
+                                    </div>
+                                    Top Topics
+                                </h4>
+
+                                {campaignAnalytics.top_topics.length > 0 ? (
+                                    <div className="space-y-2">
+                                        {campaignAnalytics.top_topics.map(({topic, calls}) => (
+                                            <div key={topic} className="flex justify-between items-center">
+                                                <span className="text-gray-300 capitalize truncate mr-2">{topic}</span>
+                                                <Badge variant="info" pill>{calls}</Badge>
+                                            </div>
+                                        ))}
+                                    </div>
+                                ) : (
+                                    <p className="text-gray-500 text-sm">No topics extracted yet</p>
+                                )}
+                            </div>
+
+                            {/* Outcome Funnel */}
+                            <div
+                                className="bg-dark-700/30 p-5 rounded-lg border border-dark-600 hover:border-primary-500/30 transition-colors shadow-md">
+                                <h4 className="font-medium text-white mb-4 flex items-center">
+                                    <div
+                                        className="w-8 h-8 rounded-full bg-blue-900/30 border border-blue-500/20 flex items-center justify-center mr-3">
+                                        <Filter size={16} className="text-blue-400"/>
+                                    </div>
+                                    Outcome Funnel
+                                </h4>
+
+                                <div className="space-y-3">
+                                    {[
+                                        ['Contacts', campaignAnalytics.funnel.contacts],
+                                        ['Dialed', campaignAnalytics.funnel.dialed],
+                                        ['Connected', campaignAnalytics.funnel.connected],
+                                        ['Analyzed', campaignAnalytics.funnel.analyzed],
+                                        ['Positive', campaignAnalytics.funnel.positive]
+                                    ].map(([label, value]) => {
+                                        const total = campaignAnalytics.funnel.contacts;
+                                        const percentage = total ? Math.round((value / total) * 100) : 0;
+                                        return (
+                                            <div key={label}>
+                                                <div className="flex justify-between text-sm mb-1">
+                                                    <span className="text-gray-400">{label}</span>
+                                                    <span className="text-white">{value} ({percentage}%)</span>
+                                                </div>
+                                                <div className="w-full bg-dark-600 rounded-full h-2">
+                                                    <div
+                                                        className="bg-gradient-to-r from-blue-600 to-blue-400 h-2 rounded-full"
+                                                        style={{width: `${percentage}%`}}
+                                                    ></div>
+                                                </div>
+                                            </div>
+                                        );
+                                    })}
+                                </div>
+                            </div>
+
+                            {/* Call Duration */}
+                            <div
+                                className="bg-dark-700/30 p-5 rounded-lg border border-dark-600 hover:border-primary-500/30 transition-colors shadow-md">
+                                <h4 className="font-medium text-white mb-4 flex items-center">
+                                    <div
+                                        className="w-8 h-8 rounded-full bg-yellow-900/30 border border-yellow-500/20 flex items-center justify-center mr-3">
+                                        <Clock size={16} className="text-yellow-400"/>
+                                    </div>
+                                    Call Duration
+                                    <span className="ml-auto text-xs text-gray-400">
+                                        {campaignAnalytics.duration.calls} calls
+                                    </span>
+                                </h4>
+
+                                <div className="grid grid-cols-3 gap-4">
+                                    {[
+                                        ['Average', campaignAnalytics.duration.avg],
+                                        ['Median', campaignAnalytics.duration.percentiles.p50],
+                                        ['90th pct.', campaignAnalytics.duration.percentiles.p90],
+                                        ['95th pct.', campaignAnalytics.duration.percentiles.p95],
+                                        ['Shortest', campaignAnalytics.duration.min],
+                                        ['Longest', campaignAnalytics.duration.max]
+                                    ].map(([label, seconds]) => (
+                                        <div key={label} className="bg-dark-800/50 p-3 rounded-lg">
+                                            <div className="text-xs text-gray-400 mb-1">{label}</div>
+                                            <div className="text-lg font-bold text-white">
+                                                {seconds !== null && seconds !== undefined ? `${seconds}s` : '-'}
+                                            </div>
+                                        </div>
+                                    ))}
+                                </div>
+                            </div>
+                        </div>
+                    )}
+
                     {/* Contact Results */}
                     <div className="bg-dark-700/30 p-6 rounded-lg border border-dark-600">
                         <div className="flex justify-between items-center mb-6">
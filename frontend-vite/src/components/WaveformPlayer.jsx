@@ -1,7 +1,51 @@
 import React, {useEffect, useRef, useState} from 'react';
 import {Play, Pause, Download, Volume2, VolumeX} from 'lucide-react';
 
-const WaveformPlayer = ({audioUrl}) => {
+// Binary peaks from /api/call_recording/<id>/peaks?format=binary: a 16 byte header
+// (magic, sample rate, bins, duration) followed by interleaved int8 min/max pairs
+const PEAKS_HEADER_SIZE = 16;
+
+const parsePeaks = (arrayBuffer) => {
+    const view = new DataView(arrayBuffer);
+    const magic = String.fromCharCode(...new Uint8Array(arrayBuffer, 0, 4));
+    if (magic !== 'WPK1') {
+        throw new Error(`Unknown peaks format: ${magic}`);
+    }
+    const bins = view.getUint32(8, true);
+    const duration = view.getFloat32(12, true);
+    const data = new Int8Array(arrayBuffer, PEAKS_HEADER_SIZE, bins * 2);
+
+    const min = new Float32Array(bins);
+    const max = new Float32Array(bins);
+    for (let i = 0; i < bins; i++) {
+        min[i] = data[i * 2] / 127;
+        max[i] = data[i * 2 + 1] / 127;
+    }
+    return {min, max, duration};
+};
+
+// Min/max pairs from a decoded AudioBuffer, for recordings without precomputed peaks
+const peaksFromBuffer = (buffer, bins) => {
+    const channelData = buffer.getChannelData(0);
+    const step = Math.ceil(channelData.length / bins);
+    const min = new Float32Array(bins);
+    const max = new Float32Array(bins);
+
+    for (let i = 0; i < bins; i++) {
+        let lo = 1.0;
+        let hi = -1.0;
+        for (let j = i * step; j < Math.min((i + 1) * step, channelData.length); j++) {
+            const datum = channelData[j];
+            if (datum < lo) lo = datum;
+            if (datum > hi) hi = datum;
+        }
+        min[i] = lo;
+        max[i] = hi;
+    }
+    return {min, max, duration: buffer.duration};
+};
+
+const WaveformPlayer = ({audioUrl, peaksUrl}) => {
     const canvasRef = useRef(null);
     const audioRef = useRef(null);
     const animationRef = useRef(null);
@@ -10,64 +54,88 @@ const WaveformPlayer = ({audioUrl}) => {
     const [currentTime, setCurrentTime] = useState(0);
     const [volume, setVolume] = useState(1);
     const [isMuted, setIsMuted] = useState(false);
-    const [audioContext, setAudioContext] = useState(null);
-    const [audioBuffer, setAudioBuffer] = useState(null);
+    const [peaks, setPeaks] = useState(null);
     const [isLoading, setIsLoading] = useState(true);
     const [error, setError] = useState(null);
 
-    // Initialize audio context and load audio data
+    // Load waveform data: precomputed peaks when available, otherwise decode the audio
     useEffect(() => {
         if (!audioUrl) return;
 
-        // Create audio context
-        const AudioContext = window.AudioContext || window.webkitAudioContext;
-        const context = new AudioContext();
-        setAudioContext(context);
+        let cancelled = false;
+        let context = null;
+
+        const fetchPeaks = async () => {
+            const response = await fetch(peaksUrl + (peaksUrl.includes('?') ? '&' : '?') + 'format=binary');
+            if (!response.ok) {
+                throw new Error(`Failed to fetch peaks: ${response.status} ${response.statusText}`);
+            }
+            return parsePeaks(await response.arrayBuffer());
+        };
 
         // Fetch and decode audio data with enhanced error handling
-        const fetchData = async () => {
-            try {
-                setIsLoading(true);
-                setError(null);
-
-                console.log("Fetching audio from:", audioUrl); // Debug log
-
-                const response = await fetch(audioUrl, {
-                    method: 'GET',
-                    headers: {
-                        'Accept': 'audio/*',
-                    },
-                    // Add credentials if needed for cross-origin requests
-                    credentials: 'include',
-                    // Add mode for CORS
-                    mode: 'cors',
-                });
-
-                if (!response.ok) {
-                    console.error("Audio fetch response error:", response.status, response.statusText);
-                    throw new Error(`Failed to fetch audio: ${response.status} ${response.statusText}`);
-                }
+        const decodeAudio = async () => {
+            console.log("Fetching audio from:", audioUrl); // Debug log
+
+            const response = await fetch(audioUrl, {
+                method: 'GET',
+                headers: {
+                    'Accept': 'audio/*',
+                },
+                // Add credentials if needed for cross-origin requests
+                credentials: 'include',
+                // Add mode for CORS
+                mode: 'cors',
+            });
 
-                const arrayBuffer = await response.arrayBuffer();
+            if (!response.ok) {
+                console.error("Audio fetch response error:", response.status, response.statusText);
+                throw new Error(`Failed to fetch audio: ${response.status} ${response.statusText}`);
+            }
 
-                // Check if arrayBuffer is valid
-                if (!arrayBuffer || arrayBuffer.byteLength === 0) {
-                    throw new Error("Received empty audio data");
-                }
+            const arrayBuffer = await response.arrayBuffer();
+
+            // Check if arrayBuffer is valid
+            if (!arrayBuffer || arrayBuffer.byteLength === 0) {
+                throw new Error("Received empty audio data");
+            }
+
+            console.log("Audio data received, size:", arrayBuffer.byteLength); // Debug log
+
+            const AudioContext = window.AudioContext || window.webkitAudioContext;
+            context = new AudioContext();
+            try {
+                const decodedData = await context.decodeAudioData(arrayBuffer);
+                return peaksFromBuffer(decodedData, canvasRef.current ? canvasRef.current.width : 600);
+            } catch (decodeError) {
+                console.error("Audio decoding error:", decodeError);
+                throw new Error(`Failed to decode audio: ${decodeError.message}`);
+            }
+        };
 
-                console.log("Audio data received, size:", arrayBuffer.byteLength); // Debug log
+        const fetchData = async () => {
+            setIsLoading(true);
+            setError(null);
 
+            let waveform = null;
+            if (peaksUrl) {
                 try {
-                    const decodedData = await context.decodeAudioData(arrayBuffer);
-                    setAudioBuffer(decodedData);
-                    setDuration(decodedData.duration);
-                    drawWaveform(decodedData);
-                    setIsLoading(false);
-                } catch (decodeError) {
-                    console.error("Audio decoding error:", decodeError);
-                    throw new Error(`Failed to decode audio: ${decodeError.message}`);
+                    waveform = await fetchPeaks();
+                } catch (err) {
+                    console.warn('Precomputed peaks unavailable, decoding audio instead:', err);
                 }
+            }
+
+            try {
+                if (!waveform) {
+                    waveform = await decodeAudio();
+                }
+                if (cancelled) return;
+                setPeaks(waveform);
+                setDuration(waveform.duration);
+                setIsLoading(false);
             } catch (err) {
+                if (cancelled) return;
                 console.error('Error loading audio:', err);
                 setError(err.message || "Failed to load audio");
                 setIsLoading(false);
@@ -82,15 +150,23 @@ const WaveformPlayer = ({audioUrl}) => {
         fetchData();
 
         return () => {
+            cancelled = true;
             if (context && context.state !== 'closed') {
                 context.close();
             }
         };
-    }, [audioUrl]);
+    }, [audioUrl, peaksUrl]);
+
+    // Draw the waveform once the canvas is on screen
+    useEffect(() => {
+        if (!isLoading && peaks) {
+            drawWaveform(peaks);
+        }
+    }, [peaks, isLoading]);
 
     // Draw the waveform visualization
-    const drawWaveform = (buffer) => {
-        if (!canvasRef.current || !buffer) return;
+    const drawWaveform = ({min, max}) => {
+        if (!canvasRef.current) return;
 
         const canvas = canvasRef.current;
         const ctx = canvas.getContext('2d');
@@ -102,9 +178,8 @@ const WaveformPlayer = ({audioUrl}) => {
         // Clear canvas
         ctx.clearRect(0, 0, width, height);
 
-        // Get channel data
-        const channelData = buffer.getChannelData(0);
-        const step = Math.ceil(channelData.length / width);
+        // Each pixel column covers one or more peak bins
+        const binsPerPixel = min.length / width;
 
         // Set styling
         ctx.lineWidth = 2;
@@ -113,20 +188,21 @@ const WaveformPlayer = ({audioUrl}) => {
 
         // Draw waveform
         for (let i = 0; i < width; i++) {
-            const dataIndex = Math.floor(i * step);
-            let min = 1.0;
-            let max = -1.0;
+            const first = Math.floor(i * binsPerPixel);
+            const last = Math.max(first + 1, Math.floor((i + 1) * binsPerPixel));
+            let lo = 1.0;
+            let hi = -1.0;
 
             // Find min and max in this segment
-            for (let j = 0; j < step; j++) {
-                const datum = channelData[dataIndex + j];
-                if (datum < min) min = datum;
-                if (datum > max) max = datum;
+            for (let j = first; j < Math.min(last, min.length); j++) {
+                if (min[j] < lo) lo = min[j];
+                if (max[j] > hi) hi = max[j];
             }
+            if (hi < lo) continue;
 
             // Draw line from min to max
-            const y1 = (1 + min) * height / 2;
-            const y2 = (1 + max) * height / 2;
+            const y1 = (1 + lo) * height / 2;
+            const y2 = (1 + hi) * height / 2;
             ctx.moveTo(i, y1);
             ctx.lineTo(i, y2);
         }
@@ -285,7 +361,7 @@ const WaveformPlayer = ({audioUrl}) => {
                     </div>
 
                     {/* Hidden audio element */}
-                    <audio ref={audioRef} src={audioUrl} preload="auto"></audio>
+                    <audio ref={audioRef} src={audioUrl} preload={peaksUrl ? "metadata" : "auto"}></audio>
                 </>
             )}
         </div>